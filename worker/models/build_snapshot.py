@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Build a single-file snapshot of the assembled InstantID pipeline and
+upload it to the GCS model bucket.
+
+The snapshot (manifest.json + weights.safetensors + tokenizers) lets the
+worker restore the whole engine with one sequential read instead of
+resolving every component and rebuilding the IP-Adapter attention layers.
+
+Run inside the worker image (needs a GPU and the GCS models mount):
+    python models/build_snapshot.py --output /tmp/snapshots/instantid
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import storage
+
+# Make `src` importable when run as a script from worker/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import settings
+from src.loading import HostMemoryBudget, LoadTimeline
+from src.model_manager import ModelManager
+from src.snapshot import MANIFEST_NAME, save_snapshot
+from download_models import write_manifest
+
+# Configuration
+BUCKET_NAME = "jhakaas-models-jhakaas-dev"
+GCS_PREFIX = "snapshots/instantid"
+
+
+def upload_snapshot(local_dir, bucket_name, gcs_prefix):
+    """Upload the snapshot directory, writing the manifest last so readers never see a partial snapshot"""
+    bucket = storage.Client().bucket(bucket_name)
+
+    files = []
+    for root, dirs, filenames in os.walk(local_dir):
+        for filename in filenames:
+            files.append(os.path.join(root, filename))
+    files.sort(key=lambda path: os.path.basename(path) == MANIFEST_NAME)
+
+    for file_path in files:
+        relative_path = os.path.relpath(file_path, local_dir)
+        gcs_path = f"{gcs_prefix}/{relative_path}"
+        size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        print(f"📤 Uploading {relative_path} ({size_mb:.1f}MB) to gs://{bucket_name}/{gcs_path}")
+        bucket.blob(gcs_path).upload_from_filename(file_path)
+
+    print(f"✓ Snapshot uploaded to gs://{bucket_name}/{gcs_prefix}/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build InstantID pipeline snapshot")
+    parser.add_argument("--output", default="/tmp/snapshots/instantid", help="Local output directory")
+    parser.add_argument("--bucket", default=BUCKET_NAME, help="GCS bucket to upload to")
+    parser.add_argument("--no-upload", action="store_true", help="Only write the snapshot locally")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("📸 InstantID Snapshot Builder")
+    print("="*60)
+
+    manager = ModelManager(args.bucket)
+    budget = HostMemoryBudget(settings.load_host_memory_budget_mb * 1024 * 1024)
+
+    # Always assemble from the individual components, never from an older snapshot
+    with ThreadPoolExecutor(max_workers=settings.model_load_workers) as pool:
+        pipe = manager.build_instantid_pipeline(
+            pool, LoadTimeline(), budget, use_snapshot=False
+        )
+
+    manifest = save_snapshot(pipe, args.output)
+    print(f"✓ Snapshot written to {args.output} "
+          f"({manifest['num_tensors']} tensors, {manifest['weights_bytes'] / 1024**3:.2f}GB)")
+
+    if not args.no_upload:
+        upload_snapshot(args.output, args.bucket, GCS_PREFIX)
+        # The worker only sees the snapshot once the bucket manifest lists it
+        write_manifest(args.bucket)
+
+
+if __name__ == "__main__":
+    main()
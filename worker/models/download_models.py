@@ -6,14 +6,22 @@ and upload them to GCS bucket.
 This script runs in Cloud Build (no Docker needed).
 """
 
+import base64
+import json
 import os
 import sys
+from datetime import datetime
 from huggingface_hub import hf_hub_download, snapshot_download
 from google.cloud import storage
 
 # Configuration
 BUCKET_NAME = "jhakaas-models-jhakaas-dev"
 PROJECT_ID = "jhakaas-dev"
+MANIFEST_PATH = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Top-level prefixes whose subdirectories are independent components
+GROUPED_PREFIXES = ("style_loras", "snapshots")
 
 # Cache the storage client and bucket
 _storage_client = None
@@ -96,6 +104,43 @@ def download_instantid():
 
     return True
 
+def convert_instantid_adapter():
+    """Convert the pickled InstantID ip-adapter.bin to safetensors once.
+
+    The worker then loads both halves of the adapter (image projection and
+    IP attention layers) in one memory-mapped pass instead of unpickling the
+    .bin twice. Tensors are stored as `image_proj.<name>` / `ip_adapter.<name>`
+    in their original dtype.
+    """
+    print("\n" + "="*60)
+    print("🔁 Checking InstantID adapter (safetensors)")
+    print("="*60)
+
+    gcs_path = "instantid/ip-adapter.safetensors"
+    if check_gcs_exists(gcs_path):
+        return True
+
+    try:
+        # Only this step needs torch (to unpickle the .bin)
+        import torch
+        from safetensors.torch import save_file
+
+        local_path = hf_hub_download(repo_id="InstantX/InstantID", filename="ip-adapter.bin", cache_dir="./cache")
+        state_dict = torch.load(local_path, map_location="cpu")
+        tensors = {
+            f"{group}.{name}": tensor.contiguous()
+            for group in ("image_proj", "ip_adapter")
+            for name, tensor in state_dict[group].items()
+        }
+        output_path = os.path.join("./cache", "ip-adapter.safetensors")
+        save_file(tensors, output_path, metadata={"format": "pt", "source": "InstantX/InstantID/ip-adapter.bin"})
+        print(f"✓ Converted {len(tensors)} tensors")
+        upload_to_gcs(output_path, gcs_path)
+        return True
+    except Exception as e:
+        print(f"⚠️  Failed to convert InstantID adapter: {e}")
+        return False
+
 def download_antelopev2():
     """Download InsightFace AntelopeV2 face analysis model"""
     print("\n" + "="*60)
@@ -344,6 +389,75 @@ def download_ip_adapter_models():
         print(f"⚠️  Failed to download ControlNet Canny: {e}")
         return False
 
+def download_lcm_lora():
+    """Download the LCM-LoRA step-distillation adapter (fast quality tier)"""
+    print("\n" + "="*60)
+    print("📥 Checking LCM-LoRA (Fast Tier)")
+    print("="*60)
+
+    if check_gcs_directory_exists("lcm-lora-sdxl/"):
+        print("✓ LCM-LoRA already in GCS, skipping download")
+        return True
+
+    print("📥 Downloading latent-consistency/lcm-lora-sdxl...")
+    try:
+        local_path = hf_hub_download(
+            repo_id="latent-consistency/lcm-lora-sdxl",
+            filename="pytorch_lora_weights.safetensors",
+            cache_dir="./cache"
+        )
+        upload_to_gcs(local_path, "lcm-lora-sdxl/pytorch_lora_weights.safetensors")
+        return True
+    except Exception as e:
+        print(f"⚠️  Failed to download LCM-LoRA: {e}")
+        return False
+
+def component_key(blob_name):
+    """Split a blob name into (manifest key, path within the component)"""
+    parts = blob_name.split("/")
+    depth = 2 if parts[0] in GROUPED_PREFIXES else 1
+    return "/".join(parts[:depth]), "/".join(parts[depth:])
+
+def write_manifest(bucket_name=BUCKET_NAME):
+    """Write manifest.json listing every model file with its size and MD5.
+
+    The worker resolves components by manifest key and verifies staged
+    files against it, so this must run after any upload to the bucket.
+    """
+    print("\n" + "="*60)
+    print("📝 Writing Model Manifest")
+    print("="*60)
+
+    bucket = storage.Client(project=PROJECT_ID).bucket(bucket_name)
+    components = {}
+    for blob in bucket.list_blobs():
+        if blob.name == MANIFEST_PATH or blob.name.endswith("/"):
+            continue
+        key, relative_path = component_key(blob.name)
+        if not relative_path:
+            continue
+        # Composite uploads have no MD5; the worker then checks size only
+        md5 = base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None
+        components.setdefault(key, {"files": {}})["files"][relative_path] = {
+            "size": blob.size,
+            "md5": md5,
+        }
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "bucket": bucket_name,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "components": components,
+    }
+    bucket.blob(MANIFEST_PATH).upload_from_string(
+        json.dumps(manifest, indent=2, sort_keys=True),
+        content_type="application/json"
+    )
+
+    total_files = sum(len(c["files"]) for c in components.values())
+    print(f"✓ Manifest written: {len(components)} components, {total_files} files")
+    return manifest
+
 def main():
     print("\n" + "="*60)
     print("🚀 Model Cache Builder")
@@ -370,6 +484,10 @@ def main():
         success = False
         print("\n❌ Failed to download InstantID models")
 
+    # 3b. InstantID adapter as safetensors (the worker falls back to the .bin without it)
+    if not convert_instantid_adapter():
+        print("\n⚠️  InstantID adapter conversion failed; workers will load ip-adapter.bin.")
+
     # 4. Face Analysis (InsightFace - Required for InstantID only)
     if not download_antelopev2():
         success = False
@@ -385,6 +503,13 @@ def main():
         # LoRAs are optional, so we don't set success = False for this
         print("\n⚠️  Some Style LoRAs failed to download, but continuing.")
 
+    # 7. LCM-LoRA ("fast" tier only; the other tiers work without it)
+    if not download_lcm_lora():
+        print("\n⚠️  LCM-LoRA failed to download; the 'fast' tier will be unavailable.")
+
+    # 8. Manifest (the worker resolves every component through it)
+    write_manifest()
+
     print("\n" + "="*60)
     if success:
         print("✅ Model cache build complete!")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Quantize UNet and ControlNet weights to int8 once, offline, and upload
+them to the GCS model bucket as a weight variant.
+
+Each component gets a `diffusion_pytorch_model.int8.safetensors` next to
+its fp16 weights: Linear/Conv2d weights as int8 plus one fp16 scale per
+output channel (see src/quantization.py). Workers started with
+ENABLE_INT8_WEIGHTS=true load these instead of the fp16 files.
+
+Run inside the worker image (GCS models mount; a GPU is not needed):
+    python models/quantize_models.py --output /tmp/quantized
+"""
+
+import argparse
+import os
+import sys
+
+import torch
+from diffusers import ControlNetModel, UNet2DConditionModel
+from google.cloud import storage
+from safetensors.torch import save_file
+
+# Make `src` importable when run as a script from worker/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.loading import find_weight_file, instantiate_empty, stream_safetensors, weight_stem
+from src.model_store import create_model_store
+from src.quantization import QUANTIZED_VARIANT, SCALE_SUFFIX, quantizable_layers, quantize_weight
+from download_models import write_manifest
+
+# Configuration
+BUCKET_NAME = "jhakaas-models-jhakaas-dev"
+
+# (manifest key, subdir, model class, source variant)
+COMPONENTS = [
+    ("sdxl-base", "unet", UNet2DConditionModel, "fp16"),
+    ("instantid", "ControlNetModel", ControlNetModel, None),
+    ("controlnet-canny", "", ControlNetModel, "fp16"),
+]
+
+
+def quantized_path(key, subdir, model_cls):
+    """Path of a component's int8 variant within the bucket"""
+    filename = f"{weight_stem(model_cls)}.{QUANTIZED_VARIANT}.safetensors"
+    return "/".join(part for part in (key, subdir, filename) if part)
+
+
+def quantize_component(store, key, subdir, model_cls, variant, local_path):
+    """Write the int8 variant of one component to local_path"""
+    stem = weight_stem(model_cls)
+    model_dir = store.path(key, subdir, weight_name=stem, variant=variant)
+    source = find_weight_file(model_dir, stem, variant)
+
+    # The module layout (on the meta device) decides which tensors are Linear/Conv2d weights
+    layers = set(quantizable_layers(instantiate_empty(model_cls, model_dir)))
+
+    tensors = {}
+    source_bytes = 0
+    for name, tensor in stream_safetensors(source, "cpu"):
+        source_bytes += tensor.numel() * tensor.element_size()
+        layer = name[:-len(".weight")] if name.endswith(".weight") else None
+        if layer in layers:
+            tensors[name], tensors[layer + SCALE_SUFFIX] = quantize_weight(tensor)
+        elif tensor.is_floating_point():
+            tensors[name] = tensor.to(torch.float16).contiguous()
+        else:
+            tensors[name] = tensor.clone()
+
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    save_file(tensors, local_path, metadata={"format": "pt", "quantization": "int8-weight-only-per-channel"})
+
+    quantized_bytes = os.path.getsize(local_path)
+    print(f"✓ {key}/{subdir}: {len(layers)} layers int8, "
+          f"{source_bytes / 1024**3:.2f}GB → {quantized_bytes / 1024**3:.2f}GB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize UNet/ControlNet weights to int8")
+    parser.add_argument("--output", default="/tmp/quantized", help="Local output directory")
+    parser.add_argument("--bucket", default=BUCKET_NAME, help="GCS bucket to upload to")
+    parser.add_argument("--no-upload", action="store_true", help="Only write the int8 files locally")
+    parser.add_argument("--force", action="store_true", help="Re-upload variants that already exist")
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("🔢 Int8 Weight Quantizer")
+    print("="*60)
+
+    store = create_model_store()
+    bucket = None if args.no_upload else storage.Client().bucket(args.bucket)
+
+    for key, subdir, model_cls, variant in COMPONENTS:
+        if not store.has(key, subdir):
+            print(f"⚠️  {key}/{subdir} not in model manifest, skipping")
+            continue
+
+        gcs_path = quantized_path(key, subdir, model_cls)
+        blob = bucket.blob(gcs_path) if bucket is not None else None
+        if blob is not None and blob.exists() and not args.force:
+            print(f"⏭️  Already quantized: gs://{args.bucket}/{gcs_path}")
+            continue
+
+        local_path = os.path.join(args.output, gcs_path)
+        quantize_component(store, key, subdir, model_cls, variant, local_path)
+        if blob is not None:
+            print(f"📤 Uploading to gs://{args.bucket}/{gcs_path}")
+            blob.upload_from_filename(local_path)
+
+    if bucket is not None:
+        # Workers only see the int8 variants once the bucket manifest lists them
+        write_manifest(args.bucket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+SDXL resolution buckets for Jhakaas Worker.
+
+Instead of squashing every input to 1024x1024, the input is cropped to the
+nearest-aspect bucket of the requested output size and generated at that
+resolution. All buckets are multiples of 64 and close to the pixel area
+SDXL was trained at for that size, so:
+- non-square photos keep their proportions
+- "preview" requests pay for ~0.6MP (96x96-ish latents) instead of 1MP
+"""
+
+import math
+from typing import List, Literal, Tuple
+
+from PIL import Image, ImageOps
+
+from src.compiled import compile_buckets, parse_resolution
+from src.config import settings
+
+OutputSize = Literal["preview", "full"]
+
+# (width, height); portrait and landscape variants of each aspect ratio
+RESOLUTION_BUCKETS = {
+    "preview": [
+        (768, 768),
+        (640, 896), (896, 640),
+        (576, 1024), (1024, 576),
+    ],
+    "full": [
+        (1024, 1024),
+        (896, 1152), (1152, 896),
+        (832, 1216), (1216, 832),
+        (768, 1344), (1344, 768),
+    ],
+}
+
+
+def select_bucket(width: int, height: int, output_size: str = "full") -> Tuple[int, int]:
+    """
+    Pick the bucket whose aspect ratio is closest to width/height.
+
+    Raises:
+        ValueError: If output_size is not a known size tier
+    """
+    if output_size not in RESOLUTION_BUCKETS:
+        raise ValueError(f"Unknown output size: {output_size}")
+
+    # Compare in log space so 2:3 and 3:2 are equally far from 1:1
+    aspect = math.log(width / height)
+    return min(
+        RESOLUTION_BUCKETS[output_size],
+        key=lambda bucket: abs(math.log(bucket[0] / bucket[1]) - aspect)
+    )
+
+
+def fit_to_bucket(image: Image.Image, output_size: str = "full") -> Image.Image:
+    """Resize-to-cover and center-crop an image to its bucket (minimal crop, no distortion)."""
+    bucket = select_bucket(image.width, image.height, output_size)
+    if image.size == bucket:
+        return image
+    return ImageOps.fit(image, bucket, Image.LANCZOS)
+
+
+def warmup_buckets(device: str = "cuda") -> List[Tuple[int, int, int]]:
+    """(width, height, batch_size) shapes to warm up: WARMUP_RESOLUTIONS plus every compile bucket."""
+    buckets = []
+    if settings.enable_warmup:
+        resolutions = settings.cpu_warmup_resolutions if device == "cpu" else settings.warmup_resolutions
+        buckets = [(*parse_resolution(resolution), 1) for resolution in resolutions]
+    if settings.enable_compile:
+        buckets += [bucket for bucket in compile_buckets() if bucket not in buckets]
+    return buckets
@@ -0,0 +1,178 @@
+"""
+Opt-in compiled execution for the denoising networks (UNet and ControlNet).
+
+Both networks run once or twice per denoising step, so they are compiled with
+torch.compile (Inductor; CUDA graphs via the "reduce-overhead" mode on GPU).
+Compilation is static-shape only: every input shape seen while the engine
+warms up is compiled, then the set is sealed. After sealing, a call whose
+shapes (or injected LoRA adapters) were not warmed up runs eager instead of
+triggering a recompile, so production requests never pay for compilation.
+
+The same code path runs on CPU (Inductor's C++ backend, no CUDA graphs).
+"""
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import torch
+
+from src.config import settings
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    """Parse a "WIDTHxHEIGHT" bucket string into (width, height)."""
+    width, _, height = resolution.lower().partition("x")
+    return int(width), int(height)
+
+
+def compile_buckets() -> List[Tuple[int, int, int]]:
+    """(width, height, batch_size) combinations that warm-up compiles."""
+    return [
+        (*parse_resolution(resolution), batch_size)
+        for resolution in settings.compile_resolutions
+        for batch_size in settings.compile_batch_sizes
+    ]
+
+
+def _shape_signature(args, kwargs) -> Tuple:
+    """Shapes/dtypes of every tensor argument plus Python constants, recursing into dicts/sequences."""
+    signature = []
+
+    def visit(name, value):
+        if isinstance(value, torch.Tensor):
+            signature.append((name, tuple(value.shape), value.dtype))
+        elif isinstance(value, dict):
+            for key in sorted(value):
+                visit(f"{name}.{key}", value[key])
+        elif isinstance(value, (list, tuple)):
+            for i, item in enumerate(value):
+                visit(f"{name}.{i}", item)
+        elif isinstance(value, (bool, int, float, str)) or value is None:
+            # Python constants (e.g. conditioning_scale) are specialized into the
+            # graph, so a new value would recompile: they are part of the key
+            signature.append((name, value))
+
+    for i, value in enumerate(args):
+        visit(str(i), value)
+    for key in sorted(kwargs):
+        visit(key, kwargs[key])
+    return tuple(signature)
+
+
+def _adapter_signature(module: torch.nn.Module) -> Tuple:
+    """
+    Adapters injected into the module (diffusers' PEFT backend).
+
+    load_lora_weights adds LoRA layers to an already-compiled module; once injected they
+    stay in the module even while disabled, and deleting the last adapter leaves an
+    empty `peft_config`, so "never injected" (None) and "()" are different structures.
+    """
+    peft_config = getattr(module, "peft_config", None)
+    return (("adapters", None if peft_config is None else tuple(sorted(peft_config))),)
+
+
+class BucketedCompiledForward:
+    """
+    Replaces a module's forward with a compiled version restricted to warmed-up shapes.
+
+    Installed as an instance attribute, so `module(...)` and all attribute access
+    (config, dtype, attention processors, LoRA loading) keep working unchanged.
+
+    `state` returns module state the forward reads besides its arguments (e.g.
+    attention processor attributes); dynamo guards on it, so it is part of the key.
+    """
+
+    def __init__(self, module: torch.nn.Module, name: str, mode: str, state: Optional[Callable[[], Tuple]] = None):
+        self.module = module
+        self.name = name
+        self.state = state
+        self.eager_forward = module.forward
+        self.compiled_forward = torch.compile(self.eager_forward, mode=mode, dynamic=False)
+        self.shapes: Set[Tuple] = set()
+        self.sealed = False
+        self.enabled = True
+        self.misses = 0
+        module.forward = self
+
+    def __call__(self, *args, **kwargs):
+        if not self.enabled:
+            return self.eager_forward(*args, **kwargs)
+
+        signature = _shape_signature(args, kwargs) + _adapter_signature(self.module)
+        if self.state is not None:
+            signature += self.state()
+        if signature in self.shapes:
+            return self.compiled_forward(*args, **kwargs)
+        if not self.sealed:
+            self.shapes.add(signature)
+            return self.compiled_forward(*args, **kwargs)
+
+        self.misses += 1
+        if self.misses == 1 or self.misses % 100 == 0:
+            logger.warning("compiled_shape_miss", module=self.name, misses=self.misses)
+        return self.eager_forward(*args, **kwargs)
+
+    def seal(self):
+        self.sealed = True
+        logger.info("compiled_shapes_sealed", module=self.name, num_shapes=len(self.shapes))
+
+    def remove(self):
+        """Restore the eager forward."""
+        if self.module.__dict__.get("forward") is self:
+            del self.module.forward
+
+
+class CompiledPipeline:
+    """
+    Compiled UNet/ControlNet forwards for one pipeline instance.
+
+    Sets `pipe.compiled_dispatch` while compiled forwards are enabled: they are
+    instance attributes, so `is_compiled_module` never sees them, and the
+    denoising loop uses the flag to mark CUDA graph step boundaries.
+    """
+
+    def __init__(self, pipe, mode: Optional[str] = None):
+        self.pipe = pipe
+        device_type = pipe.unet.device.type
+        # CUDA graphs are GPU-only; Inductor's default mode is the CPU equivalent
+        self.mode = (mode or settings.compile_mode) if device_type == "cuda" else "default"
+
+        # One dynamo cache entry per warmed shape; keep headroom over the default of 8
+        torch._dynamo.config.cache_size_limit = max(
+            torch._dynamo.config.cache_size_limit, 4 * len(compile_buckets()) + 8
+        )
+
+        self.forwards: Dict[str, BucketedCompiledForward] = {}
+        for name in ("unet", "controlnet"):
+            module = getattr(pipe, name, None)
+            if module is not None:
+                # Attention processor state (identity regions, per-sample IP scales) lives on the UNet
+                state = getattr(pipe, "compiled_state_signature", None) if name == "unet" else None
+                self.forwards[name] = BucketedCompiledForward(module, name, self.mode, state)
+        pipe.compiled_dispatch = True
+
+        logger.info("pipeline_compiled", mode=self.mode, device=device_type, modules=list(self.forwards))
+
+    def set_enabled(self, enabled: bool):
+        """Toggle compiled dispatch (e.g. off while unfused adapters change the graph)."""
+        for forward in self.forwards.values():
+            forward.enabled = enabled
+        self.pipe.compiled_dispatch = enabled
+
+    def seal(self):
+        for forward in self.forwards.values():
+            forward.seal()
+
+    def remove(self):
+        for forward in self.forwards.values():
+            forward.remove()
+        self.forwards = {}
+        self.pipe.compiled_dispatch = False
+
+    def stats(self) -> Dict:
+        return {
+            name: {"shapes": len(forward.shapes), "sealed": forward.sealed, "misses": forward.misses}
+            for name, forward in self.forwards.items()
+        }
@@ -56,7 +56,63 @@ class Settings(BaseSettings):
         default="/tmp/insightface",
         description="InsightFace models directory"
     )
-    
+
+    # Model Loading
+    model_load_workers: int = Field(
+        default=4,
+        ge=1,
+        le=16,
+        description="Worker threads used to load model components concurrently"
+    )
+    load_host_memory_budget_mb: int = Field(
+        default=2048,
+        ge=256,
+        le=16384,
+        description="Maximum host RAM staged for in-flight weight tensors during loading"
+    )
+    use_pipeline_snapshot: bool = Field(
+        default=True,
+        description="Restore the InstantID engine from a single-file snapshot when available"
+    )
+    model_manifest_name: str = Field(
+        default="manifest.json",
+        description="Model manifest file at the root of the models mount"
+    )
+    model_store_mode: Literal["direct", "stage"] = Field(
+        default="direct",
+        description="'direct' loads weights memory-mapped from the models mount; 'stage' copies them to "
+                    "MODEL_STORE_DIR first and deletes the copies once the engine is loaded"
+    )
+    model_store_dir: str = Field(
+        default="/tmp/model_store",
+        description="Local directory that model files are staged into (MODEL_STORE_MODE=stage); should be a disk volume"
+    )
+    model_store_allow_tmpfs: bool = Field(
+        default=False,
+        description="Allow staging into a tmpfs MODEL_STORE_DIR (e.g. Cloud Run's in-memory /tmp), which keeps "
+                    "the staged weights in host memory until they are released"
+    )
+    model_stage_workers: int = Field(
+        default=16,
+        ge=1,
+        le=64,
+        description="Concurrent chunk reads when staging model files from the mount (MODEL_STORE_MODE=stage)"
+    )
+    model_stage_chunk_mb: int = Field(
+        default=64,
+        ge=1,
+        le=1024,
+        description="Chunk size for parallel reads when staging model files"
+    )
+    verify_model_checksums: bool = Field(
+        default=False,
+        description="Verify MD5 of staged model files against the manifest (sizes are always checked)"
+    )
+    allow_hub_downloads: bool = Field(
+        default=False,
+        description="Fall back to HuggingFace Hub for components missing from the manifest (dev only)"
+    )
+
     # Model Parameters
     guidance_scale: float = Field(
         default=5.0,
@@ -70,6 +126,32 @@ class Settings(BaseSettings):
         le=50,
         description="Number of inference steps"
     )
+    fast_tier_steps: int = Field(
+        default=6,
+        ge=4,
+        le=8,
+        description="Inference steps for the 'fast' tier (LCM-LoRA step distillation)"
+    )
+    best_tier_steps: int = Field(
+        default=30,
+        ge=20,
+        le=50,
+        description="Inference steps for the 'best' tier (DPM-Solver++ Karras)"
+    )
+    cfg_cutoff: float = Field(
+        default=1.0,
+        gt=0.0,
+        le=1.0,
+        description="Fraction of InstantID steps run with classifier-free guidance; later steps run conditional-only (1.0 = all)"
+    )
+    cfg_cutoff_by_style: dict[str, float] = Field(
+        default={},
+        description='Per-style CFG_CUTOFF overrides, e.g. {"natural": 0.7, "corporate": 0.7}'
+    )
+    img2img_strength_by_style: dict[str, float] = Field(
+        default={"natural": 0.4, "corporate": 0.4, "vintage": 0.5},
+        description='Per-style img2img strength for photo-preserving styles (InstantID): only this fraction of the steps runs, starting from the noised input photo; unset styles denoise from pure noise'
+    )
     controlnet_scale: float = Field(
         default=0.8,
         ge=0.0,
@@ -82,6 +164,72 @@ class Settings(BaseSettings):
         le=1.0,
         description="IP-Adapter scale for face preservation"
     )
+    controlnet_cache_interval: int = Field(
+        default=1,
+        ge=1,
+        le=4,
+        description="Run the InstantID ControlNet every N steps and reuse its residuals in between (1 = every step)"
+    )
+    unet_cache_interval: int = Field(
+        default=1,
+        ge=1,
+        le=10,
+        description="Run the full UNet every N steps and reuse deep block features in between (1 = off, standard/best tiers)"
+    )
+    unet_cache_depth: int = Field(
+        default=1,
+        ge=1,
+        le=2,
+        description="Outer down/up block pairs recomputed on cached UNet steps (higher = slower, closer to full)"
+    )
+    max_faces: int = Field(
+        default=4,
+        ge=1,
+        le=8,
+        description="Most faces (largest first) given their own identity in multi-face (all_faces) generation"
+    )
+    identity_region_expand: float = Field(
+        default=2.0,
+        ge=1.0,
+        le=4.0,
+        description="Multi-face identity region size, as a multiple of each InsightFace face box"
+    )
+    face_crop_expand: float = Field(
+        default=2.5,
+        ge=1.5,
+        le=5.0,
+        description="Face-crop region size, as a multiple of the InsightFace face box (grown to the bucket's aspect ratio)"
+    )
+    face_crop_output_size: Literal["preview", "full"] = Field(
+        default="preview",
+        description="Bucket size the face-crop region is generated at when the request sets no output_size"
+    )
+    face_crop_feather: float = Field(
+        default=0.1,
+        ge=0.0,
+        le=0.5,
+        description="Width of the face-crop paste-back blend, as a fraction of the region's shorter side"
+    )
+    token_merge_ratio_by_tier: dict[str, float] = Field(
+        default={},
+        description='Fraction of self-attention tokens merged per quality tier (ToMe), e.g. {"standard": 0.3, "best": 0.2}; unset tiers do not merge'
+    )
+    token_merge_max_downsample: int = Field(
+        default=2,
+        ge=1,
+        le=8,
+        description="Merge tokens only in self-attention layers at most this many times below latent resolution (2 = SDXL's highest-resolution attention)"
+    )
+    token_merge_protect_face: bool = Field(
+        default=True,
+        description="Never merge tokens inside the InsightFace face box (InstantID)"
+    )
+    text_kv_cache_mb: int = Field(
+        default=0,
+        ge=0,
+        le=2048,
+        description="VRAM budget for InstantID text cross-attention K/V reused across requests with the same prompt and adapters (0 = off)"
+    )
     lora_scale: float = Field(
         default=0.8,
         ge=0.0,
@@ -122,6 +270,12 @@ class Settings(BaseSettings):
         le=60,
         description="Timeout for downloading input images"
     )
+    model_ready_wait_seconds: int = Field(
+        default=300,
+        ge=0,
+        le=900,
+        description="How long /generate waits for background model loading before returning 503"
+    )
     
     # Rate Limiting
     rate_limit_per_minute: int = Field(
@@ -172,16 +326,140 @@ class Settings(BaseSettings):
         description="Allowed domains for image URLs"
     )
     
+    # CPU Serving (used when no GPU is available)
+    cpu_dtype: Literal["bfloat16", "float32"] = Field(
+        default="bfloat16",
+        description="Pipeline dtype on CPU (float32 memory-maps the fp32 weights without a copy)"
+    )
+    cpu_threads: int = Field(
+        default=0,
+        ge=0,
+        le=256,
+        description="Intra-op threads on CPU (0 = all CPUs available to the process)"
+    )
+    cpu_default_quality: Literal["fast", "standard", "best"] = Field(
+        default="fast",
+        description="Quality tier for requests that do not set one, on CPU"
+    )
+    cpu_default_output_size: Literal["preview", "full"] = Field(
+        default="preview",
+        description="Output size for requests that do not set one, on CPU"
+    )
+    cpu_warmup_resolutions: list[str] = Field(
+        default=["768x768"],
+        description="WIDTHxHEIGHT buckets warmed up on CPU (replaces WARMUP_RESOLUTIONS)"
+    )
+
     # GPU Settings
     enable_xformers: bool = Field(
         default=True,
-        description="Enable xFormers memory efficient attention"
+        description="Enable xFormers memory efficient attention (IP-Adapter engine)"
     )
     enable_attention_slicing: bool = Field(
+        default=False,
+        description="Enable attention slicing for memory efficiency (IP-Adapter engine; slower, tiled VAE covers the decode peak)"
+    )
+    attention_backend: Literal["auto", "sdpa", "xformers", "math"] = Field(
+        default="auto",
+        description="InstantID attention kernel: auto = fused scaled_dot_product_attention, else xformers, else math"
+    )
+    vae_tiling: Literal["auto", "always", "never"] = Field(
+        default="auto",
+        description="Tiled VAE encode/decode: auto = above VAE_TILING_MIN_PIXELS or under memory pressure"
+    )
+    vae_tiling_min_pixels: int = Field(
+        default=1_572_864,
+        ge=262_144,
+        description="Output pixel count above which the VAE always runs tiled (default 1.5MP, above every bucket)"
+    )
+    vae_tile_size: int = Field(
+        default=512,
+        ge=256,
+        le=1024,
+        multiple_of=64,
+        description="VAE tile edge in pixels (25% of each tile overlaps and is blended)"
+    )
+    vae_decode_mb_per_megapixel: int = Field(
+        default=3072,
+        ge=256,
+        description="Estimated untiled VAE decode peak per output megapixel, for memory-pressure tiling"
+    )
+    enable_int8_weights: bool = Field(
+        default=False,
+        description="Load UNet/ControlNet int8 weight variants from models/quantize_models.py (opt-in)"
+    )
+
+    # Compiled Execution
+    enable_compile: bool = Field(
+        default=False,
+        description="Compile UNet/ControlNet with torch.compile during warm-up (opt-in)"
+    )
+    compile_mode: Literal["default", "reduce-overhead", "max-autotune", "max-autotune-no-cudagraphs"] = Field(
+        default="reduce-overhead",
+        description="torch.compile mode on GPU (reduce-overhead captures CUDA graphs); CPU always uses default"
+    )
+    compile_resolutions: list[str] = Field(
+        default=["1024x1024"],
+        description="WIDTHxHEIGHT buckets (see src/buckets.py) compiled during warm-up"
+    )
+    compile_batch_sizes: list[int] = Field(
+        default=[1],
+        description="Images-per-request batch buckets compiled during warm-up"
+    )
+
+    # Batching
+    max_batch_size: int = Field(
+        default=4,
+        ge=1,
+        le=16,
+        description="Most InstantID jobs (same style, tier and bucket) denoised together by process_batch"
+    )
+
+    # Warm-up
+    enable_warmup: bool = Field(
         default=True,
-        description="Enable attention slicing for memory efficiency"
+        description="Run synthetic generations per engine and bucket before reporting ready"
     )
-    
+    warmup_resolutions: list[str] = Field(
+        default=["1024x1024", "832x1216", "768x768"],
+        description="WIDTHxHEIGHT buckets warmed up (compile buckets are always included)"
+    )
+    warmup_steps: int = Field(
+        default=4,
+        ge=3,
+        le=20,
+        description="Inference steps per warm-up generation (>=3 so CUDA graphs record and replay)"
+    )
+    latency_regression_factor: float = Field(
+        default=1.5,
+        ge=1.0,
+        le=10.0,
+        description="Log latency_regression when a generation exceeds baseline by this factor"
+    )
+
+    # VRAM Budget
+    vram_reserve_mb: int = Field(
+        default=1024,
+        ge=0,
+        le=16384,
+        description="GPU memory kept free beyond a request's activation peak (fragmentation, cuDNN workspaces)"
+    )
+    vram_activation_safety: float = Field(
+        default=1.2,
+        ge=1.0,
+        le=3.0,
+        description="Margin applied to activation estimates scaled from a different measured bucket"
+    )
+    vram_offload_text_encoders: bool = Field(
+        default=True,
+        description="Offload text encoders to CPU under memory pressure instead of rejecting requests"
+    )
+    readiness_min_free_mb: int = Field(
+        default=1024,
+        ge=0,
+        description="Readiness fails when available GPU memory (free + allocator cache) drops below this"
+    )
+
     @field_validator('environment')
     @classmethod
     def validate_environment(cls, v):
@@ -190,7 +468,44 @@ class Settings(BaseSettings):
             raise ValueError(f"Invalid environment: {v}")
         return v
 
-    @field_validator('cache_dir', 'insightface_root')
+    @field_validator('compile_resolutions', 'warmup_resolutions', 'cpu_warmup_resolutions')
+    @classmethod
+    def validate_resolutions(cls, v):
+        """Resolution buckets must be WIDTHxHEIGHT multiples of 8 (latent stride)."""
+        for resolution in v:
+            width, _, height = resolution.lower().partition("x")
+            if not (width.isdigit() and height.isdigit()) or int(width) % 8 or int(height) % 8:
+                raise ValueError(f"Invalid resolution bucket: {resolution}")
+        return v
+
+    @field_validator('cfg_cutoff_by_style')
+    @classmethod
+    def validate_cfg_cutoffs(cls, v):
+        """CFG cutoffs are fractions of the denoising steps."""
+        for style, cutoff in v.items():
+            if not 0.0 < cutoff <= 1.0:
+                raise ValueError(f"CFG cutoff for {style} must be in (0, 1]: {cutoff}")
+        return v
+
+    @field_validator('img2img_strength_by_style')
+    @classmethod
+    def validate_img2img_strengths(cls, v):
+        """Strengths are fractions of the denoising steps; 1.0 is a full denoise from noise."""
+        for style, strength in v.items():
+            if not 0.0 < strength <= 1.0:
+                raise ValueError(f"img2img strength for {style} must be in (0, 1]: {strength}")
+        return v
+
+    @field_validator('token_merge_ratio_by_tier')
+    @classmethod
+    def validate_token_merge_ratios(cls, v):
+        """Merge ratios are fractions of the tokens; at most the non-destination three quarters."""
+        for tier, ratio in v.items():
+            if not 0.0 <= ratio <= 0.75:
+                raise ValueError(f"Token merge ratio for {tier} must be in [0, 0.75]: {ratio}")
+        return v
+
+    @field_validator('cache_dir', 'insightface_root', 'model_store_dir')
     @classmethod
     def validate_paths(cls, v):
         """Ensure paths are absolute."""
@@ -0,0 +1,98 @@
+"""
+Face-region crop generation with paste-back for Jhakaas Worker.
+
+Large photos (up to MAX_IMAGE_DIMENSION) are normally resized whole into a
+~1MP bucket, so wide shots spend most of the generation on background and
+the face ends up a few hundred pixels across. In face-crop mode:
+- a region around the InsightFace box(es), FACE_CROP_EXPAND times the box
+  and shaped like the nearest bucket, is cut from the original photo
+- only that region is generated, at its (smaller) bucket
+- the result is resized back over the region and blended into the original
+  with a feathered edge, so the rest of the photo keeps its full resolution
+
+Keypoints and boxes are mapped into the crop, so faces are detected once.
+"""
+
+import copy
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from src.buckets import select_bucket
+
+# Fall back to whole-image generation when the region covers more of the photo than this
+MAX_REGION_FRACTION = 0.5
+
+Region = Tuple[int, int, int, int]
+
+
+def face_crop_region(boxes: Sequence, width: int, height: int, output_size: str,
+                     expand: float) -> Optional[Tuple[Region, Tuple[int, int]]]:
+    """
+    (x1, y1, x2, y2) region around the face boxes and the bucket it is generated at.
+
+    The region is centred on the union of the boxes, `expand` times its size and
+    grown to the bucket's aspect ratio, then shifted (or shrunk) to fit the photo.
+    Returns None when it would cover more than MAX_REGION_FRACTION of the photo.
+    """
+    boxes = np.asarray([box[:4] for box in boxes], dtype=np.float64)
+    x1, y1 = boxes[:, 0].min(), boxes[:, 1].min()
+    x2, y2 = boxes[:, 2].max(), boxes[:, 3].max()
+    bucket = select_bucket(max(x2 - x1, 1), max(y2 - y1, 1), output_size)
+    aspect = bucket[0] / bucket[1]
+
+    region_w, region_h = (x2 - x1) * expand, (y2 - y1) * expand
+    region_w, region_h = max(region_w, region_h * aspect), max(region_h, region_w / aspect)
+    # Shrink (keeping the aspect ratio) when the photo is smaller than the region
+    fit = min(1.0, width / region_w, height / region_h)
+    region_w, region_h = region_w * fit, region_h * fit
+    if region_w * region_h > MAX_REGION_FRACTION * width * height:
+        return None
+
+    left = min(max((x1 + x2 - region_w) / 2, 0), width - region_w)
+    top = min(max((y1 + y2 - region_h) / 2, 0), height - region_h)
+    region = (round(left), round(top), round(left + region_w), round(top + region_h))
+    return region, bucket
+
+
+def crop_to_region(image: Image.Image, region: Region, bucket: Tuple[int, int]) -> Image.Image:
+    """The region of the original photo, resized to its bucket."""
+    return image.crop(region).resize(bucket, Image.LANCZOS)
+
+
+def faces_in_crop(faces: Sequence, region: Region, bucket: Tuple[int, int]) -> list:
+    """Copies of InsightFace results with bbox and kps mapped into the resized crop."""
+    scale = np.array([bucket[0] / (region[2] - region[0]), bucket[1] / (region[3] - region[1])])
+    offset = np.array(region[:2], dtype=np.float64)
+    mapped = []
+    for face in faces:
+        face = copy.copy(face)
+        face.bbox = ((np.asarray(face.bbox[:4]).reshape(2, 2) - offset) * scale).reshape(4)
+        face.kps = (np.asarray(face.kps) - offset) * scale
+        mapped.append(face)
+    return mapped
+
+
+def paste_back(original: Image.Image, generated: Image.Image, region: Region, feather: float) -> Image.Image:
+    """
+    Blend the generated crop over its region of the original photo.
+
+    The alpha ramps from 0 to 1 over `feather` of the region's shorter side, except on
+    edges that touch the photo's border (nothing to blend into there).
+    """
+    width, height = region[2] - region[0], region[3] - region[1]
+    generated = generated.resize((width, height), Image.LANCZOS)
+
+    ramp = max(1, int(min(width, height) * feather))
+    xs, ys = np.arange(width) + 0.5, np.arange(height) + 0.5
+    left = xs / ramp if region[0] > 0 else np.ones(width)
+    right = (width - xs) / ramp if region[2] < original.width else np.ones(width)
+    top = ys / ramp if region[1] > 0 else np.ones(height)
+    bottom = (height - ys) / ramp if region[3] < original.height else np.ones(height)
+    alpha = np.minimum(np.minimum(left, right)[None, :], np.minimum(top, bottom)[:, None]).clip(0, 1)
+    mask = Image.fromarray((alpha * 255).astype(np.uint8), mode="L")
+
+    output = original.copy()
+    output.paste(generated, region[:2], mask)
+    return output
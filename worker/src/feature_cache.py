@@ -0,0 +1,92 @@
+"""
+Cross-step UNet feature caching (DeepCache-style) for Jhakaas Worker.
+
+The deep, low-resolution blocks of the UNet (inner down blocks, mid block,
+inner up blocks) change little between adjacent denoising steps. On refresh
+steps the whole UNet runs and the outputs of those deep blocks are kept; on
+the steps in between the deep blocks return their cached outputs and only
+the shallow, full-resolution blocks (the outer `depth` down/up blocks plus
+conv_in/conv_out) are recomputed against the current latents.
+
+Works for both engines without touching the UNet forward: the deep blocks'
+forwards are swapped for cache lookups only inside `active()`, so warm-up
+and other callers see the plain UNet. Compiled dispatch must be off while
+the cache is active (block forwards change between steps).
+"""
+
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from src.config import settings
+
+
+class UNetFeatureCache:
+    """Reuses deep UNet block outputs for `interval - 1` steps after each full step."""
+
+    def __init__(self, unet: torch.nn.Module, depth: Optional[int] = None, interval: Optional[int] = None):
+        self.unet = unet
+        self.depth = depth or settings.unet_cache_depth
+        self.interval = interval or settings.unet_cache_interval
+        self.enabled = False
+        self.stats: Dict[str, int] = {"full": 0, "cached": 0}
+
+        num_up = len(unet.up_blocks)
+        # Everything below the outer `depth` down/up blocks is cached
+        self.deep_modules: List[Tuple[str, torch.nn.Module]] = (
+            [(f"down_blocks.{i}", block) for i, block in enumerate(unet.down_blocks) if i >= self.depth]
+            + [("mid_block", unet.mid_block)]
+            + [(f"up_blocks.{i}", block) for i, block in enumerate(unet.up_blocks) if i < num_up - self.depth]
+        )
+        self._reset()
+
+    def _reset(self):
+        self.calls = 0
+        self.refresh = True
+        self.shape: Optional[Tuple[int, ...]] = None
+        self.features: Dict[str, object] = {}
+
+    @contextmanager
+    def active(self):
+        """Cache deep features across the UNet calls (one per step) made inside the block."""
+        if not self.enabled or self.interval <= 1:
+            yield self
+            return
+
+        modules = [("unet", self.unet, self._unet_forward)] + [
+            (name, module, self._cached_forward(name, module.forward)) for name, module in self.deep_modules
+        ]
+        previous = {}
+        self._reset()
+        self._unet_previous = self.unet.forward
+        for name, module, forward in modules:
+            # Keep instance-level forwards (compiled dispatch, other wrappers) to restore them
+            previous[name] = module.__dict__.get("forward")
+            module.forward = forward
+        try:
+            yield self
+        finally:
+            for name, module, _ in modules:
+                if previous[name] is None:
+                    module.__dict__.pop("forward", None)
+                else:
+                    module.forward = previous[name]
+            self._reset()
+            self._unet_previous = None
+
+    def _unet_forward(self, sample, *args, **kwargs):
+        # One UNet call per denoising step (CFG branches are batched together)
+        shape = tuple(sample.shape)
+        self.refresh = self.calls % self.interval == 0 or shape != self.shape
+        self.shape = shape
+        self.calls += 1
+        self.stats["full" if self.refresh else "cached"] += 1
+        return self._unet_previous(sample, *args, **kwargs)
+
+    def _cached_forward(self, name, forward):
+        def cached_forward(*args, **kwargs):
+            if self.refresh or name not in self.features:
+                self.features[name] = forward(*args, **kwargs)
+            return self.features[name]
+        return cached_forward
@@ -0,0 +1,92 @@
+"""
+Cross-request text cross-attention K/V cache for Jhakaas Worker.
+
+Within a request the InstantID processors already compute the text keys and
+values once per layer (they do not depend on the latents). Across requests
+the same styled prompt recurs, so the per-layer text K/V of a finished call
+are kept in a bounded LRU and pre-filled into the processors of the next call
+with identical prompt embeddings and adapter state.
+
+Keys are (adapter state, prompt-embedding digest): LoRA layers on to_k/to_v
+change the projections, so the active adapters and weights are part of the
+key, and the manager clears the cache whenever adapter weights are loaded or
+deleted (an adapter name can be reused with different weights).
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+MB = 1024 * 1024
+
+
+def _entry_bytes(entry: Dict) -> int:
+    """Bytes held by one entry: {processor name: {(kind, rows): (key, value)}}."""
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for layers in entry.values()
+        for pair in layers.values()
+        for tensor in pair
+    )
+
+
+class TextKVCache:
+    """LRU of per-layer text K/V bounded by a VRAM budget."""
+
+    def __init__(self, max_mb: int):
+        self.max_bytes = max_mb * MB
+        self.entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self.sizes: Dict[tuple, int] = {}
+        self.bytes = 0
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Dict]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key, entry: Dict):
+        size = _entry_bytes(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self.bytes -= self.sizes.pop(key)
+                del self.entries[key]
+            while self.entries and self.bytes + size > self.max_bytes:
+                evicted, _ = self.entries.popitem(last=False)
+                self.bytes -= self.sizes.pop(evicted)
+                self.stats["evictions"] += 1
+            self.entries[key] = entry
+            self.sizes[key] = size
+            self.bytes += size
+
+    def clear(self, reason: str):
+        """Drop every entry (adapter weights changed, attention backend changed, memory pressure)."""
+        with self._lock:
+            if not self.entries:
+                return
+            logger.info("text_kv_cache_cleared", reason=reason, entries=len(self.entries),
+                        size_mb=round(self.bytes / MB))
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def summary(self) -> Dict:
+        """Snapshot for the debug endpoint."""
+        return {
+            "entries": len(self.entries),
+            "size_mb": round(self.bytes / MB),
+            "budget_mb": round(self.max_bytes / MB),
+            **self.stats,
+        }
@@ -0,0 +1,292 @@
+"""
+Parallel, direct-to-device model loading for Jhakaas Worker.
+
+This module provides the building blocks used by ModelManager at cold start:
+- Memory-mapped safetensors reading, streamed tensor-by-tensor to the target device
+- A host memory budget that caps how many bytes are staged on the CPU at once
+- Construction of diffusers/transformers modules on the meta device so no
+  randomly initialised CPU copy is ever allocated
+- A load timeline that records when each component started and finished
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+from accelerate import init_empty_weights
+from diffusers import ModelMixin
+
+from src.logger import get_logger
+from src.quantization import is_quantized_checkpoint, prepare_quantized_layout
+
+logger = get_logger(__name__)
+
+# safetensors dtype tags -> torch dtypes
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+class HostMemoryBudget:
+    """
+    Byte-counting semaphore that caps host RAM used for in-flight tensors.
+
+    Every tensor read from disk is accounted against the budget until it has
+    been copied to its target device. A single tensor larger than the whole
+    budget is still admitted, but only when nothing else is in flight.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        nbytes = min(nbytes, self.max_bytes)
+        with self._cond:
+            while self.in_flight + nbytes > self.max_bytes:
+                self._cond.wait()
+            self.in_flight += nbytes
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= nbytes
+                self._cond.notify_all()
+
+
+class LoadTimeline:
+    """Records start/end offsets of each component load relative to cold start."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.events: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def track(self, name: str, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) and record its load window under `name`."""
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.events[name] = {
+                    "start_ms": round((start - self.t0) * 1000),
+                    "end_ms": round((end - self.t0) * 1000),
+                    "duration_ms": round((end - start) * 1000),
+                    "thread": threading.current_thread().name,
+                }
+            logger.info("component_loaded", component=name, **self.events[name])
+
+    def log_summary(self, **kwargs):
+        total_ms = round((time.perf_counter() - self.t0) * 1000)
+        serial_ms = sum(event["duration_ms"] for event in self.events.values())
+        logger.info(
+            "model_load_timeline",
+            total_ms=total_ms,
+            serial_ms=serial_ms,
+            components=dict(sorted(self.events.items(), key=lambda item: item[1]["start_ms"])),
+            **kwargs
+        )
+
+
+def read_safetensors_header(path: str) -> Tuple[Dict, int]:
+    """
+    Parse the JSON header of a safetensors file.
+
+    Returns:
+        (header, data_start) where header maps tensor names to
+        {"dtype", "shape", "data_offsets"} and data_start is the byte offset
+        of the tensor data section.
+    """
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    header.pop("__metadata__", None)
+    return header, 8 + header_len
+
+
+def stream_safetensors(
+    path: str,
+    device: str,
+    dtype: Optional[torch.dtype] = None,
+    budget: Optional[HostMemoryBudget] = None,
+) -> Iterator[Tuple[str, torch.Tensor]]:
+    """
+    Yield (name, tensor) pairs from a memory-mapped safetensors file.
+
+    Tensors are visited in file order so the mapping is read sequentially,
+    and each one is copied from the page cache straight to `device`. No full
+    CPU state dict is ever materialized. Floating point tensors are cast to
+    `dtype` when given.
+
+    On CPU targets with a matching dtype the yielded tensor is a view over the
+    mapping itself, so weights stay memory-mapped and are paged in on demand.
+    """
+    header, data_start = read_safetensors_header(path)
+    entries = sorted(header.items(), key=lambda item: item[1]["data_offsets"][0])
+
+    with open(path, "rb") as f:
+        # ACCESS_COPY gives a private, writable mapping: pages are shared with the
+        # page cache until written, and torch.frombuffer accepts it without a copy.
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if hasattr(mm, "madvise"):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+
+    for name, info in entries:
+        begin, end = info["data_offsets"]
+        nbytes = end - begin
+        src_dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        target_dtype = dtype if (dtype is not None and src_dtype.is_floating_point) else src_dtype
+
+        reservation = budget.reserve(nbytes) if budget is not None else _no_reservation()
+        with reservation:
+            if nbytes == 0:
+                tensor = torch.empty(info["shape"], dtype=src_dtype)
+            else:
+                tensor = torch.frombuffer(
+                    mm,
+                    dtype=src_dtype,
+                    count=nbytes // src_dtype.itemsize,
+                    offset=data_start + begin,
+                ).view(info["shape"])
+            tensor = tensor.to(device=device, dtype=target_dtype)
+        yield name, tensor
+
+
+@contextmanager
+def _no_reservation():
+    yield
+
+
+def assign_tensor(model: torch.nn.Module, name: str, tensor: torch.Tensor) -> bool:
+    """Replace a parameter or buffer in-place. Returns False for unknown names."""
+    module_path, _, leaf = name.rpartition(".")
+    try:
+        module = model.get_submodule(module_path) if module_path else model
+    except AttributeError:
+        return False
+
+    if leaf in module._parameters:
+        module._parameters[leaf] = torch.nn.Parameter(tensor, requires_grad=False)
+    elif leaf in module._buffers:
+        module._buffers[leaf] = tensor
+    else:
+        return False
+    return True
+
+
+def load_weights_into_model(
+    model: torch.nn.Module,
+    path: str,
+    device: str,
+    dtype: Optional[torch.dtype] = None,
+    budget: Optional[HostMemoryBudget] = None,
+    prefix: str = "",
+) -> List[str]:
+    """
+    Stream a safetensors file into a (meta-initialised) module.
+
+    Args:
+        prefix: Only tensors whose name starts with this prefix are loaded,
+            with the prefix stripped (used for multi-component files).
+
+    Returns:
+        Names from the file that did not match any parameter or buffer.
+    """
+    unexpected = []
+    for name, tensor in stream_safetensors(path, device, dtype, budget):
+        if prefix:
+            if not name.startswith(prefix):
+                continue
+            name = name[len(prefix):]
+        if not assign_tensor(model, name, tensor):
+            unexpected.append(name)
+    return unexpected
+
+
+def weight_stem(model_cls) -> str:
+    """File stem of a component's weights: diffusers and transformers name them differently."""
+    return "diffusion_pytorch_model" if issubclass(model_cls, ModelMixin) else "model"
+
+
+def find_weight_file(model_dir: str, stem: str, variant: Optional[str] = None) -> Optional[str]:
+    """Locate `{stem}.{variant}.safetensors` (preferred) or `{stem}.safetensors`."""
+    candidates = [f"{stem}.{variant}.safetensors"] if variant else []
+    candidates.append(f"{stem}.safetensors")
+    for candidate in candidates:
+        path = os.path.join(model_dir, candidate)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def instantiate_empty(model_cls, model_dir: str) -> torch.nn.Module:
+    """Build a diffusers or transformers module from its config on the meta device."""
+    if issubclass(model_cls, ModelMixin):
+        config = model_cls.load_config(model_dir)
+        with init_empty_weights():
+            return model_cls.from_config(config)
+
+    config = model_cls.config_class.from_pretrained(model_dir)
+    with init_empty_weights():
+        return model_cls(config)
+
+
+def build_model_on_device(
+    model_cls,
+    model_dir: str,
+    device: str,
+    dtype: torch.dtype,
+    variant: Optional[str] = None,
+    budget: Optional[HostMemoryBudget] = None,
+) -> torch.nn.Module:
+    """
+    Instantiate `model_cls` from `model_dir` with weights streamed directly to `device`.
+
+    Raises:
+        FileNotFoundError: If no safetensors weights exist in model_dir
+        RuntimeError: If the checkpoint does not match the module layout
+    """
+    weight_path = find_weight_file(model_dir, weight_stem(model_cls), variant)
+    if weight_path is None:
+        raise FileNotFoundError(f"No safetensors weights for {model_cls.__name__} in {model_dir}")
+
+    model = instantiate_empty(model_cls, model_dir)
+    header, _ = read_safetensors_header(weight_path)
+    if is_quantized_checkpoint(header):
+        # int8 variant (models/quantize_models.py): swap in int8 layers before streaming
+        prepare_quantized_layout(model, header)
+    unexpected = load_weights_into_model(model, weight_path, device, dtype, budget)
+
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing or unexpected:
+        raise RuntimeError(
+            f"{model_cls.__name__} checkpoint mismatch in {weight_path}: "
+            f"{len(missing)} missing, {len(unexpected)} unexpected "
+            f"(e.g. {(missing or unexpected)[:3]})"
+        )
+
+    # Non-persistent buffers (e.g. CLIP position_ids) were created on the CPU
+    model.to(device)
+    model.eval()
+    return model
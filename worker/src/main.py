@@ -3,6 +3,10 @@ Jhakaas AI Worker - FastAPI Application
 
 This module provides the main FastAPI application for the Jhakaas AI worker service.
 It handles image generation requests using InstantID with style transfer.
+
+Heavy dependencies (torch, diffusers, insightface, google-cloud-storage) are not
+imported here: the server binds its port immediately and models are imported and
+loaded on a background thread, with readiness reporting progress meanwhile.
 """
 
 import os
@@ -14,7 +18,6 @@ from typing import Optional, Literal
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from contextvars import ContextVar
 
-import torch
 from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -22,7 +25,6 @@ from pydantic import BaseModel, HttpUrl, Field, validator
 
 from src.config import settings
 from src.logger import setup_logging, get_logger, request_id_var
-from src.model_manager import ModelManager
 from src import utils
 
 # Setup logging
@@ -48,13 +50,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Model Manager
-manager = ModelManager(settings.model_bucket)
+# Model Manager is created by the background loader (importing it pulls in torch)
+manager = None
 
 # Thread pool for async processing
 executor = ThreadPoolExecutor(max_workers=1)
 
 
+class ModelLoadState:
+    """Tracks background model loading for readiness reporting and request gating."""
+
+    def __init__(self):
+        self.stage = "starting"  # starting -> importing -> loading -> ready | failed
+        self.started_at = time.time()
+        self.error: Optional[str] = None
+        self.ready = asyncio.Event()
+        self.finished = asyncio.Event()  # set on success or failure
+
+    def progress(self) -> dict:
+        components = (manager.load_timeline or {}) if manager is not None else {}
+        return {
+            "stage": self.stage,
+            "elapsed_s": round(time.time() - self.started_at, 1),
+            "components_loaded": sorted(components),
+            "error": self.error,
+        }
+
+
+load_state = ModelLoadState()
+
+
 # ============================================================================
 # Request/Response Models
 # ============================================================================
@@ -91,6 +116,26 @@ class GenerateRequest(BaseModel):
         default="instantid",
         description="Face ID Engine to use: 'instantid' (Research) or 'ip_adapter' (Commercial Safe)"
     )
+    quality: Optional[Literal["fast", "standard", "best"]] = Field(
+        default=None,
+        description="Quality tier: 'fast' (LCM-LoRA, 4-8 steps), 'standard' (Euler) or 'best' (DPM-Solver++, more steps). "
+                    "Defaults to 'standard' on GPU and CPU_DEFAULT_QUALITY on CPU"
+    )
+    output_size: Optional[Literal["preview", "full"]] = Field(
+        default=None,
+        description="Output size tier: 'preview' (~0.6MP) or 'full' (~1MP); aspect ratio follows the input. "
+                    "Defaults to 'full' on GPU and CPU_DEFAULT_OUTPUT_SIZE on CPU"
+    )
+    all_faces: bool = Field(
+        default=False,
+        description="Keep every detected face's identity (up to MAX_FACES) in one generation, for group photos. "
+                    "InstantID engine only"
+    )
+    face_crop: bool = Field(
+        default=False,
+        description="Generate only an expanded region around the face(s) and blend it back into the "
+                    "full-resolution photo, for large or wide shots. InstantID engine only"
+    )
     
     @validator('image_url')
     def validate_image_url(cls, v):
@@ -143,6 +188,7 @@ class HealthResponse(BaseModel):
     gpu_available: bool
     models_loaded: bool
     gpu_memory_free_gb: Optional[float] = None
+    loading: Optional[dict] = None
 
 
 # ============================================================================
@@ -237,19 +283,73 @@ async def global_exception_handler(request: Request, exc: Exception):
 # Startup/Shutdown Events
 # ============================================================================
 
-@app.on_event("startup")
-async def startup_event():
-    """Load models on startup."""
-    logger.info("service_starting", environment=settings.environment)
-    
+def _initialize_models():
+    """Import the model stack and load the default engine (runs off the event loop)."""
+    global manager
+
+    load_state.stage = "importing"
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    load_state.stage = "loading"
+    manager.load_models()
+
+
+async def load_models_in_background():
+    """Load models without blocking startup, so the port is bound immediately."""
+    loop = asyncio.get_running_loop()
     try:
-        manager.load_models()
-        logger.info("service_ready", models_loaded=True)
+        await loop.run_in_executor(None, _initialize_models)
+        load_state.stage = "ready"
+        load_state.ready.set()
+        logger.info("service_ready", models_loaded=True, **load_state.progress())
     except RuntimeError as e:
+        load_state.stage = "failed"
+        load_state.error = str(e)
         logger.error("model_load_failed", error=str(e), error_type="RuntimeError")
-        # Don't raise - allow service to start for health checks
+        # Don't raise - keep serving health checks
     except Exception as e:
+        load_state.stage = "failed"
+        load_state.error = str(e)
         logger.exception("unexpected_startup_error", error=str(e))
+    finally:
+        load_state.finished.set()
+
+
+async def wait_for_models():
+    """
+    Hold a request until models are ready, up to settings.model_ready_wait_seconds.
+
+    Raises:
+        HTTPException: 503 if loading failed or did not finish in time
+    """
+    if load_state.ready.is_set():
+        return
+
+    logger.info("waiting_for_models", **load_state.progress())
+    try:
+        await asyncio.wait_for(load_state.finished.wait(), timeout=settings.model_ready_wait_seconds)
+    except asyncio.TimeoutError:
+        logger.error("generation_failed", reason="models_still_loading", **load_state.progress())
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Models still loading after {settings.model_ready_wait_seconds}s"
+        )
+
+    if not load_state.ready.is_set():
+        logger.error("generation_failed", reason="models_not_loaded", error=load_state.error)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Models not loaded"
+        )
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Start loading models in the background."""
+    logger.info("service_starting", environment=settings.environment)
+    load_state.started_at = time.time()
+    app.state.model_loader = asyncio.create_task(load_models_in_background())
 
 
 @app.on_event("shutdown")
@@ -259,7 +359,9 @@ async def shutdown_event():
     
     try:
         # Cleanup GPU memory
-        if manager.pipe:
+        if manager is not None and manager.pipe:
+            import torch
+
             del manager.pipe
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
@@ -295,49 +397,68 @@ def readiness():
     Readiness probe - can the service handle requests?
     
     Used by Kubernetes/Cloud Run to determine if the service is ready to receive traffic.
+    While models are loading in the background this returns 503 with loading progress.
     """
     # Check if models are loaded
-    if not manager.pipe:
-        logger.warning("readiness_check_failed", reason="models_not_loaded")
-        raise HTTPException(
+    if not load_state.ready.is_set() or not manager.pipe:
+        logger.warning("readiness_check_failed", reason="models_not_loaded", stage=load_state.stage)
+        return JSONResponse(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Models not loaded"
+            content=HealthResponse(
+                status="failed" if load_state.stage == "failed" else "loading",
+                gpu_available=False,
+                models_loaded=False,
+                loading=load_state.progress()
+            ).dict()
         )
-    
-    # Check GPU availability
+
+    # torch is already imported by the model stack at this point
+    import torch
+
+    # CPU mode (no GPU on this machine): models are loaded, nothing else to check
+    if manager.device == "cpu":
+        return HealthResponse(
+            status="ready",
+            gpu_available=False,
+            models_loaded=True,
+            loading=load_state.progress()
+        )
+
+    # Check GPU availability (models were loaded onto it)
     if not torch.cuda.is_available():
         logger.error("readiness_check_failed", reason="gpu_not_available")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="GPU not available"
         )
-    
-    # Check GPU memory
+
+    # Check GPU memory: driver-free memory plus blocks the caching allocator holds
+    # but is not using (memory_allocated alone ignores both the allocator cache and
+    # non-torch allocations such as the CUDA context and onnxruntime)
     gpu_memory_free_gb = None
     try:
-        gpu_memory = torch.cuda.get_device_properties(0).total_memory
-        gpu_memory_allocated = torch.cuda.memory_allocated(0)
-        gpu_memory_free = gpu_memory - gpu_memory_allocated
+        gpu_memory_free = manager.vram.available_bytes()
         gpu_memory_free_gb = gpu_memory_free / 1e9
-        
-        if gpu_memory_free < 1e9:  # Less than 1GB free
+    except Exception as e:
+        logger.warning("gpu_memory_check_failed", error=str(e))
+    else:
+        if gpu_memory_free < settings.readiness_min_free_mb * 1024 * 1024:
             logger.warning(
                 "low_gpu_memory",
                 free_gb=gpu_memory_free_gb,
-                allocated_gb=gpu_memory_allocated / 1e9
+                reserved_gb=torch.cuda.memory_reserved() / 1e9
             )
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="Low GPU memory"
             )
-    except Exception as e:
-        logger.warning("gpu_memory_check_failed", error=str(e))
-    
+
     return HealthResponse(
         status="ready",
         gpu_available=True,
         models_loaded=True,
-        gpu_memory_free_gb=gpu_memory_free_gb
+        gpu_memory_free_gb=gpu_memory_free_gb,
+        loading=load_state.progress()
     )
 
 
@@ -347,15 +468,55 @@ def health_check():
     """Legacy health check endpoint."""
     try:
         readiness_response = readiness()
+        if isinstance(readiness_response, JSONResponse):
+            return {
+                "status": "unhealthy",
+                "gpu_available": False,
+                "models_loaded": False,
+                "loading": load_state.progress()
+            }
         return readiness_response.dict()
     except HTTPException:
+        import torch
+
         return {
             "status": "unhealthy",
             "gpu_available": torch.cuda.is_available(),
-            "models_loaded": manager.pipe is not None
+            "models_loaded": manager is not None and manager.pipe is not None
         }
 
 
+# ============================================================================
+# Debug Endpoints
+# ============================================================================
+
+@app.get("/debug/warmup", tags=["Debug"])
+def debug_warmup():
+    """
+    Warm-up results per engine: per-bucket first-run latency and the
+    per-step/overhead baseline used for latency_regression alerts.
+    """
+    return {
+        "stage": load_state.stage,
+        "current_engine": manager.current_engine if manager is not None else None,
+        "engines": manager.warmup_report if manager is not None else {},
+    }
+
+
+@app.get("/debug/vram", tags=["Debug"])
+def debug_vram():
+    """
+    VRAM ledger: measured footprint of each resident component (UNet, VAE,
+    text encoders, ControlNet, LoRA adapters, IP-Adapter), activation peaks per
+    engine and bucket, offloaded modules and admission rejections, plus the
+    cross-request text K/V cache (entries, size, hits/misses/evictions).
+    """
+    if manager is None:
+        return {"stage": load_state.stage, "ledger": None, "text_kv_cache": None}
+    text_kv_cache = manager.text_kv_cache.summary() if manager.text_kv_cache is not None else None
+    return {"stage": load_state.stage, "ledger": manager.vram.ledger(), "text_kv_cache": text_kv_cache}
+
+
 # ============================================================================
 # Main API Endpoints
 # ============================================================================
@@ -376,21 +537,22 @@ async def generate_image(request: GenerateRequest):
     """
     req_id = request_id_var.get()
     start_time = time.time()
-    input_path = None
     
     logger.info(
         "generation_started",
         style=request.style,
         engine=request.engine,
+        quality=request.quality,
+        output_size=request.output_size,
+        all_faces=request.all_faces,
+        face_crop=request.face_crop,
         prompt_length=len(request.prompt),
         request_id=req_id
     )
     
-    # Check if models are loaded
-    # Note: manager.pipe might be None if we are switching engines, so we check inside process_image logic or here
-    # But readiness check relies on manager.pipe. 
-    # For dual engine, we might need to relax this or ensure at least one is loaded.
-    # For now, let's assume load_models() loads the default engine.
+    # Requests that arrive while models are still loading wait here (bounded)
+    # instead of failing; load_models() loads the default engine.
+    await wait_for_models()
     if not manager.pipe:
         logger.error("generation_failed", reason="models_not_loaded")
         raise HTTPException(
@@ -399,10 +561,10 @@ async def generate_image(request: GenerateRequest):
         )
     
     try:
-        # 1. Download Input Image
+        # 1. Download Input Image (decoded in memory, no temp file)
         logger.debug("downloading_image", url=str(request.image_url))
-        input_path = utils.download_image(str(request.image_url))
-        logger.info("image_downloaded", path=input_path)
+        input_image = utils.download_image(str(request.image_url))
+        logger.info("image_downloaded", width=input_image.shape[1], height=input_image.shape[0])
         
         # 2. Process Image with timeout
         logger.debug("processing_image", timeout=settings.processing_timeout_seconds)
@@ -414,10 +576,14 @@ async def generate_image(request: GenerateRequest):
                 loop.run_in_executor(
                     executor,
                     manager.process_image,
-                    input_path,
+                    input_image,
                     request.prompt,
                     request.style,
-                    request.engine
+                    request.engine,
+                    request.quality,
+                    request.output_size,
+                    request.all_faces,
+                    request.face_crop
                 ),
                 timeout=settings.processing_timeout_seconds
             )
@@ -440,9 +606,6 @@ async def generate_image(request: GenerateRequest):
         output_url = utils.upload_image(result_image)
         logger.info("result_uploaded", url=output_url)
         
-        # 4. Cleanup
-        utils.cleanup_file(input_path)
-        
         total_time = int((time.time() - start_time) * 1000)
         
         logger.info(
@@ -474,6 +637,17 @@ async def generate_image(request: GenerateRequest):
         )
         
     except RuntimeError as e:
+        # The model stack (and torch) is loaded once a request gets this far
+        from src.vram import VramAdmissionError
+
+        if isinstance(e, VramAdmissionError):
+            # Transient: the request may fit once in-flight work finishes
+            logger.warning("request_rejected_low_vram", error=str(e))
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+
         # Handle runtime errors (e.g., model errors)
         logger.error("runtime_error", error=str(e))
         raise HTTPException(
@@ -488,11 +662,6 @@ async def generate_image(request: GenerateRequest):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
         )
-        
-    finally:
-        # Always cleanup temp files
-        if input_path:
-            utils.cleanup_file(input_path)
 
 
 # ============================================================================
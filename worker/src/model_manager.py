@@ -1,30 +1,105 @@
 import os
-import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import torch
 from diffusers import (
     DiffusionPipeline,
     StableDiffusionXLControlNetPipeline,
     AutoencoderKL,
-    EulerDiscreteScheduler
+    EulerDiscreteScheduler,
+    UNet2DConditionModel
 )
 from diffusers.utils import load_image
 from diffusers.models import ControlNetModel
+from transformers import CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
 import cv2
 import numpy as np
 from PIL import Image
 from insightface.app import FaceAnalysis
 from google.cloud import storage
-from src.pipelines import StableDiffusionXLInstantIDPipeline
+from src.config import settings
+from src.buckets import fit_to_bucket, warmup_buckets
+from src.compiled import CompiledPipeline
+from src.face_crop import crop_to_region, face_crop_region, faces_in_crop, paste_back
+from src.feature_cache import UNetFeatureCache
+from src.kv_cache import TextKVCache
+from src.quality import DISTILLATION_ADAPTER, SchedulerSet, tier_config
+from huggingface_hub import hf_hub_download
+from src.loading import HostMemoryBudget, LoadTimeline, build_model_on_device, weight_stem
+from src.model_store import ModelStoreError, create_model_store
+from src.quantization import QUANTIZED_VARIANT
+from src.snapshot import load_snapshot
+from src.token_merging import TokenMerging
+from src.vae_tiling import AutoTiledVae
+from src.vram import VramAdmissionError, VramManager
+from src.logger import get_logger
+from src.pipelines import StableDiffusionXLInstantIDPipeline, draw_kps, identity_region_masks
+
+logger = get_logger(__name__)
+
+SDXL_BASE_REPO = "stabilityai/stable-diffusion-xl-base-1.0"
+VAE_FP16_REPO = "madebyollin/sdxl-vae-fp16-fix"
+SNAPSHOT_KEY = "snapshots/instantid"
+IP_ADAPTER_CONTROLNET_SCALE = 0.5  # Structure strength (lower = more style freedom)
+
+# Style fragment appended to the user prompt (unknown styles use "<style> style")
+STYLE_PROMPTS = {
+    # EXISTING STYLES
+    "anime": "anime art style, vibrant colors, cel shading, manga illustration, Japanese animation",
+    "cartoon": "cartoon style, bold outlines, flat colors, animated character design, Western animation",
+    "bollywood": "Bollywood movie star, dramatic Indian cinema style, vibrant colors, cinematic lighting",
+    "cinematic": "cinematic photography, professional film still, dramatic lighting, depth of field",
+    "natural": "natural photography, realistic, soft lighting, photorealistic",
+    "corporate": "corporate headshot, professional business portrait, neutral background",
+    "artistic": "artistic portrait, painterly style, creative interpretation",
+    "vintage": "vintage photography, classic portrait, timeless aesthetic, film grain",
+    "glamour": "glamour photography, elegant portrait, sophisticated lighting",
+    "pixar": "Pixar animation style, 3D character, glossy rendering, animated feature film",
+    
+    # NEW VIRAL EFFECTS (LoRA-based)
+    "ps2": "ps2 graphics, playstation 2 game character, low poly, early 2000s video game graphics, retro gaming",
+    "pixel": "16-bit pixel art portrait, retro game sprite, dithered shading, pixel perfect, classic video game",
+    "aesthetic": "aesthetic portrait, soft pastel colors, dreamy atmosphere, instagram aesthetic, soft focus, ethereal",
+    
+    # NEW VIRAL EFFECTS (Prompt-only, no LoRA needed)
+    "yearbook": "professional yearbook portrait, studio lighting, formal attire, clean white background, 1990s school photo aesthetic, neutral expression, passport photo style",
+    "kpop": "k-pop idol portrait, korean beauty aesthetic, glass skin, soft lighting, pastel colors, kpop mv style, korean drama cinematography, perfect skin, dewy makeup",
+    "bollywood_poster": "dramatic bollywood movie poster, cinematic lighting, intense expression, vibrant colors, hand-painted poster art style, 1990s hindi film aesthetic, theatrical pose",
+    "y2k": "y2k aesthetic, 2000s digital camera photo, low quality, flash photography, early 2000s party photo, nostalgic, disposable camera feel",
+    "couple_aesthetic": "romantic couple portrait, soft pastel colors, dreamy atmosphere, aesthetic photography, golden hour lighting, instagram couple goals, soft focus",
+    "mermaid": "mermaid portrait, shimmering fish scales, iridescent skin, underwater glow, flowing hair, ethereal beauty, ocean depths, fantasy creature",
+    "sigma": "dramatic black and white portrait, intense gaze, cinematic lighting, powerful presence, sigma male aesthetic, motivational poster style",
+    "thug_life": "cool portrait, confident expression, urban style, street photography, hip hop aesthetic",
+}
+
+# Negative prompt to avoid artifacts while allowing style transformation
+NEGATIVE_PROMPT = "monochrome, lowres, bad anatomy, worst quality, low quality, blurry, nsfw, nude"
+
 
 class ModelManager:
     def __init__(self, bucket_name):
         self.bucket_name = bucket_name
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # fp16 on GPU; bf16 (or fp32) on CPU, where fp16 matmuls have no fast kernels
+        self.dtype = torch.float16 if self.device == "cuda" else getattr(torch, settings.cpu_dtype)
         self.pipe = None  # Current active pipeline
         self.current_engine = None # "instantid" or "ip_adapter"
         self.app = None # InsightFace app (InstantID only)
         self.style_loras = {}  # Cache for loaded style LoRAs
         self.current_lora = None  # Track currently active LoRA
+        self.load_timeline = None  # Per-component timings of the last engine load
+        self.store = create_model_store()  # Manifest-driven model resolution on the GCS mount
+        self.compiled = None  # CompiledPipeline when ENABLE_COMPILE is set
+        self.schedulers = None  # Per-quality-tier schedulers for the active pipeline
+        self.distillation_loaded = False  # LCM-LoRA adapter available for the "fast" tier
+        self.warmup_report = {}  # engine -> warm-up results and per-bucket baseline latency
+        self.vram = VramManager(self.device)  # GPU memory ledger and request admission
+        self.vae_tiling = None  # Per-call tiled VAE encode/decode policy for the active pipeline
+        self.unet_cache = None  # Cross-step deep UNet feature cache for the active pipeline
+        self.token_merging = None  # Self-attention token merging (ToMe) for the active pipeline
+        self.text_kv_cache = None  # Cross-request text cross-attention K/V (InstantID, TEXT_KV_CACHE_MB)
+        self.adapter_state = "none"  # Active LoRA adapters and weights, part of the text K/V cache key
 
         # Use /tmp for HuggingFace cache (models download ~12GB on first run)
         # In production, consider pre-downloading to GCS or baking into image
@@ -34,146 +109,265 @@ class ModelManager:
         os.environ["TRANSFORMERS_CACHE"] = self.cache_dir
         print(f"HuggingFace cache directory: {self.cache_dir}")
 
-    def load_models(self):
-        print(f"Loading models on {self.device}...")
-
         if self.device == "cpu":
-            print("WARNING: Running on CPU. This will be slow.")
-            return
-
-        # Models are mounted from GCS at /gcs/models/
-        gcs_models_path = "/gcs/models"
+            self._configure_cpu()
 
-        # Check if GCS mount exists
-        if not os.path.exists(gcs_models_path):
-            print(f"WARNING: GCS models path not found: {gcs_models_path}")
-            print("Proceeding with HuggingFace Hub downloads")
-
-        # 1. Load Face Analysis (InsightFace AntelopeV2)
-        print("\n1️⃣ Loading Face Analysis Model (AntelopeV2)...")
+    def _configure_cpu(self):
+        """Size torch's thread pool to the CPUs this process may actually use (cgroup/affinity)."""
+        available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        threads = settings.cpu_threads or available
+        torch.set_num_threads(threads)
         try:
-            # InsightFace needs writable directory for cache
-            # Use /tmp since GCS mount is read-only
-            insightface_root = '/tmp/insightface'
-            os.makedirs(insightface_root, exist_ok=True)
-
-            # Check if we can copy from GCS to avoid download
-            antelopev2_gcs = os.path.join(gcs_models_path, 'antelopev2')
-            antelopev2_tmp = os.path.join(insightface_root, 'models', 'antelopev2')
-
-            if os.path.exists(antelopev2_gcs) and not os.path.exists(antelopev2_tmp):
-                print(f"Copying AntelopeV2 from GCS to /tmp...")
-                os.makedirs(os.path.dirname(antelopev2_tmp), exist_ok=True)
-                shutil.copytree(antelopev2_gcs, antelopev2_tmp)
-                print("✓ Copied from GCS")
-            elif os.path.exists(antelopev2_tmp):
-                print("✓ Using cached AntelopeV2 from /tmp")
+            # One denoising loop at a time: inter-op parallelism only oversubscribes
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # Already fixed once any parallel work has run
+        logger.info("cpu_mode", threads=threads, available_cpus=available, dtype=settings.cpu_dtype)
+
+    def _synchronize(self):
+        if self.device == "cuda":
+            torch.cuda.synchronize()
+
+    def _resolve(self, key, subdir="", repo_id=None, weight_name=None, variant=None):
+        """Resolve a component to its staged local directory by manifest key.
+
+        Returns None when the component is missing and Hub downloads are
+        allowed (dev only), so the caller loads `repo_id` instead. Otherwise a
+        missing component raises ModelStoreError straight away.
+        """
+        if repo_id and settings.allow_hub_downloads and not self.store.has(key, subdir):
+            print(f"⚠️  {key}/{subdir} not in model manifest, using HuggingFace: {repo_id}")
+            return None
+        return self.store.path(key, subdir, weight_name=weight_name, variant=variant)
+
+    def _load_component(self, model_cls, key, subdir, repo_id, variant=None, budget=None):
+        """Load a single model component directly onto the target device.
+
+        The component is staged from the models mount to local disk, then its
+        weights are memory-mapped and streamed tensor by tensor to the device.
+        HuggingFace Hub ids (dev fallback) go through from_pretrained.
+        """
+        variant = self._weight_variant(model_cls, key, subdir, variant)
+        local_dir = self._resolve(key, subdir, repo_id, weight_name=weight_stem(model_cls), variant=variant)
+        if local_dir:
+            try:
+                return build_model_on_device(
+                    model_cls, local_dir, self.device, self.dtype, variant=variant, budget=budget
+                )
+            except (FileNotFoundError, RuntimeError) as e:
+                print(f"⚠️  Streaming load failed for {local_dir}, using from_pretrained: {e}")
+                return model_cls.from_pretrained(
+                    local_dir, torch_dtype=self.dtype, variant=variant
+                ).to(self.device)
+
+        kwargs = {"subfolder": subdir} if subdir else {}
+        return model_cls.from_pretrained(
+            repo_id, torch_dtype=self.dtype, variant=variant, **kwargs
+        ).to(self.device)
+
+    def _weight_variant(self, model_cls, key, subdir, variant):
+        """Pick the weight file variant for this device and precision.
+
+        - ENABLE_INT8_WEIGHTS: the offline-quantized int8 UNet/ControlNet weights
+        - fp32 on CPU: the full-precision file, so weights stay memory-mapped
+          instead of being upcast into a private copy
+        """
+        prefix = f"{subdir}/" if subdir else ""
+        files = self.store.files(key)
+        if settings.enable_int8_weights and model_cls in (UNet2DConditionModel, ControlNetModel):
+            if f"{prefix}{weight_stem(model_cls)}.{QUANTIZED_VARIANT}.safetensors" in files:
+                return QUANTIZED_VARIANT
+            logger.warning("int8_weights_missing", component=f"{key}/{subdir}", fallback=variant or "default")
+        elif self.dtype == torch.float32 and variant == "fp16":
+            if f"{prefix}{weight_stem(model_cls)}.safetensors" in files:
+                return None
+        return variant
+
+    def _load_tokenizers_and_scheduler(self):
+        """Tokenizers and the (Euler) scheduler are tiny config-only components."""
+        components = {}
+        # Use Euler scheduler for better results (recommended for InstantID)
+        for name, component_cls in (
+            ("tokenizer", CLIPTokenizer),
+            ("tokenizer_2", CLIPTokenizer),
+            ("scheduler", EulerDiscreteScheduler),
+        ):
+            local_dir = self._resolve("sdxl-base", name, SDXL_BASE_REPO)
+            if local_dir:
+                components[name] = component_cls.from_pretrained(local_dir)
             else:
-                print("Downloading AntelopeV2 to /tmp (first run only)...")
+                components[name] = component_cls.from_pretrained(SDXL_BASE_REPO, subfolder=name)
+        return components
+
+    def _submit_sdxl_components(self, pool, timeline, budget):
+        """Submit SDXL base + VAE component loads to the pool, returning {name: future}."""
+        futures = {}
+        # Largest components first so they start on the first free workers
+        for name, model_cls in (
+            ("unet", UNet2DConditionModel),
+            ("text_encoder_2", CLIPTextModelWithProjection),
+            ("text_encoder", CLIPTextModel),
+        ):
+            futures[name] = pool.submit(
+                timeline.track, name, self._load_component, model_cls,
+                "sdxl-base", name, SDXL_BASE_REPO, variant="fp16", budget=budget
+            )
 
-            self.app = FaceAnalysis(name='antelopev2', root=insightface_root, providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-            self.app.prepare(ctx_id=0, det_size=(640, 640))
-            print("✓ Face analysis model loaded")
-        except Exception as e:
-            print(f"❌ Failed to load face analysis: {e}")
-            raise RuntimeError("Face analysis is required for InstantID")
+        # VAE FP16 fix to prevent numerical instabilities
+        futures["vae"] = pool.submit(
+            timeline.track, "vae", self._load_component, AutoencoderKL,
+            "vae-fp16", "", VAE_FP16_REPO, budget=budget
+        )
+        futures["tokenizers_scheduler"] = pool.submit(
+            timeline.track, "tokenizers_scheduler", self._load_tokenizers_and_scheduler
+        )
+        return futures
+
+    @staticmethod
+    def _collect_sdxl_components(futures):
+        components = {name: future.result() for name, future in futures.items()}
+        components.update(components.pop("tokenizers_scheduler"))
+        return components
+
+    def _load_face_analysis(self):
+        # InsightFace expects <root>/models/antelopev2; point it at the staged copy
+        insightface_root = settings.insightface_root
+        antelopev2_link = os.path.join(insightface_root, 'models', 'antelopev2')
+
+        antelopev2_dir = self._resolve("antelopev2", repo_id="DIAMONIK7777/antelopev2")
+        if antelopev2_dir and not os.path.exists(antelopev2_link):
+            os.makedirs(os.path.dirname(antelopev2_link), exist_ok=True)
+            os.symlink(antelopev2_dir, antelopev2_link)
+            print(f"✓ AntelopeV2 staged at {antelopev2_dir}")
+        elif not antelopev2_dir:
+            print("Downloading AntelopeV2 to /tmp (first run only)...")
+
+        app = FaceAnalysis(name='antelopev2', root=insightface_root, providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+        app.prepare(ctx_id=0 if self.device == "cuda" else -1, det_size=(640, 640))
+        return app
+
+    def build_instantid_pipeline(self, pool, timeline, budget, use_snapshot=True):
+        """Assemble the InstantID pipeline with its IP-Adapter loaded.
+
+        Restores from the single-file snapshot when the manifest lists one,
+        otherwise loads each component concurrently on `pool` and runs
+        set_ip_adapter. Attention optimizations are applied by the caller.
+        """
+        # The snapshot holds fp16 weights; int8 mode always assembles from components
+        if (use_snapshot and settings.use_pipeline_snapshot and not settings.enable_int8_weights
+                and self.store.has(SNAPSHOT_KEY)):
+            print(f"\n⚡ Restoring InstantID pipeline from snapshot: {SNAPSHOT_KEY}")
+            try:
+                snapshot_dir = timeline.track("snapshot_stage", self.store.path, SNAPSHOT_KEY)
+                pipe = timeline.track("snapshot", load_snapshot, snapshot_dir, self.device, self.dtype, budget=budget)
+                print("✓ InstantID pipeline restored from snapshot")
+                return pipe
+            except (ValueError, RuntimeError) as e:
+                print(f"⚠️  Snapshot restore failed, loading components instead: {e}")
+
+        controlnet_future = pool.submit(
+            timeline.track, "controlnet", self._load_component, ControlNetModel,
+            "instantid", "ControlNetModel", "InstantX/InstantID", budget=budget
+        )
+        sdxl_futures = self._submit_sdxl_components(pool, timeline, budget)
 
-        # 2. Load InstantID ControlNet
+        # InstantID ControlNet
         print("\n2️⃣ Loading InstantID ControlNet...")
         try:
-            controlnet_path = os.path.join(gcs_models_path, 'instantid/ControlNetModel') if os.path.exists(gcs_models_path) else None
-
-            if controlnet_path and os.path.exists(controlnet_path):
-                print(f"Loading ControlNet from GCS: {controlnet_path}")
-                controlnet = ControlNetModel.from_pretrained(
-                    controlnet_path,
-                    torch_dtype=torch.float16
-                )
-            else:
-                print("Loading ControlNet from HuggingFace...")
-                controlnet = ControlNetModel.from_pretrained(
-                    "InstantX/InstantID",
-                    subfolder="ControlNetModel",
-                    torch_dtype=torch.float16
-                )
+            controlnet = controlnet_future.result()
             print("✓ ControlNet loaded")
         except Exception as e:
             print(f"❌ Failed to load ControlNet: {e}")
             raise
 
-        # 3. Load SDXL Base Model with InstantID
+        # SDXL Base Model with InstantID
         print("\n3️⃣ Loading SDXL InstantID Pipeline...")
+        components = self._collect_sdxl_components(sdxl_futures)
 
-        # Check for SDXL in GCS first (GPU best practice: pre-download models)
-        sdxl_gcs_path = os.path.join(gcs_models_path, 'sdxl-base') if os.path.exists(gcs_models_path) else None
-        if sdxl_gcs_path and os.path.exists(sdxl_gcs_path):
-            print(f"Loading SDXL from GCS: {sdxl_gcs_path}")
-            base_model_path = sdxl_gcs_path
-        else:
-            print("Loading SDXL from HuggingFace (first run only)...")
-            base_model_path = "stabilityai/stable-diffusion-xl-base-1.0"
-
-        # Load VAE FP16 fix to prevent numerical instabilities
-        print("Loading VAE with FP16 fix...")
-        vae_gcs_path = os.path.join(gcs_models_path, 'vae-fp16') if os.path.exists(gcs_models_path) else None
-        if vae_gcs_path and os.path.exists(vae_gcs_path):
-            print(f"Loading VAE from GCS: {vae_gcs_path}")
-            vae = AutoencoderKL.from_pretrained(
-                vae_gcs_path,
-                torch_dtype=torch.float16
-            )
-        else:
-            print("Loading VAE from HuggingFace (first run only)...")
-            vae = AutoencoderKL.from_pretrained(
-                "madebyollin/sdxl-vae-fp16-fix",
-                torch_dtype=torch.float16
-            )
-
-        # Load InstantID Pipeline (local bundled version - diffusers 0.27.2 compatible)
-        self.pipe = StableDiffusionXLInstantIDPipeline.from_pretrained(
-            base_model_path,
-            controlnet=controlnet,
-            vae=vae,
-            torch_dtype=torch.float16,
-            use_safetensors=True,
-            variant="fp16"
-        ).to(self.device)
+        # Assemble InstantID Pipeline (local bundled version - diffusers 0.27.2 compatible)
+        # Components are already on the device, so no .to(self.device) copy is needed
+        pipe = StableDiffusionXLInstantIDPipeline(controlnet=controlnet, **components)
+        print("✓ Euler scheduler configured")
 
         # Load IP-Adapter
         print("Loading IP-Adapter...")
         try:
-            ip_adapter_path = os.path.join(gcs_models_path, 'instantid/ip-adapter.bin') if os.path.exists(gcs_models_path) else None
-
-            if ip_adapter_path and os.path.exists(ip_adapter_path):
-                print(f"Loading IP-Adapter from GCS: {ip_adapter_path}")
-                self.pipe.load_ip_adapter_instantid(ip_adapter_path)
-            else:
+            if self.store.has("instantid", "ip-adapter.safetensors"):
+                # Converted once by download_models.py: single memory-mapped pass, no unpickling
+                ip_adapter_path = self.store.file("instantid", "ip-adapter.safetensors")
+            elif settings.allow_hub_downloads and not self.store.has("instantid", "ip-adapter.bin"):
                 print("Loading IP-Adapter from HuggingFace...")
-                self.pipe.load_ip_adapter_instantid("InstantX/InstantID")
+                ip_adapter_path = hf_hub_download("InstantX/InstantID", "ip-adapter.bin")
+            else:
+                ip_adapter_path = self.store.file("instantid", "ip-adapter.bin")
+            timeline.track("ip_adapter", pipe.load_ip_adapter_instantid, ip_adapter_path)
 
             # Set optimal IP-Adapter scale for face preservation
-            self.pipe.set_ip_adapter_scale(0.8)
+            pipe.set_ip_adapter_scale(0.8)
             print("✓ IP-Adapter loaded (scale: 0.8)")
         except Exception as e:
             print(f"❌ Failed to load IP-Adapter: {e}")
             raise
 
-        # Use Euler scheduler for better results (recommended for InstantID)
-        self.pipe.scheduler = EulerDiscreteScheduler.from_config(
-            self.pipe.scheduler.config
-        )
-        print("✓ Euler scheduler configured")
+        return pipe
 
-        # 2025 Optimization: Enable attention slicing for memory efficiency
-        self.pipe.enable_attention_slicing()
-        print("✓ Attention slicing enabled")
+    def _unload_engine(self):
+        """Drop the active pipeline and every helper holding its modules, so its VRAM can be freed."""
+        if self.pipe is None:
+            return
+        print("Unloading previous engine...")
+        if self.compiled is not None:
+            self.compiled.remove()
+        if self.vae_tiling is not None:
+            self.vae_tiling.remove()  # Restores the VAE's own encode/decode
+        self.compiled = None
+        self.vae_tiling = None
+        self.unet_cache = None  # Holds the UNet and its deep blocks
+        self.token_merging = None  # Holds the UNet and its attn1 modules
+        self.text_kv_cache = None  # Holds GPU tensors of the unloaded engine
+        self.pipe = None
+        self.current_engine = None
+        self.vram.release_engine()
 
-        # 2025 Optimization: Enable xFormers or SDPA for faster attention
-        try:
-            self.pipe.enable_xformers_memory_efficient_attention()
-            print("✓ xFormers memory efficient attention enabled")
-        except Exception as e:
-            print(f"xFormers not available (using PyTorch SDPA): {e}")
+    def load_models(self):
+        print(f"Loading models on {self.device} ({self.dtype})...")
+
+        # Free the previous engine (e.g. IP-Adapter) before this one is built
+        self._unload_engine()
+
+        # Every component is resolved through the manifest on the GCS mount
+        if not self.store.available and not settings.allow_hub_downloads:
+            raise ModelStoreError(f"Model manifest unavailable at {self.store.manifest_path}")
+
+        # All components load concurrently; weights stream straight to the device and
+        # the host memory budget caps how much is staged on the CPU at any time.
+        budget = HostMemoryBudget(settings.load_host_memory_budget_mb * 1024 * 1024)
+        timeline = LoadTimeline()
+        self.load_timeline = timeline.events  # Updated live as components finish
+
+        with ThreadPoolExecutor(max_workers=settings.model_load_workers, thread_name_prefix="model-load") as pool:
+            face_future = pool.submit(timeline.track, "face_analysis", self._load_face_analysis)
+
+            pipe = self.build_instantid_pipeline(pool, timeline, budget)
+
+            # Face Analysis (InsightFace AntelopeV2)
+            print("\n1️⃣ Loading Face Analysis Model (AntelopeV2)...")
+            try:
+                self.app = face_future.result()
+                print("✓ Face analysis model loaded")
+            except Exception as e:
+                print(f"❌ Failed to load face analysis: {e}")
+                raise RuntimeError("Face analysis is required for InstantID")
+
+        self.pipe = pipe
+        self._optimize_pipeline()
+        self._prepare_quality_tiers(timeline)
+        self.vram.register_pipeline("instantid", self.pipe)
+        if settings.enable_warmup or settings.enable_compile:
+            timeline.track("warm_up", self.warm_up, "instantid")
+
+        timeline.log_summary(engine="instantid", peak_staged_mb=round(budget.peak / 1024 / 1024))
+        self.store.release()  # Staged copies are no longer needed once the weights are on the device
 
         print("✓ InstantID pipeline loaded successfully!")
         self.current_engine = "instantid"
@@ -188,45 +382,45 @@ class ModelManager:
             return
 
         # Unload previous engine if exists to save VRAM
-        if self.pipe is not None:
-            print("Unloading previous engine...")
-            del self.pipe
-            torch.cuda.empty_cache()
-            self.pipe = None
+        self._unload_engine()
+
+        budget = HostMemoryBudget(settings.load_host_memory_budget_mb * 1024 * 1024)
+        timeline = LoadTimeline()
+        self.load_timeline = timeline.events  # Updated live as components finish
+
+        with ThreadPoolExecutor(max_workers=settings.model_load_workers, thread_name_prefix="model-load") as pool:
+            # 1. Load ControlNet Canny (Structure)
+            print("Loading ControlNet Canny...")
+            controlnet_future = pool.submit(
+                timeline.track, "controlnet_canny", self._load_component, ControlNetModel,
+                "controlnet-canny", "", "diffusers/controlnet-canny-sdxl-1.0", variant="fp16", budget=budget
+            )
 
-        gcs_models_path = "/gcs/models"
-        
-        # 1. Load SDXL Base
-        print("Loading SDXL Base...")
-        sdxl_path = os.path.join(gcs_models_path, 'sdxl-base') if os.path.exists(gcs_models_path) else "stabilityai/stable-diffusion-xl-base-1.0"
-        
-        # 2. Load ControlNet Canny (Structure)
-        print("Loading ControlNet Canny...")
-        canny_path = os.path.join(gcs_models_path, 'controlnet-canny') if os.path.exists(gcs_models_path) else "diffusers/controlnet-canny-sdxl-1.0"
-        controlnet = ControlNetModel.from_pretrained(canny_path, torch_dtype=torch.float16)
+            # 2. Load SDXL Base + VAE
+            print("Loading SDXL Base and VAE...")
+            sdxl_futures = self._submit_sdxl_components(pool, timeline, budget)
 
-        # 3. Load VAE
-        print("Loading VAE...")
-        vae_path = os.path.join(gcs_models_path, 'vae-fp16') if os.path.exists(gcs_models_path) else "madebyollin/sdxl-vae-fp16-fix"
-        vae = AutoencoderKL.from_pretrained(vae_path, torch_dtype=torch.float16)
+            controlnet = controlnet_future.result()
+            components = self._collect_sdxl_components(sdxl_futures)
 
-        # 4. Initialize Pipeline
+        # 3. Initialize Pipeline
         print("Initializing SDXL ControlNet Pipeline...")
-        self.pipe = StableDiffusionXLControlNetPipeline.from_pretrained(
-            sdxl_path,
-            controlnet=controlnet,
-            vae=vae,
-            torch_dtype=torch.float16,
-            use_safetensors=True,
-            variant="fp16"
-        ).to(self.device)
+        self.pipe = StableDiffusionXLControlNetPipeline(controlnet=controlnet, **components)
 
-        # 5. Load IP-Adapter
+        # 4. Load IP-Adapter
         print("Loading IP-Adapter weights...")
-        ip_adapter_path = os.path.join(gcs_models_path, 'ip-adapter') if os.path.exists(gcs_models_path) else "h94/IP-Adapter"
-        
+        if settings.allow_hub_downloads and not self.store.has("ip-adapter"):
+            ip_adapter_path = "h94/IP-Adapter"
+        else:
+            weight_path = self.store.file("ip-adapter", "sdxl_models/ip-adapter_sdxl.safetensors")
+            if self.store.has("ip-adapter", "sdxl_models/image_encoder"):
+                self.store.path("ip-adapter", "sdxl_models/image_encoder")
+            ip_adapter_path = os.path.dirname(os.path.dirname(weight_path))
+
         # Load Standard SDXL IP-Adapter
-        self.pipe.load_ip_adapter(
+        timeline.track(
+            "ip_adapter",
+            self.pipe.load_ip_adapter,
             ip_adapter_path, 
             subfolder="sdxl_models", 
             weight_name="ip-adapter_sdxl.safetensors"
@@ -235,17 +429,232 @@ class ModelManager:
         # Set scale (0.6-0.8 is good for likeness)
         self.pipe.set_ip_adapter_scale(0.7)
 
-        # Optimize
-        self.pipe.scheduler = EulerDiscreteScheduler.from_config(self.pipe.scheduler.config)
-        self.pipe.enable_attention_slicing()
-        try:
-            self.pipe.enable_xformers_memory_efficient_attention()
-        except:
-            pass
+        self._optimize_pipeline()
+        self._prepare_quality_tiers(timeline)
+        self.vram.register_pipeline("ip_adapter", self.pipe)
+        if settings.enable_warmup or settings.enable_compile:
+            timeline.track("warm_up", self.warm_up, "ip_adapter")
+
+        timeline.log_summary(engine="ip_adapter", peak_staged_mb=round(budget.peak / 1024 / 1024))
+        self.store.release()  # Staged copies are no longer needed once the weights are on the device
 
         self.current_engine = "ip_adapter"
         print("✓ IP-Adapter Engine loaded successfully!")
 
+    def _optimize_pipeline(self):
+        """Device-specific execution settings for a newly assembled pipeline."""
+        self.vae_tiling = AutoTiledVae(self.pipe.vae, self.vram)
+        self.unet_cache = UNetFeatureCache(self.pipe.unet)
+        self.token_merging = TokenMerging(self.pipe.unet, self.pipe.vae_scale_factor)
+
+        instantid = isinstance(self.pipe, StableDiffusionXLInstantIDPipeline)
+        if instantid:
+            # The InstantID processors pick their own kernel; diffusers' xFormers/slicing
+            # switches would replace them and drop the identity attention
+            backend = self.pipe.set_attention_backend(settings.attention_backend)
+            print(f"✓ InstantID attention backend: {backend}")
+        self.text_kv_cache = None
+        if instantid and settings.text_kv_cache_mb > 0:
+            self.text_kv_cache = TextKVCache(settings.text_kv_cache_mb)
+        self.pipe.text_kv_cache = self.text_kv_cache
+
+        if self.device == "cpu":
+            # oneDNN convolutions are fastest on NHWC; slicing and xFormers only cost time on CPU
+            for name in ("unet", "controlnet", "vae"):
+                module = getattr(self.pipe, name, None)
+                if module is not None:
+                    module.to(memory_format=torch.channels_last)
+            print("✓ channels_last memory format enabled (CPU)")
+            return
+
+        if instantid:
+            return
+
+        # Attention slicing trades speed for memory; the VAE decode peak is covered by tiling
+        if settings.enable_attention_slicing:
+            self.pipe.enable_attention_slicing()
+            print("✓ Attention slicing enabled")
+
+        # 2025 Optimization: Enable xFormers or SDPA for faster attention
+        if settings.enable_xformers:
+            try:
+                self.pipe.enable_xformers_memory_efficient_attention()
+                print("✓ xFormers memory efficient attention enabled")
+            except Exception as e:
+                print(f"xFormers not available (using PyTorch SDPA): {e}")
+
+    def _prepare_quality_tiers(self, timeline):
+        """Set up per-tier schedulers and the step-distillation adapter on a new pipeline."""
+        self.current_lora = None  # A new pipeline has no style adapters
+        self.schedulers = SchedulerSet(self.pipe.scheduler.config)
+        timeline.track("distillation_lora", self._load_distillation_lora)
+
+    def _load_distillation_lora(self):
+        """Load the LCM-LoRA adapter for the "fast" tier; it stays disabled until a fast request."""
+        self.distillation_loaded = False
+        try:
+            if settings.allow_hub_downloads and not self.store.has("lcm-lora-sdxl"):
+                print("Loading LCM-LoRA from HuggingFace...")
+                self.pipe.load_lora_weights("latent-consistency/lcm-lora-sdxl", adapter_name=DISTILLATION_ADAPTER)
+            else:
+                lora_path = self.store.file("lcm-lora-sdxl", "pytorch_lora_weights.safetensors")
+                self.pipe.load_lora_weights(lora_path, adapter_name=DISTILLATION_ADAPTER)
+            self.pipe.disable_lora()
+            self.distillation_loaded = True
+            print("✓ LCM-LoRA loaded for the fast tier")
+        except Exception as e:
+            print(f"⚠️  LCM-LoRA unavailable, 'fast' tier disabled: {e}")
+
+    def _activate_adapters(self, lora_scale, distilled):
+        """Enable the style LoRA and/or the distillation adapter for this request only.
+
+        Returns:
+            True if any adapter is active
+        """
+        names, weights = [], []
+        if self.current_lora is not None and lora_scale > 0:
+            names.append(self.current_lora)
+            weights.append(lora_scale)
+        if distilled:
+            names.append(DISTILLATION_ADAPTER)
+            weights.append(1.0)
+
+        self.adapter_state = "+".join(f"{name}@{weight:g}" for name, weight in zip(names, weights)) or "none"
+        if names:
+            self.pipe.enable_lora()
+            self.pipe.set_adapters(names, adapter_weights=weights)
+        elif self.current_lora is not None or self.distillation_loaded:
+            self.pipe.disable_lora()
+        return bool(names)
+
+    def _synthetic_generation_kwargs(self, engine, width, height, batch_size):
+        """Pipeline arguments for a synthetic generation matching a real request's shapes and constants."""
+        kwargs = {
+            "prompt": "warm-up",
+            "negative_prompt": "warm-up",
+            "width": width,
+            "height": height,
+            "num_images_per_prompt": batch_size,
+            # Enough steps for CUDA graphs to warm up, record and replay
+            "num_inference_steps": 3,
+            "guidance_scale": 5.0,
+        }
+        if engine == "ip_adapter":
+            kwargs.update(
+                ip_adapter_image=Image.new("RGB", (224, 224)),
+                image=Image.new("RGB", (width, height)),
+                controlnet_conditioning_scale=IP_ADAPTER_CONTROLNET_SCALE,
+            )
+        else:
+            kwargs.update(
+                image_embeds=np.zeros(512, dtype=np.float32),
+                image=Image.new("RGB", (width, height)),
+                controlnet_conditioning_scale=settings.controlnet_scale,
+                controlnet_cache_interval=settings.controlnet_cache_interval,
+            )
+        return kwargs
+
+    def _timed_synthetic_generation(self, engine, width, height, batch_size, steps):
+        """Run one synthetic generation; return total, per-step and fixed-overhead latency in ms."""
+        marks = []
+
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            self._synchronize()
+            marks.append(time.perf_counter())
+            return callback_kwargs
+
+        kwargs = self._synthetic_generation_kwargs(engine, width, height, batch_size)
+        kwargs["num_inference_steps"] = steps
+        self._synchronize()
+        start = time.perf_counter()
+        with torch.inference_mode():
+            self.pipe(**kwargs, callback_on_step_end=on_step_end)
+        self._synchronize()
+        total_ms = (time.perf_counter() - start) * 1000
+
+        # The first interval includes prompt encoding, so per-step time uses the rest
+        intervals = sorted((b - a) * 1000 for a, b in zip(marks, marks[1:]))
+        step_ms = intervals[len(intervals) // 2]
+        return {
+            "total_ms": round(total_ms, 1),
+            "step_ms": round(step_ms, 1),
+            "overhead_ms": round(total_ms - steps * step_ms, 1),
+        }
+
+    def warm_up(self, engine):
+        """Run short synthetic generations per bucket before the engine serves traffic.
+
+        The first pass per bucket absorbs cuDNN algorithm selection, allocator
+        growth and lazy kernel loading (and compilation when ENABLE_COMPILE is
+        set); the second pass is recorded as that bucket's baseline latency.
+        """
+        if settings.enable_compile:
+            self.compiled = CompiledPipeline(self.pipe)
+            if isinstance(self.pipe, StableDiffusionXLInstantIDPipeline):
+                self.pipe.cache_attention_kv = False
+
+        started = time.perf_counter()
+        steps = settings.warmup_steps
+        buckets = {}
+        for width, height, batch_size in warmup_buckets(self.device):
+            first = self._timed_synthetic_generation(engine, width, height, batch_size, steps)
+            # Allocator and workspaces are settled after the first pass: measure the activation peak
+            with self.vram.measure(engine, width, height, batch_size):
+                baseline = self._timed_synthetic_generation(engine, width, height, batch_size, steps)
+            baseline["first_run_ms"] = first["total_ms"]
+            buckets[f"{width}x{height}x{batch_size}"] = baseline
+            print(f"✓ Warmed up {engine} {width}x{height} x{batch_size}: "
+                  f"{baseline['step_ms']:.0f}ms/step (first run {first['total_ms'] / 1000:.1f}s)")
+
+            if self.compiled and engine == "instantid" and min([settings.cfg_cutoff, *settings.cfg_cutoff_by_style.values()]) < 1.0:
+                # Steps after a CFG cutoff run only the conditional half of the batch; compile that
+                # shape too (one guided step, the rest conditional-only) before compiled shapes seal
+                kwargs = self._synthetic_generation_kwargs(engine, width, height, batch_size)
+                kwargs.update(num_inference_steps=steps, guidance_end=1 / steps)
+                with torch.inference_mode():
+                    self.pipe(**kwargs)
+
+        if self.compiled:
+            self.compiled.seal()
+
+        self.warmup_report[engine] = {
+            "completed_at": datetime.utcnow().isoformat() + "Z",
+            "duration_s": round(time.perf_counter() - started, 1),
+            "steps": steps,
+            "compiled": self.compiled is not None,
+            "buckets": buckets,
+        }
+        logger.info(
+            "warmup_completed",
+            engine=engine,
+            duration_s=self.warmup_report[engine]["duration_s"],
+            compiled=self.compiled is not None,
+            step_ms={key: bucket["step_ms"] for key, bucket in buckets.items()}
+        )
+
+    def expected_latency_ms(self, engine, width, height, steps, batch_size=1):
+        """Baseline generation latency from warm-up, or None if the bucket was not warmed up."""
+        baseline = self.warmup_report.get(engine, {}).get("buckets", {}).get(f"{width}x{height}x{batch_size}")
+        if baseline is None:
+            return None
+        return baseline["overhead_ms"] + steps * baseline["step_ms"]
+
+    def _check_latency(self, engine, width, height, steps, elapsed_ms, batch_size=1):
+        """Log a latency_regression event when a generation is well above its warm-up baseline."""
+        expected_ms = self.expected_latency_ms(engine, width, height, steps, batch_size)
+        if expected_ms is None:
+            return
+        if elapsed_ms > settings.latency_regression_factor * expected_ms:
+            logger.warning(
+                "latency_regression",
+                engine=engine,
+                bucket=f"{width}x{height}",
+                steps=steps,
+                elapsed_ms=round(elapsed_ms),
+                expected_ms=round(expected_ms),
+                ratio=round(elapsed_ms / expected_ms, 2)
+            )
+
     def load_style_lora(self, style):
         """Load style-specific LoRA from GCS or HuggingFace"""
         # Map styles to their LoRA repositories
@@ -262,44 +671,50 @@ class ModelManager:
         }
 
         style_lower = style.lower()
-        if style_lower not in style_lora_map:
-            print(f"No LoRA available for style: {style}")
-            return False
 
         # Check if this LoRA is already active
         if self.current_lora == style_lower:
             print(f"✓ Style LoRA already active: {style}")
             return True
 
-        # Unload previous LoRA if different style
+        # Unload previous LoRA if different style (the distillation adapter stays loaded), also
+        # for styles without one: its injected layers would otherwise stay in the UNet, disabled
         if self.current_lora is not None:
             print(f"Unloading previous LoRA: {self.current_lora}")
             try:
-                self.pipe.unload_lora_weights()
+                self.pipe.delete_adapters(self.current_lora)
                 self.current_lora = None
             except Exception as e:
                 print(f"⚠️  Failed to unload LoRA: {e}")
 
+        if style_lower not in style_lora_map:
+            print(f"No LoRA available for style: {style}")
+            return False
+
         try:
             repo_id = style_lora_map[style_lower]
             print(f"Loading {style} LoRA from {repo_id}...")
 
-            # Try to load from GCS first
-            gcs_lora_path = f"/gcs/models/style_loras/{style_lower}"
-            if os.path.exists(gcs_lora_path):
-                safetensors_files = [f for f in os.listdir(gcs_lora_path) if f.endswith('.safetensors')]
-                if safetensors_files:
-                    lora_path = os.path.join(gcs_lora_path, safetensors_files[0])
-                    print(f"Loading LoRA from GCS: {lora_path}")
-                    self.pipe.load_lora_weights(lora_path)
-                    self.style_loras[style_lower] = lora_path
-                    self.current_lora = style_lower
-                    print(f"✓ {style} LoRA loaded from GCS")
-                    return True
-
-            # Fallback to HuggingFace
+            # Resolve from the model manifest first
+            lora_key = f"style_loras/{style_lower}"
+            safetensors_files = [f for f in self.store.files(lora_key) if f.endswith('.safetensors')]
+            if safetensors_files:
+                lora_path = self.store.file(lora_key, safetensors_files[0])
+                print(f"Loading LoRA from model store: {lora_path}")
+                self.pipe.load_lora_weights(lora_path, adapter_name=style_lower)
+                self.store.release()
+                self.style_loras[style_lower] = lora_path
+                self.current_lora = style_lower
+                print(f"✓ {style} LoRA loaded from GCS")
+                return True
+
+            if not settings.allow_hub_downloads:
+                print(f"⚠️  {lora_key} not in model manifest and Hub downloads are disabled")
+                return False
+
+            # Fallback to HuggingFace (dev only)
             print(f"Loading LoRA from HuggingFace: {repo_id}")
-            self.pipe.load_lora_weights(repo_id)
+            self.pipe.load_lora_weights(repo_id, adapter_name=style_lower)
             self.style_loras[style_lower] = repo_id
             self.current_lora = style_lower
             print(f"✓ {style} LoRA loaded from HuggingFace")
@@ -310,11 +725,8 @@ class ModelManager:
             self.current_lora = None
             return False
 
-            self.current_lora = None
-            return False
-
-    def process_image_ip_adapter(self, face_image, prompt, negative_prompt, style, lora_scale):
-        """Process image using IP-Adapter Engine"""
+    def process_image_ip_adapter(self, face_image, prompt, negative_prompt, num_inference_steps, guidance_scale):
+        """Process image using IP-Adapter Engine (face_image is already at its bucket size)"""
         print(f"\n🚀 Generating with IP-Adapter Engine...")
         
         # 1. Prepare Control Image (Canny Edge)
@@ -337,29 +749,51 @@ class ModelManager:
         # ControlNet uses canny_image to keep structure
         
         try:
-            images = self.pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                ip_adapter_image=face_image, # The face reference
-                image=canny_image,           # The structure reference (ControlNet)
-                controlnet_conditioning_scale=0.5, # Structure strength (lower = more style freedom)
-                num_inference_steps=20,
-                guidance_scale=5.0,
-                cross_attention_kwargs={"scale": float(lora_scale)} if lora_scale > 0 else None,
-            ).images
+            start = time.perf_counter()
+            with self.vram.admit("ip_adapter", face_image.width, face_image.height, pipe=self.pipe), \
+                    self.unet_cache.active(), self.token_merging.active():
+                images = self.pipe(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    ip_adapter_image=face_image, # The face reference
+                    image=canny_image,           # The structure reference (ControlNet)
+                    width=face_image.width,
+                    height=face_image.height,
+                    controlnet_conditioning_scale=IP_ADAPTER_CONTROLNET_SCALE,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                ).images
+            self._check_latency(
+                "ip_adapter", face_image.width, face_image.height, num_inference_steps,
+                (time.perf_counter() - start) * 1000
+            )
 
             if not images:
                 raise RuntimeError("Pipeline returned no images")
 
             return images[0]
 
+        except VramAdmissionError:
+            raise
         except Exception as e:
             print(f"❌ IP-Adapter generation failed: {e}")
             raise RuntimeError(f"IP-Adapter processing error: {str(e)}")
 
-    def process_image(self, face_image_path, prompt, style, engine="instantid"):
-        """Process image using selected engine"""
-        
+    def _default_quality(self, quality, output_size):
+        """Fill in the device default quality tier and output size."""
+        if self.device == "cpu":
+            # Fewer steps and ~0.6MP by default; the fast tier needs the LCM-LoRA
+            default_quality = settings.cpu_default_quality
+            if default_quality == "fast" and not self.distillation_loaded:
+                default_quality = "standard"
+            quality = quality or default_quality
+            output_size = output_size or settings.cpu_default_output_size
+        return quality or "standard", output_size or "full"
+
+    def _prepare_generation(self, engine, style, quality, all_faces=False):
+        """Switch engine, style LoRA and quality tier for the next generation. Returns the tier."""
+        tier = tier_config(quality)
+
         # Switch engine if needed
         if engine == "ip_adapter":
             if self.current_engine != "ip_adapter":
@@ -374,17 +808,14 @@ class ModelManager:
         if not self.pipe:
             raise RuntimeError("Models not loaded")
 
-        # Load and prepare the face image
-        print(f"\n📸 Loading face image from: {face_image_path}")
-        face_image = load_image(face_image_path)
-        face_image = face_image.resize((1024, 1024), Image.LANCZOS)
-
-
-
-
-
-        # 2. Load style LoRA if available
+        # Load style LoRA if available
+        previous_lora = self.current_lora
         lora_loaded = self.load_style_lora(style)
+        if self.current_lora != previous_lora:
+            self.vram.register_pipeline(self.current_engine, self.pipe)  # Adapter weights changed
+            if self.text_kv_cache is not None:
+                # Cached text K/V went through the previous adapter's to_k/to_v layers
+                self.text_kv_cache.clear("lora_changed")
         if lora_loaded:
             lora_scale = 0.8  # Optimal weight from research: 0.75-0.85
             print(f"🎨 Style LoRA active with scale: {lora_scale}")
@@ -392,45 +823,177 @@ class ModelManager:
             lora_scale = 0.0
             print("🎨 No LoRA - using prompt-based styling")
 
-        # 3. Build style-aware prompt
-        style_prompts = {
-            # EXISTING STYLES
-            "anime": "anime art style, vibrant colors, cel shading, manga illustration, Japanese animation",
-            "cartoon": "cartoon style, bold outlines, flat colors, animated character design, Western animation",
-            "bollywood": "Bollywood movie star, dramatic Indian cinema style, vibrant colors, cinematic lighting",
-            "cinematic": "cinematic photography, professional film still, dramatic lighting, depth of field",
-            "natural": "natural photography, realistic, soft lighting, photorealistic",
-            "corporate": "corporate headshot, professional business portrait, neutral background",
-            "artistic": "artistic portrait, painterly style, creative interpretation",
-            "vintage": "vintage photography, classic portrait, timeless aesthetic, film grain",
-            "glamour": "glamour photography, elegant portrait, sophisticated lighting",
-            "pixar": "Pixar animation style, 3D character, glossy rendering, animated feature film",
-            
-            # NEW VIRAL EFFECTS (LoRA-based)
-            "ps2": "ps2 graphics, playstation 2 game character, low poly, early 2000s video game graphics, retro gaming",
-            "pixel": "16-bit pixel art portrait, retro game sprite, dithered shading, pixel perfect, classic video game",
-            "aesthetic": "aesthetic portrait, soft pastel colors, dreamy atmosphere, instagram aesthetic, soft focus, ethereal",
-            
-            # NEW VIRAL EFFECTS (Prompt-only, no LoRA needed)
-            "yearbook": "professional yearbook portrait, studio lighting, formal attire, clean white background, 1990s school photo aesthetic, neutral expression, passport photo style",
-            "kpop": "k-pop idol portrait, korean beauty aesthetic, glass skin, soft lighting, pastel colors, kpop mv style, korean drama cinematography, perfect skin, dewy makeup",
-            "bollywood_poster": "dramatic bollywood movie poster, cinematic lighting, intense expression, vibrant colors, hand-painted poster art style, 1990s hindi film aesthetic, theatrical pose",
-            "y2k": "y2k aesthetic, 2000s digital camera photo, low quality, flash photography, early 2000s party photo, nostalgic, disposable camera feel",
-            "couple_aesthetic": "romantic couple portrait, soft pastel colors, dreamy atmosphere, aesthetic photography, golden hour lighting, instagram couple goals, soft focus",
-            "mermaid": "mermaid portrait, shimmering fish scales, iridescent skin, underwater glow, flowing hair, ethereal beauty, ocean depths, fantasy creature",
-            "sigma": "dramatic black and white portrait, intense gaze, cinematic lighting, powerful presence, sigma male aesthetic, motivational poster style",
-            "thug_life": "cool portrait, confident expression, urban style, street photography, hip hop aesthetic",
-        }
-
+        # Quality tier: swap the scheduler in place and enable the tier's adapters
+        if tier["distilled"] and not self.distillation_loaded:
+            raise ValueError("Quality tier 'fast' is unavailable: LCM-LoRA is not loaded")
+        self.pipe.scheduler = self.schedulers.get(quality)
+        adapters_active = self._activate_adapters(lora_scale, tier["distilled"])
+        print(f"⚡ Quality tier: {quality} ({type(self.pipe.scheduler).__name__}, {tier['steps']} steps)")
+
+        # Cross-step UNet feature caching; distilled (fast) tiers have too few steps to skip any
+        self.unet_cache.enabled = settings.unet_cache_interval > 1 and not tier["distilled"]
+        self.token_merging.ratio = tier["token_merge_ratio"]
+
+        # Active (or still injected) LoRA layers change the traced graph, cached steps swap block
+        # forwards, merged tokens change attention shapes and identity regions change the IP
+        # processors; run those requests eager
+        compiled = (
+            self.compiled is not None and not adapters_active and self.current_lora is None
+            and not all_faces and not self.unet_cache.enabled and not self.token_merging.enabled
+        )
+        if self.compiled:
+            self.compiled.set_enabled(compiled)
+        if isinstance(self.pipe, StableDiffusionXLInstantIDPipeline):
+            # Per-call text/identity K/V caching mutates processor state, which compiled graphs cannot follow
+            self.pipe.cache_attention_kv = not compiled
+        return tier
+
+    @staticmethod
+    def guidance_end(style):
+        """Fraction of InstantID steps that keep classifier-free guidance for a style."""
+        return settings.cfg_cutoff_by_style.get(style.lower(), settings.cfg_cutoff)
+
+    @staticmethod
+    def img2img_strength(style):
+        """Fraction of the InstantID steps run from the noised input photo for a style (1.0 = from pure noise)."""
+        return settings.img2img_strength_by_style.get(style.lower(), 1.0)
+
+    @staticmethod
+    def denoise_steps(steps, strength):
+        """Steps actually run at an img2img strength (the pipeline keeps at least one)."""
+        return steps if strength >= 1.0 else max(1, int(steps * strength))
+
+    @staticmethod
+    def build_prompt(prompt, style):
+        """Style-aware (prompt, negative prompt)"""
         # Get style prompt or use the style as-is
-        style_prompt = style_prompts.get(style.lower(), f"{style} style")
+        style_prompt = STYLE_PROMPTS.get(style.lower(), f"{style} style")
 
         # Combine user prompt with style
         # For InstantID, prompts should focus on style/environment, not face description
         full_prompt = f"{prompt}, {style_prompt}, high quality, detailed, professional"
+        return full_prompt, NEGATIVE_PROMPT
+
+    @staticmethod
+    def _input_image(face_image):
+        """RGB PIL image from a decoded array (utils.download_image) or a local path (scripts, benchmarks)."""
+        if isinstance(face_image, np.ndarray):
+            print(f"\n📸 Face image: {face_image.shape[1]}x{face_image.shape[0]} (decoded in memory)")
+            return Image.fromarray(face_image)
+        print(f"\n📸 Loading face image from: {face_image}")
+        return load_image(face_image)
+
+    def _load_bucketed_face(self, face_image, output_size):
+        face_image = self._input_image(face_image)
+        # Crop to the nearest-aspect resolution bucket; conditioning images are built at this size
+        face_image = fit_to_bucket(face_image, output_size)
+        print(f"📐 Resolution bucket: {face_image.width}x{face_image.height} ({output_size})")
+        return face_image
+
+    def _load_face_crop(self, face_image, output_size, all_faces):
+        """
+        Full-resolution photo, the face region cut from it at its bucket, and the faces mapped into the crop.
+
+        Returns (original, region, face image, faces). When the region would cover most of the
+        photo, region and faces are None and the face image is the whole photo fitted to its bucket.
+        """
+        original = self._input_image(face_image)
+        faces = self._detect_faces(original)
+        kept = self._largest_faces(faces) if all_faces else faces[:1]
+
+        crop = face_crop_region(
+            [face.bbox for face in kept], original.width, original.height, output_size, settings.face_crop_expand
+        )
+        if crop is None:
+            print("✂️  Face region covers most of the photo; generating the whole photo")
+            face_image = fit_to_bucket(original, output_size)
+            print(f"📐 Resolution bucket: {face_image.width}x{face_image.height} ({output_size})")
+            return original, None, face_image, None
+
+        region, bucket = crop
+        print(f"✂️  Face region {region[2] - region[0]}x{region[3] - region[1]} of {original.width}x{original.height}, "
+              f"generated at {bucket[0]}x{bucket[1]}")
+        return original, region, crop_to_region(original, region, bucket), faces_in_crop(kept, region, bucket)
+
+    def _detect_faces(self, face_image):
+        if not self.app:
+             raise RuntimeError("Face analysis model not loaded (Required for InstantID)")
 
-        # Negative prompt to avoid artifacts while allowing style transformation
-        negative_prompt = "monochrome, lowres, bad anatomy, worst quality, low quality, blurry, nsfw, nude"
+        # Extract face embeddings and keypoints using InsightFace
+        print("🔍 Detecting face and extracting embeddings...")
+        face_image_cv = cv2.cvtColor(np.array(face_image), cv2.COLOR_RGB2BGR)
+        faces = self.app.get(face_image_cv)
+
+        if not faces:
+            raise ValueError("No face detected in the image. Please provide an image with a clear face.")
+        return faces
+
+    @staticmethod
+    def _largest_faces(faces):
+        """Up to MAX_FACES faces, largest box first."""
+        faces = sorted(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]), reverse=True)
+        return faces[:settings.max_faces]
+
+    def _face_conditioning(self, face_image, faces=None):
+        """InsightFace embedding, keypoint control image and bounding box of the first detected face."""
+        faces = faces or self._detect_faces(face_image)
+
+        # Use the first detected face
+        face_info = faces[0]
+        print(f"✓ Face detected (confidence: {face_info.det_score:.2f})")
+
+        # 512-dim face embedding; the 5 facial keypoints become the InstantID ControlNet image
+        return face_info.embedding, draw_kps(face_image, face_info.kps), face_info.bbox
+
+    def _group_conditioning(self, face_image, faces=None):
+        """
+        Conditioning for every detected face (up to MAX_FACES, largest first).
+
+        Returns (embeddings, keypoint image with all faces, boxes, identity masks); the
+        masks are None when only one face is found, which runs the single-face path.
+        faces: already detected faces (face-crop mode), instead of detecting on face_image.
+        """
+        faces = self._largest_faces(faces or self._detect_faces(face_image))
+        print(f"✓ {len(faces)} face(s) detected (confidence: {', '.join(f'{f.det_score:.2f}' for f in faces)})")
+
+        boxes = [face.bbox for face in faces]
+        if len(faces) == 1:
+            return faces[0].embedding, draw_kps(face_image, faces[0].kps), boxes, None
+
+        # One ControlNet image with every face's keypoints; each identity acts inside its own region
+        kps_image = np.max([np.asarray(draw_kps(face_image, face.kps)) for face in faces], axis=0)
+        masks = identity_region_masks(boxes, face_image.width, face_image.height, settings.identity_region_expand)
+        embeddings = np.stack([face.embedding for face in faces])
+        return embeddings, Image.fromarray(kps_image), boxes, masks
+
+    def process_image(self, face_image, prompt, style, engine="instantid", quality=None, output_size=None,
+                      all_faces=False, face_crop=False):
+        """
+        Process image using selected engine, quality tier and output size (None = device default).
+
+        face_image is the decoded RGB array from utils.download_image, or a local image path.
+
+        all_faces keeps every detected face's identity in one denoising pass (group photos,
+        InstantID only); otherwise only the first face conditions the generation.
+        face_crop generates only a region around the face(s), at FACE_CROP_OUTPUT_SIZE unless
+        output_size is given, and returns the full-resolution photo with it blended back in
+        (InstantID only).
+        """
+        if all_faces and engine != "instantid":
+            raise ValueError(f"Multi-face generation is only supported by the instantid engine, not {engine}")
+        if face_crop and engine != "instantid":
+            raise ValueError(f"Face-crop generation is only supported by the instantid engine, not {engine}")
+        if face_crop:
+            output_size = output_size or settings.face_crop_output_size
+        quality, output_size = self._default_quality(quality, output_size)
+        tier = self._prepare_generation(engine, style, quality, all_faces)
+
+        original, region, faces = None, None, None
+        if face_crop:
+            original, region, face_image, faces = self._load_face_crop(face_image, output_size, all_faces)
+        else:
+            face_image = self._load_bucketed_face(face_image, output_size)
+        full_prompt, negative_prompt = self.build_prompt(prompt, style)
 
         print(f"📝 Prompt: {full_prompt}")
         print(f"🎯 Style: {style}")
@@ -442,27 +1005,157 @@ class ModelManager:
                 face_image, 
                 full_prompt, 
                 negative_prompt, 
-                style, 
-                lora_scale
+                tier["steps"],
+                tier["guidance_scale"]
             )
 
         # --- INSTANTID LOGIC BELOW ---
-        
-        if not self.app:
-             raise RuntimeError("Face analysis model not loaded (Required for InstantID)")
+        if all_faces:
+            face_emb, face_kps_image, face_boxes, identity_masks = self._group_conditioning(face_image, faces)
+        else:
+            face_emb, face_kps_image, face_box = self._face_conditioning(face_image, faces)
+            face_boxes, identity_masks = [face_box], None
 
-        # 1. Extract face embeddings and keypoints using InsightFace
-        print("🔍 Detecting face and extracting embeddings...")
-        face_image_cv = cv2.cvtColor(np.array(face_image), cv2.COLOR_RGB2BGR)
-        faces = self.app.get(face_image_cv)
+        strength = self.img2img_strength(style)
+        steps = self.denoise_steps(tier["steps"], strength)
+        if strength < 1.0:
+            print(f"🖼️  img2img strength {strength}: {steps}/{tier['steps']} steps from the input photo")
 
-        if not faces:
-            raise ValueError("No face detected in the image. Please provide an image with a clear face.")
+        print(f"\n🚀 Generating with InstantID Engine...")
+        try:
+            start = time.perf_counter()
+            with self.vram.admit("instantid", face_image.width, face_image.height, pipe=self.pipe), \
+                    self.unet_cache.active(), self.token_merging.active(face_boxes=[face_boxes]):
+                images = self.pipe(
+                    prompt=full_prompt,
+                    negative_prompt=negative_prompt,
+                    image_embeds=face_emb,
+                    image=face_kps_image,
+                    identity_masks=identity_masks,
+                    init_image=face_image,
+                    strength=strength,
+                    width=face_image.width,
+                    height=face_image.height,
+                    controlnet_conditioning_scale=settings.controlnet_scale,
+                    controlnet_cache_interval=settings.controlnet_cache_interval,
+                    guidance_end=self.guidance_end(style),
+                    adapter_state=self.adapter_state,
+                    num_inference_steps=tier["steps"],
+                    guidance_scale=tier["guidance_scale"],
+                ).images
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._check_latency("instantid", face_image.width, face_image.height, steps, elapsed_ms)
+            if identity_masks is not None:
+                logger.info("group_generated", faces=len(face_boxes), duration_ms=round(elapsed_ms))
 
-        # Use the first detected face
-        face_info = faces[0]
-        face_emb = face_info.embedding  # 512-dim face embedding
-        face_kps = face_info.kps  # 5 facial keypoints
+            if not images:
+                raise RuntimeError("Pipeline returned no images")
 
-        print(f"✓ Face detected (confidence: {face_info.det_score:.2f})")
+            if region is not None:
+                logger.info(
+                    "face_crop_generated",
+                    original=f"{original.width}x{original.height}",
+                    region=f"{region[2] - region[0]}x{region[3] - region[1]}",
+                    bucket=f"{face_image.width}x{face_image.height}",
+                )
+                return paste_back(original, images[0], region, settings.face_crop_feather)
+            return images[0]
+
+        except VramAdmissionError:
+            raise
+        except Exception as e:
+            print(f"❌ InstantID generation failed: {e}")
+            raise RuntimeError(f"InstantID processing error: {str(e)}")
+
+    def process_batch(self, jobs, style, engine="instantid", quality=None, output_size=None):
+        """
+        Generate several faces in shared denoising loops (InstantID engine).
+
+        Jobs share style, quality tier and output size; each is a dict with
+        face_image_path (a decoded RGB array or a local path), prompt and optional
+        ip_adapter_scale / controlnet_scale.
+        Jobs landing in the same resolution bucket run as one batch of up to
+        MAX_BATCH_SIZE images. Returns one PIL image or exception per job, in order,
+        so a job without a detectable face does not fail the others.
+        """
+        if engine != "instantid":
+            # The IP-Adapter engine takes one reference image per call (diffusers ip_adapter_image)
+            raise ValueError(f"Batched generation is only supported by the instantid engine, not {engine}")
+        quality, output_size = self._default_quality(quality, output_size)
+        tier = self._prepare_generation(engine, style, quality)
+
+        results = [None] * len(jobs)
+        groups = {}
+        for index, job in enumerate(jobs):
+            try:
+                face_image = self._load_bucketed_face(job["face_image_path"], output_size)
+                face_emb, face_kps_image, face_box = self._face_conditioning(face_image)
+            except Exception as e:
+                results[index] = e if isinstance(e, ValueError) else RuntimeError(f"Face preparation error: {e}")
+                continue
+            prompt, negative_prompt = self.build_prompt(job["prompt"], style)
+            groups.setdefault(face_image.size, []).append({
+                "index": index,
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "image_embeds": face_emb,
+                "image": face_kps_image,
+                "init_image": face_image,
+                "face_box": face_box,
+                "ip_adapter_scale": job.get("ip_adapter_scale", settings.ip_adapter_scale),
+                "controlnet_scale": job.get("controlnet_scale", settings.controlnet_scale),
+            })
+
+        for (width, height), members in groups.items():
+            for offset in range(0, len(members), settings.max_batch_size):
+                batch = members[offset:offset + settings.max_batch_size]
+                try:
+                    images = self._generate_batch(batch, width, height, tier, style)
+                except VramAdmissionError:
+                    raise
+                except Exception as e:
+                    print(f"❌ InstantID batch generation failed: {e}")
+                    images = [RuntimeError(f"InstantID processing error: {str(e)}")] * len(batch)
+                for member, image in zip(batch, images):
+                    results[member["index"]] = image
+        return results
+
+    def _generate_batch(self, batch, width, height, tier, style):
+        """One InstantID call with per-sample identity, keypoints, prompt and scales."""
+        print(f"\n🚀 Generating {len(batch)} images with InstantID Engine ({width}x{height})...")
+        strength = self.img2img_strength(style)
+        steps = self.denoise_steps(tier["steps"], strength)
+        start = time.perf_counter()
+        with self.vram.admit("instantid", width, height, batch_size=len(batch), pipe=self.pipe), \
+                self.unet_cache.active(), \
+                self.token_merging.active(face_boxes=[[member["face_box"]] for member in batch]):
+            images = self.pipe(
+                prompt=[member["prompt"] for member in batch],
+                negative_prompt=[member["negative_prompt"] for member in batch],
+                image_embeds=[member["image_embeds"] for member in batch],
+                image=[member["image"] for member in batch],
+                init_image=[member["init_image"] for member in batch],
+                strength=strength,
+                width=width,
+                height=height,
+                ip_adapter_scale=[member["ip_adapter_scale"] for member in batch],
+                controlnet_conditioning_scale=[member["controlnet_scale"] for member in batch],
+                controlnet_cache_interval=settings.controlnet_cache_interval,
+                guidance_end=self.guidance_end(style),
+                adapter_state=self.adapter_state,
+                num_inference_steps=tier["steps"],
+                guidance_scale=tier["guidance_scale"],
+            ).images
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._check_latency("instantid", width, height, steps, elapsed_ms, batch_size=len(batch))
+        logger.info(
+            "batch_generated",
+            bucket=f"{width}x{height}",
+            batch_size=len(batch),
+            duration_ms=round(elapsed_ms),
+            per_image_ms=round(elapsed_ms / len(batch))
+        )
 
+        if len(images) != len(batch):
+            raise RuntimeError(f"Pipeline returned {len(images)} images for a batch of {len(batch)}")
+        return images
@@ -0,0 +1,354 @@
+"""
+Manifest-driven local model store for Jhakaas Worker.
+
+The model bucket (mounted read-only via GCS FUSE) carries a `manifest.json`
+written by models/download_models.py. It lists every component by key
+(e.g. "sdxl-base", "instantid", "style_loras/anime") with the size and MD5 of
+each file. This module:
+- Resolves components and files by manifest key, never by probing paths
+- By default (MODEL_STORE_MODE=direct) returns paths on the mount itself:
+  the loaders memory-map safetensors and stream tensors straight to the
+  device, so no copy of the weights is kept in host memory
+- With MODEL_STORE_MODE=stage, copies only the files a caller needs to
+  local disk using parallel chunked reads (GCS FUSE throughput scales with
+  concurrent reads), and deletes them again once the engine is loaded
+- Verifies files against the manifest before they are used
+- Fails fast with ModelStoreError when something is missing, without any
+  network fallback
+
+On Cloud Run /tmp is an in-memory filesystem counted against the memory
+limit, so staging refuses tmpfs unless MODEL_STORE_ALLOW_TMPFS is set.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from src.config import settings
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST_VERSION = 1
+WEIGHT_EXTENSIONS = (".safetensors", ".bin")
+MEMORY_FILESYSTEMS = ("tmpfs", "ramfs")
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Type of the filesystem holding path (longest matching mount point in /proc/mounts), if known."""
+    path = os.path.realpath(path)
+    best, best_type = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace("\\040", " ")
+                inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) >= len(best):
+                    best, best_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+
+class ModelStoreError(RuntimeError):
+    """Raised when a model component cannot be resolved from the manifest."""
+
+
+class ModelStore:
+    """Resolves model components by manifest key, on the mount or staged to local disk."""
+
+    def __init__(
+        self,
+        mount_dir: str,
+        local_dir: str,
+        manifest_name: str = "manifest.json",
+        workers: int = 16,
+        chunk_bytes: int = 64 * 1024 * 1024,
+        verify_checksums: bool = False,
+        stage: bool = True,
+        allow_tmpfs: bool = False,
+    ):
+        self.mount_dir = mount_dir
+        self.local_dir = local_dir
+        self.stage = stage
+        self.allow_tmpfs = allow_tmpfs
+        # Resolved paths point into the mount (direct) or the staging directory
+        self.root = local_dir if stage else mount_dir
+        self.manifest_path = os.path.join(mount_dir, manifest_name)
+        self.chunk_bytes = chunk_bytes
+        self.verify_checksums = verify_checksums
+
+        self._manifest: Optional[Dict] = None
+        self._manifest_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._staging: Dict[str, Future] = {}
+        self._local_dir_checked = False
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model-stage")
+
+    # ------------------------------------------------------------------
+    # Manifest
+    # ------------------------------------------------------------------
+
+    @property
+    def manifest(self) -> Optional[Dict]:
+        """Parsed manifest, or None if it is missing or invalid (see manifest_error)."""
+        with self._lock:
+            if self._manifest is None and self._manifest_error is None:
+                self._manifest, self._manifest_error = self._read_manifest()
+            return self._manifest
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None, f"model manifest not found at {self.manifest_path}"
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            return None, f"unreadable model manifest {self.manifest_path}: {e}"
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None, f"unsupported model manifest version {manifest.get('version')}"
+        logger.info(
+            "model_manifest_loaded",
+            path=self.manifest_path,
+            components=len(manifest["components"])
+        )
+        return manifest, None
+
+    @property
+    def available(self) -> bool:
+        return self.manifest is not None
+
+    def files(self, key: str, subdir: str = "") -> List[str]:
+        """Relative paths (within the component) of all manifest files under subdir."""
+        manifest = self.manifest
+        if manifest is None or key not in manifest["components"]:
+            return []
+        prefix = f"{subdir.strip('/')}/" if subdir else ""
+        return sorted(path for path in manifest["components"][key]["files"] if path.startswith(prefix))
+
+    def has(self, key: str, subdir: str = "") -> bool:
+        return bool(self.files(key, subdir))
+
+    def _require(self, key: str, subdir: str = "") -> List[str]:
+        files = self.files(key, subdir)
+        if not files:
+            reason = self._manifest_error or "not listed in manifest"
+            raise ModelStoreError(f"Cannot resolve model component {key}/{subdir}: {reason}".replace("/:", ":"))
+        return files
+
+    # ------------------------------------------------------------------
+    # Resolution
+    # ------------------------------------------------------------------
+
+    def path(
+        self,
+        key: str,
+        subdir: str = "",
+        weight_name: Optional[str] = None,
+        variant: Optional[str] = None,
+    ) -> str:
+        """
+        Stage a component (or one of its subfolders) and return its local directory.
+
+        Args:
+            key: Manifest component key, e.g. "sdxl-base"
+            subdir: Subfolder within the component, e.g. "unet"
+            weight_name: If given, only `{weight_name}.{variant}.safetensors` (or
+                `{weight_name}.safetensors` when no variant file exists) is staged
+                among the weight files; config files are always staged.
+            variant: Weight variant such as "fp16"
+
+        Raises:
+            ModelStoreError: If the component is not in the manifest or staging fails
+        """
+        files = self._require(key, subdir)
+        if weight_name is not None:
+            files = self._select_weights(files, subdir, weight_name, variant)
+        self._stage_all(key, files)
+        return os.path.join(self.root, key, subdir)
+
+    def file(self, key: str, relpath: str) -> str:
+        """Stage a single file of a component and return its local path."""
+        manifest = self.manifest
+        if manifest is None or relpath not in manifest["components"].get(key, {}).get("files", {}):
+            reason = self._manifest_error or "not listed in manifest"
+            raise ModelStoreError(f"Cannot resolve model file {key}/{relpath}: {reason}")
+        self._stage_all(key, [relpath])
+        return os.path.join(self.root, key, relpath)
+
+    @staticmethod
+    def _select_weights(files, subdir, weight_name, variant):
+        prefix = f"{subdir.strip('/')}/" if subdir else ""
+        preferred = [f"{prefix}{weight_name}.{variant}.safetensors"] if variant else []
+        preferred.append(f"{prefix}{weight_name}.safetensors")
+        chosen = next((path for path in preferred if path in files), None)
+        if chosen is None:
+            raise ModelStoreError(f"No {weight_name} safetensors weights under {subdir or 'component root'}")
+
+        # Keep config/tokenizer files, drop every other weight file
+        return [path for path in files if path == chosen or not path.endswith(WEIGHT_EXTENSIONS)]
+
+    # ------------------------------------------------------------------
+    # Staging
+    # ------------------------------------------------------------------
+
+    def _check_local_dir(self):
+        """Refuse to stage into memory-backed storage unless explicitly allowed."""
+        if self._local_dir_checked:
+            return
+        fs_type = filesystem_type(self.local_dir)
+        if fs_type in MEMORY_FILESYSTEMS:
+            if not self.allow_tmpfs:
+                raise ModelStoreError(
+                    f"MODEL_STORE_DIR {self.local_dir} is on {fs_type}: staged weights would stay resident in "
+                    f"host memory. Use MODEL_STORE_MODE=direct, a disk volume, or set MODEL_STORE_ALLOW_TMPFS"
+                )
+            logger.warning("model_store_on_tmpfs", path=self.local_dir, fs_type=fs_type)
+        self._local_dir_checked = True
+
+    def _stage_all(self, key: str, files: List[str]):
+        """Stage (or, in direct mode, verify) files concurrently; a file already in progress is awaited."""
+        if self.stage:
+            self._check_local_dir()
+        futures = []
+        with self._lock:
+            for relpath in files:
+                staged_key = f"{key}/{relpath}"
+                future = self._staging.get(staged_key)
+                if future is None or (future.done() and future.exception() is not None):
+                    future = Future()
+                    self._staging[staged_key] = future
+                    futures.append((future, key, relpath, True))
+                else:
+                    futures.append((future, key, relpath, False))
+
+        # Files this caller owns are copied here; their chunks fan out on the pool
+        for future, key_, relpath, owner in futures:
+            if owner:
+                try:
+                    self._stage_file(key_, relpath)
+                    future.set_result(None)
+                except Exception as e:
+                    future.set_exception(e)
+
+        for future, key_, relpath, _ in futures:
+            try:
+                future.result()
+            except Exception as e:
+                raise ModelStoreError(f"Failed to stage {key_}/{relpath}: {e}") from e
+
+    def _stage_file(self, key: str, relpath: str):
+        entry = self.manifest["components"][key]["files"][relpath]
+        src = os.path.join(self.mount_dir, key, relpath)
+        dst = os.path.join(self.local_dir, key, relpath)
+
+        if not self.stage:
+            self._verify(src, key, relpath, entry)
+            return
+
+        # Files are only renamed into place after verification, so a size match is trusted
+        if os.path.exists(dst) and os.path.getsize(dst) == entry["size"]:
+            return
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        partial = f"{dst}.partial"
+        self._copy_chunked(src, partial, entry["size"])
+
+        try:
+            self._verify(partial, key, relpath, entry)
+        except ModelStoreError:
+            os.remove(partial)
+            raise
+
+        os.replace(partial, dst)
+        logger.debug("model_file_staged", key=key, path=relpath, size_mb=entry["size"] / 1024 / 1024)
+
+    def _verify(self, path: str, key: str, relpath: str, entry: Dict):
+        """Check a file's size (and MD5 when enabled) against its manifest entry."""
+        try:
+            actual_size = os.path.getsize(path)
+        except OSError as e:
+            raise ModelStoreError(f"Cannot read {key}/{relpath}: {e}")
+        if actual_size != entry["size"]:
+            raise ModelStoreError(f"Size mismatch for {key}/{relpath}: {actual_size} != {entry['size']}")
+        if self.verify_checksums and entry.get("md5"):
+            if self._md5(path) != entry["md5"]:
+                raise ModelStoreError(f"Checksum mismatch for {key}/{relpath}")
+
+    def release(self):
+        """
+        Delete every staged file (stage mode), once the loaded tensors live on the device.
+
+        Files still memory-mapped (CPU weights) keep their pages until unmapped; later
+        resolutions stage them again. No-op in direct mode.
+        """
+        if not self.stage:
+            return
+        with self._lock:
+            staged = [name for name, future in self._staging.items() if future.done()]
+            for name in staged:
+                del self._staging[name]
+        freed = 0
+        for name in staged:
+            path = os.path.join(self.local_dir, name)
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning("model_file_release_failed", path=path, error=str(e))
+        if staged:
+            logger.info("model_store_released", files=len(staged), size_mb=round(freed / 1024 / 1024))
+
+    def _copy_chunked(self, src: str, dst: str, size: int):
+        """Copy src to dst with concurrent positional reads/writes of chunk_bytes each."""
+        src_fd = os.open(src, os.O_RDONLY)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(dst_fd, size)
+
+            def copy_chunk(offset):
+                length = min(self.chunk_bytes, size - offset)
+                while length > 0:
+                    data = os.pread(src_fd, length, offset)
+                    if not data:
+                        raise ModelStoreError(f"Unexpected end of file reading {src} at {offset}")
+                    os.pwrite(dst_fd, data, offset)
+                    offset += len(data)
+                    length -= len(data)
+
+            chunks = [self._pool.submit(copy_chunk, offset) for offset in range(0, size, self.chunk_bytes)]
+            for chunk in chunks:
+                chunk.result()
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+
+    @staticmethod
+    def _md5(path: str) -> str:
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+def create_model_store() -> ModelStore:
+    """ModelStore configured from settings."""
+    return ModelStore(
+        mount_dir=settings.gcs_models_path,
+        local_dir=settings.model_store_dir,
+        manifest_name=settings.model_manifest_name,
+        workers=settings.model_stage_workers,
+        chunk_bytes=settings.model_stage_chunk_mb * 1024 * 1024,
+        verify_checksums=settings.verify_model_checksums,
+        stage=settings.model_store_mode == "stage",
+        allow_tmpfs=settings.model_store_allow_tmpfs,
+    )
@@ -1,4 +1,16 @@
 # Local InstantID pipeline - diffusers 0.27.2 compatible
-from .pipeline_stable_diffusion_xl_instantid import StableDiffusionXLInstantIDPipeline
+from .pipeline_stable_diffusion_xl_instantid import (
+    StableDiffusionXLInstantIDPipeline,
+    build_image_proj_model,
+    build_ip_attn_processors,
+    draw_kps,
+    identity_region_masks,
+)
 
-__all__ = ["StableDiffusionXLInstantIDPipeline"]
+__all__ = [
+    "StableDiffusionXLInstantIDPipeline",
+    "build_image_proj_model",
+    "build_ip_attn_processors",
+    "draw_kps",
+    "identity_region_masks",
+]
@@ -13,7 +13,9 @@
 # limitations under the License.
 
 
+import hashlib
 import math
+from contextlib import contextmanager
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import cv2
@@ -21,8 +23,10 @@ import numpy as np
 import PIL.Image
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from diffusers import StableDiffusionXLControlNetPipeline
+from safetensors import safe_open
 from diffusers.image_processor import PipelineImageInput
 from diffusers.models import ControlNetModel
 from diffusers.pipelines.controlnet.multicontrolnet import MultiControlNetModel
@@ -33,7 +37,7 @@ from diffusers.utils import (
     replace_example_docstring,
 )
 from diffusers.utils.import_utils import is_xformers_available
-from diffusers.utils.torch_utils import is_compiled_module, is_torch_version
+from diffusers.utils.torch_utils import is_compiled_module, is_torch_version, randn_tensor
 
 
 try:
@@ -159,17 +163,77 @@ class Resampler(nn.Module):
         return self.norm_out(latents)
 
 
+ATTENTION_BACKENDS = ("auto", "sdpa", "xformers", "math")
+
+
+def resolve_attention_backend(backend="auto"):
+    """
+    Pick the attention kernel for the InstantID processors.
+
+    auto prefers torch's fused scaled_dot_product_attention, which dispatches to
+    flash / memory-efficient / math kernels by device, dtype and shape; xformers
+    and the explicit softmax(QK^T)V "math" path remain as fallbacks.
+    """
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f"Unknown attention backend {backend!r}, expected one of {ATTENTION_BACKENDS}")
+    if backend == "auto":
+        if hasattr(F, "scaled_dot_product_attention"):
+            return "sdpa"
+        return "xformers" if xformers_available else "math"
+    if backend == "sdpa" and not hasattr(F, "scaled_dot_product_attention"):
+        raise ValueError("scaled_dot_product_attention requires torch>=2.0")
+    if backend == "xformers" and not xformers_available:
+        raise ValueError("xformers is not available. Make sure it is installed correctly")
+    return backend
+
+
+def split_heads(attn, tensor, backend):
+    """[batch, tokens, heads * head_dim] -> the backend's multi-head layout."""
+    if backend == "sdpa":
+        batch_size = tensor.shape[0]
+        return tensor.view(batch_size, -1, attn.heads, tensor.shape[-1] // attn.heads).transpose(1, 2)
+    return attn.head_to_batch_dim(tensor)
+
+
+def merge_heads(attn, tensor, backend):
+    """Inverse of split_heads."""
+    if backend == "sdpa":
+        batch_size, heads, tokens, head_dim = tensor.shape
+        return tensor.transpose(1, 2).reshape(batch_size, tokens, heads * head_dim)
+    return attn.batch_to_head_dim(tensor)
+
+
+def attention(attn, query, key, value, attention_mask, backend):
+    """Attention over split_heads() tensors with the given backend."""
+    if backend == "sdpa":
+        if attention_mask is not None:
+            # prepare_attention_mask returns [batch * heads, query_tokens, key_tokens]
+            attention_mask = attention_mask.view(query.shape[0], attn.heads, -1, attention_mask.shape[-1])
+        return F.scaled_dot_product_attention(query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False)
+    if backend == "xformers":
+        return xformers.ops.memory_efficient_attention(
+            query.contiguous(), key.contiguous(), value.contiguous(), attn_bias=attention_mask
+        )
+    attention_probs = attn.get_attention_scores(query, key, attention_mask)
+    return torch.bmm(attention_probs, value)
+
+
 class AttnProcessor(nn.Module):
     r"""
     Default processor for performing attention-related computations.
+    Args:
+        backend (`str`, defaults to "auto"):
+            Attention kernel, see `resolve_attention_backend`.
     """
 
     def __init__(
         self,
         hidden_size=None,
         cross_attention_dim=None,
+        backend="auto",
     ):
         super().__init__()
+        self.backend = resolve_attention_backend(backend)
 
     def __call__(
         self,
@@ -208,13 +272,12 @@ class AttnProcessor(nn.Module):
         key = attn.to_k(encoder_hidden_states)
         value = attn.to_v(encoder_hidden_states)
 
-        query = attn.head_to_batch_dim(query)
-        key = attn.head_to_batch_dim(key)
-        value = attn.head_to_batch_dim(value)
+        query = split_heads(attn, query, self.backend)
+        key = split_heads(attn, key, self.backend)
+        value = split_heads(attn, value, self.backend)
 
-        attention_probs = attn.get_attention_scores(query, key, attention_mask)
-        hidden_states = torch.bmm(attention_probs, value)
-        hidden_states = attn.batch_to_head_dim(hidden_states)
+        hidden_states = attention(attn, query, key, value, attention_mask, self.backend)
+        hidden_states = merge_heads(attn, hidden_states, self.backend).to(query.dtype)
 
         # linear proj
         hidden_states = attn.to_out[0](hidden_states)
@@ -244,15 +307,22 @@ class IPAttnProcessor(nn.Module):
             the weight scale of image prompt.
         num_tokens (`int`, defaults to 4 when do ip_adapter_plus it should be 16):
             The context length of the image features.
+        backend (`str`, defaults to "auto"):
+            Attention kernel, see `resolve_attention_backend`.
     """
 
-    def __init__(self, hidden_size, cross_attention_dim=None, scale=1.0, num_tokens=4):
+    def __init__(self, hidden_size, cross_attention_dim=None, scale=1.0, num_tokens=4, backend="auto"):
         super().__init__()
 
         self.hidden_size = hidden_size
         self.cross_attention_dim = cross_attention_dim
         self.scale = scale
         self.num_tokens = num_tokens
+        self.backend = resolve_attention_backend(backend)
+        # Text and identity-token keys/values by (kind, batch rows), set by the pipeline for one call
+        self.kv_cache = None
+        # IdentityRegions when several identities share the image, set by the pipeline for one call
+        self.identity_regions = None
 
         self.to_k_ip = nn.Linear(cross_attention_dim or hidden_size, hidden_size, bias=False)
         self.to_v_ip = nn.Linear(cross_attention_dim or hidden_size, hidden_size, bias=False)
@@ -289,8 +359,9 @@ class IPAttnProcessor(nn.Module):
         if encoder_hidden_states is None:
             encoder_hidden_states = hidden_states
         else:
-            # get encoder_hidden_states, ip_hidden_states
-            end_pos = encoder_hidden_states.shape[1] - self.num_tokens
+            # get encoder_hidden_states, ip_hidden_states (num_tokens per identity)
+            regions = self.identity_regions
+            end_pos = encoder_hidden_states.shape[1] - self.num_tokens * (regions.count if regions is not None else 1)
             encoder_hidden_states, ip_hidden_states = (
                 encoder_hidden_states[:, :end_pos, :],
                 encoder_hidden_states[:, end_pos:, :],
@@ -298,35 +369,31 @@ class IPAttnProcessor(nn.Module):
             if attn.norm_cross:
                 encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
 
-        key = attn.to_k(encoder_hidden_states)
-        value = attn.to_v(encoder_hidden_states)
+        key, value = self._key_value("text", encoder_hidden_states, attn.to_k, attn.to_v, attn)
 
-        query = attn.head_to_batch_dim(query)
-        key = attn.head_to_batch_dim(key)
-        value = attn.head_to_batch_dim(value)
+        # The query is split once and attends to the text and identity tokens separately
+        # (decoupled cross-attention: each has its own softmax)
+        query = split_heads(attn, query, self.backend)
 
-        if xformers_available:
-            hidden_states = self._memory_efficient_attention_xformers(query, key, value, attention_mask)
-        else:
-            attention_probs = attn.get_attention_scores(query, key, attention_mask)
-            hidden_states = torch.bmm(attention_probs, value)
-        hidden_states = attn.batch_to_head_dim(hidden_states)
+        hidden_states = attention(attn, query, key, value, attention_mask, self.backend)
+        hidden_states = merge_heads(attn, hidden_states, self.backend)
 
         # for ip-adapter
-        ip_key = self.to_k_ip(ip_hidden_states)
-        ip_value = self.to_v_ip(ip_hidden_states)
-
-        ip_key = attn.head_to_batch_dim(ip_key)
-        ip_value = attn.head_to_batch_dim(ip_value)
+        ip_key, ip_value = self._key_value("ip", ip_hidden_states, self.to_k_ip, self.to_v_ip, attn)
 
-        if xformers_available:
-            ip_hidden_states = self._memory_efficient_attention_xformers(query, ip_key, ip_value, None)
+        if regions is None:
+            ip_hidden_states = attention(attn, query, ip_key, ip_value, None, self.backend)
+            ip_hidden_states = merge_heads(attn, ip_hidden_states, self.backend)
         else:
-            ip_attention_probs = attn.get_attention_scores(query, ip_key, None)
-            ip_hidden_states = torch.bmm(ip_attention_probs, ip_value)
-        ip_hidden_states = attn.batch_to_head_dim(ip_hidden_states)
+            # Each identity attends separately and only contributes inside its own region
+            masks = regions.at(hidden_states.shape[1], hidden_states.dtype)
+            ip_hidden_states = 0
+            identity_kv = zip(ip_key.chunk(regions.count, dim=-2), ip_value.chunk(regions.count, dim=-2))
+            for mask, (identity_key, identity_value) in zip(masks, identity_kv):
+                identity_states = attention(attn, query, identity_key, identity_value, None, self.backend)
+                ip_hidden_states = ip_hidden_states + mask * merge_heads(attn, identity_states, self.backend)
 
-        hidden_states = hidden_states + self.scale * ip_hidden_states
+        hidden_states = (hidden_states + self.scale * ip_hidden_states).to(query.dtype)
 
         # linear proj
         hidden_states = attn.to_out[0](hidden_states)
@@ -343,13 +410,23 @@ class IPAttnProcessor(nn.Module):
 
         return hidden_states
 
-    def _memory_efficient_attention_xformers(self, query, key, value, attention_mask):
-        # TODO attention_mask
-        query = query.contiguous()
-        key = key.contiguous()
-        value = value.contiguous()
-        hidden_states = xformers.ops.memory_efficient_attention(query, key, value, attn_bias=attention_mask)
-        return hidden_states
+    def _key_value(self, kind, states, to_k, to_v, attn):
+        """Text or identity keys/values, computed once per call while the pipeline holds a kv_cache."""
+        rows = states.shape[0]
+        cache = self.kv_cache
+        if cache is not None:
+            if (kind, rows) in cache:
+                return cache[(kind, rows)]
+            if (kind, 2 * rows) in cache:
+                # Truncated CFG: the conditional half of [uncond..., cond...]
+                key, value = cache[(kind, 2 * rows)]
+                return key.chunk(2)[1], value.chunk(2)[1]
+
+        key = split_heads(attn, to_k(states), self.backend)
+        value = split_heads(attn, to_v(states), self.backend)
+        if cache is not None:
+            cache[(kind, rows)] = (key, value)
+        return key, value
 
 
 EXAMPLE_DOC_STRING = """
@@ -438,6 +515,154 @@ def draw_kps(image_pil, kps, color_list=[(255, 0, 0), (0, 255, 0), (0, 0, 255),
     return out_img_pil
 
 
+def identity_region_masks(boxes, width, height, expand=2.0):
+    """
+    One (height, width) float mask per face for region-masked identity attention.
+
+    Each face box is grown `expand` times around its centre (hair, neck, shoulders). Where grown
+    boxes overlap, a pixel belongs to the face whose centre is nearest, so identities never mix.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    centres = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+    half = np.stack([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1) * expand / 2
+
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32) + 0.5
+    inside = (np.abs(xs[None] - centres[:, 0, None, None]) <= half[:, 0, None, None]) & (
+        np.abs(ys[None] - centres[:, 1, None, None]) <= half[:, 1, None, None]
+    )
+    distance = (xs[None] - centres[:, 0, None, None]) ** 2 + (ys[None] - centres[:, 1, None, None]) ** 2
+    nearest = np.where(inside, distance, np.inf).argmin(axis=0)
+    masks = inside & (np.arange(len(boxes))[:, None, None] == nearest[None])
+    return masks.astype(np.float32)
+
+
+class IdentityRegions:
+    """Per-identity spatial masks, resized once per attention resolution for the IP processors."""
+
+    def __init__(self, masks):
+        # (identities, latent height, latent width)
+        self.masks = masks
+        self.count = masks.shape[0]
+        self._resized = {}
+
+    def at(self, tokens, dtype):
+        """(identities, tokens, 1) masks for a layer with `tokens` spatial tokens."""
+        if tokens not in self._resized:
+            latent_h, latent_w = self.masks.shape[-2:]
+            for downsample in (1, 2, 4, 8, 16):
+                height, width = -(-latent_h // downsample), -(-latent_w // downsample)
+                if height * width == tokens:
+                    break
+            else:
+                raise ValueError(f"No identity mask resolution matches {tokens} tokens")
+            masks = F.interpolate(self.masks[None].float(), size=(height, width), mode="area")[0]
+            self._resized[tokens] = masks.reshape(self.count, tokens, 1).to(dtype)
+        return self._resized[tokens]
+
+
+def build_image_proj_model(cross_attention_dim, image_emb_dim=512, num_tokens=16):
+    image_proj_model = Resampler(
+        dim=1280,
+        depth=4,
+        dim_head=64,
+        heads=20,
+        num_queries=num_tokens,
+        embedding_dim=image_emb_dim,
+        output_dim=cross_attention_dim,
+        ff_mult=4,
+    )
+    image_proj_model.eval()
+    return image_proj_model
+
+
+def build_ip_attn_processors(unet, num_tokens, scale, backend="auto"):
+    """Create the InstantID attention processors for every attention layer of `unet`."""
+    backend = resolve_attention_backend(backend)
+    attn_procs = {}
+    for name in unet.attn_processors.keys():
+        cross_attention_dim = None if name.endswith("attn1.processor") else unet.config.cross_attention_dim
+        if name.startswith("mid_block"):
+            hidden_size = unet.config.block_out_channels[-1]
+        elif name.startswith("up_blocks"):
+            block_id = int(name[len("up_blocks.")])
+            hidden_size = list(reversed(unet.config.block_out_channels))[block_id]
+        elif name.startswith("down_blocks"):
+            block_id = int(name[len("down_blocks.")])
+            hidden_size = unet.config.block_out_channels[block_id]
+        if cross_attention_dim is None:
+            attn_procs[name] = AttnProcessor(backend=backend).to(unet.device, dtype=unet.dtype)
+        else:
+            attn_procs[name] = IPAttnProcessor(
+                hidden_size=hidden_size,
+                cross_attention_dim=cross_attention_dim,
+                scale=scale,
+                num_tokens=num_tokens,
+                backend=backend,
+            ).to(unet.device, dtype=unet.dtype)
+    return attn_procs
+
+
+def load_adapter_safetensors(path, modules, device):
+    """
+    Copy a converted InstantID adapter into its modules, one tensor at a time.
+
+    The file holds the pickled checkpoint's two state dicts flattened as `image_proj.<name>` and
+    `ip_adapter.<name>` (models/download_models.py); `modules` maps each group to its module.
+    Tensors are read from the memory-mapped file straight to `device` and cast on copy, so
+    no CPU state dict is built and at most one extra tensor is resident at a time.
+
+    Raises:
+        RuntimeError: If the file does not match the modules' state dicts
+    """
+    targets = {
+        f"{group}.{name}": tensor
+        for group, module in modules.items()
+        for name, tensor in module.state_dict().items()
+    }
+    with safe_open(path, framework="pt", device=str(device)) as f:
+        names = set(f.keys())
+        missing, unexpected = sorted(targets.keys() - names), sorted(names - targets.keys())
+        if missing or unexpected:
+            raise RuntimeError(
+                f"InstantID adapter mismatch in {path}: {len(missing)} missing, {len(unexpected)} unexpected "
+                f"(e.g. {(missing or unexpected)[:3]})"
+            )
+        with torch.no_grad():
+            for name in names:
+                targets[name].copy_(f.get_tensor(name))
+
+
+def _collapse_scale(scale, batch_size, name):
+    """
+    Normalise a scale argument: None, one float, or a list with one value per prompt.
+
+    Lists whose values are all equal collapse to a float, so uniform batches run
+    exactly like a single request (and keep compiled graphs' guards stable).
+    """
+    if scale is None or not isinstance(scale, (list, tuple)):
+        return None if scale is None else float(scale)
+    if len(scale) != batch_size:
+        raise ValueError(f"`{name}` has {len(scale)} values for {batch_size} prompts")
+    scale = [float(s) for s in scale]
+    return scale[0] if len(set(scale)) == 1 else scale
+
+
+def _per_sample_scale(scale, num_images_per_prompt, do_classifier_free_guidance, device, dtype):
+    """Expand one value per prompt to one per UNet batch row ([uncond..., cond...] under CFG)."""
+    scale = torch.tensor(scale, device=device, dtype=dtype).repeat_interleave(num_images_per_prompt)
+    if do_classifier_free_guidance:
+        scale = torch.cat([scale, scale])
+    return scale
+
+
+def _tensor_digest(tensor):
+    """Content hash of a tensor (shape, dtype and bytes), used to key cached K/V across calls."""
+    data = tensor.detach().contiguous().cpu()
+    digest = hashlib.sha1(f"{tuple(data.shape)}:{data.dtype}".encode())
+    digest.update(data.view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
 class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
     def cuda(self, dtype=torch.float16, use_xformers=False):
         self.to("cuda", dtype)
@@ -446,7 +671,10 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
             self.image_proj_model.to(self.unet.device).to(self.unet.dtype)
 
         if use_xformers:
-            if is_xformers_available():
+            if self._ip_attn_processors():
+                # diffusers' xformers switch would replace the identity processors; use their own backend
+                self.set_attention_backend("xformers")
+            elif is_xformers_available():
                 import xformers
                 from packaging import version
 
@@ -460,75 +688,188 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
                 raise ValueError("xformers is not available. Make sure it is installed correctly")
 
     def load_ip_adapter_instantid(self, model_ckpt, image_emb_dim=512, num_tokens=16, scale=0.5):
-        self.set_image_proj_model(model_ckpt, image_emb_dim, num_tokens)
-        self.set_ip_adapter(model_ckpt, num_tokens, scale)
+        if str(model_ckpt).endswith(".safetensors"):
+            # Converted adapter: one memory-mapped pass, each tensor read straight to the device
+            self.set_image_proj_model(None, image_emb_dim, num_tokens)
+            self.set_ip_adapter(None, num_tokens, scale)
+            ip_layers = torch.nn.ModuleList(self.unet.attn_processors.values())
+            load_adapter_safetensors(
+                model_ckpt, {"image_proj": self.image_proj_model, "ip_adapter": ip_layers}, self.device
+            )
+            return
 
-    def set_image_proj_model(self, model_ckpt, image_emb_dim=512, num_tokens=16):
-        image_proj_model = Resampler(
-            dim=1280,
-            depth=4,
-            dim_head=64,
-            heads=20,
-            num_queries=num_tokens,
-            embedding_dim=image_emb_dim,
-            output_dim=self.unet.config.cross_attention_dim,
-            ff_mult=4,
-        )
+        # Pickled checkpoint: deserialized once and shared by both loaders
+        state_dict = torch.load(model_ckpt, map_location="cpu")
+        self.set_image_proj_model(state_dict, image_emb_dim, num_tokens)
+        self.set_ip_adapter(state_dict, num_tokens, scale)
 
-        image_proj_model.eval()
+    def set_image_proj_model(self, model_ckpt, image_emb_dim=512, num_tokens=16):
+        """`model_ckpt`: a pickled checkpoint path, its loaded state dict, or None to leave the weights to the caller."""
+        image_proj_model = build_image_proj_model(self.unet.config.cross_attention_dim, image_emb_dim, num_tokens)
 
         self.image_proj_model = image_proj_model.to(self.device, dtype=self.dtype)
-        state_dict = torch.load(model_ckpt, map_location="cpu")
-        if "image_proj" in state_dict:
-            state_dict = state_dict["image_proj"]
-        self.image_proj_model.load_state_dict(state_dict)
+        if model_ckpt is not None:
+            state_dict = torch.load(model_ckpt, map_location="cpu") if not isinstance(model_ckpt, dict) else model_ckpt
+            if "image_proj" in state_dict:
+                state_dict = state_dict["image_proj"]
+            self.image_proj_model.load_state_dict(state_dict)
 
         self.image_proj_model_in_features = image_emb_dim
 
     def set_ip_adapter(self, model_ckpt, num_tokens, scale):
+        """`model_ckpt`: a pickled checkpoint path, its loaded state dict, or None to leave the weights to the caller."""
         unet = self.unet
-        attn_procs = {}
-        for name in unet.attn_processors.keys():
-            cross_attention_dim = None if name.endswith("attn1.processor") else unet.config.cross_attention_dim
-            if name.startswith("mid_block"):
-                hidden_size = unet.config.block_out_channels[-1]
-            elif name.startswith("up_blocks"):
-                block_id = int(name[len("up_blocks.")])
-                hidden_size = list(reversed(unet.config.block_out_channels))[block_id]
-            elif name.startswith("down_blocks"):
-                block_id = int(name[len("down_blocks.")])
-                hidden_size = unet.config.block_out_channels[block_id]
-            if cross_attention_dim is None:
-                attn_procs[name] = AttnProcessor().to(unet.device, dtype=unet.dtype)
-            else:
-                attn_procs[name] = IPAttnProcessor(
-                    hidden_size=hidden_size,
-                    cross_attention_dim=cross_attention_dim,
-                    scale=scale,
-                    num_tokens=num_tokens,
-                ).to(unet.device, dtype=unet.dtype)
-        unet.set_attn_processor(attn_procs)
+        unet.set_attn_processor(build_ip_attn_processors(unet, num_tokens, scale))
 
-        state_dict = torch.load(model_ckpt, map_location="cpu")
-        ip_layers = torch.nn.ModuleList(self.unet.attn_processors.values())
-        if "ip_adapter" in state_dict:
-            state_dict = state_dict["ip_adapter"]
-        ip_layers.load_state_dict(state_dict)
+        if model_ckpt is not None:
+            state_dict = torch.load(model_ckpt, map_location="cpu") if not isinstance(model_ckpt, dict) else model_ckpt
+            ip_layers = torch.nn.ModuleList(self.unet.attn_processors.values())
+            if "ip_adapter" in state_dict:
+                state_dict = state_dict["ip_adapter"]
+            ip_layers.load_state_dict(state_dict)
 
-    def set_ip_adapter_scale(self, scale):
+    def _ip_attn_processors(self):
+        unet = getattr(self, self.unet_name) if not hasattr(self, "unet") else self.unet
+        return [p for p in unet.attn_processors.values() if isinstance(p, IPAttnProcessor)]
+
+    def set_attention_backend(self, backend="auto"):
+        """
+        Select the attention kernel of the InstantID processors. Returns the resolved backend.
+
+        Use this instead of enable_xformers_memory_efficient_attention/enable_attention_slicing,
+        which replace every processor, dropping the identity (IP) attention.
+        """
+        backend = resolve_attention_backend(backend)
         unet = getattr(self, self.unet_name) if not hasattr(self, "unet") else self.unet
         for attn_processor in unet.attn_processors.values():
-            if isinstance(attn_processor, IPAttnProcessor):
-                attn_processor.scale = scale
+            if isinstance(attn_processor, (AttnProcessor, IPAttnProcessor)):
+                attn_processor.backend = backend
+        if getattr(self, "text_kv_cache", None) is not None:
+            # Cached K/V are stored in the previous backend's head layout
+            self.text_kv_cache.clear("attention_backend")
+        return backend
+
+    @contextmanager
+    def _kv_cache_scope(self, text_kv_key=None):
+        """
+        Cache text and identity-token K/V in every IP processor for one call; always cleared on exit.
+
+        Both are constant for a call, so to_k/to_v and to_k_ip/to_v_ip run once per layer (and CFG
+        branch) instead of every step. Off when `cache_attention_kv` is False (compiled UNet).
 
-    def _encode_prompt_image_emb(self, prompt_image_emb, device, dtype, do_classifier_free_guidance):
-        if isinstance(prompt_image_emb, torch.Tensor):
+        With a `text_kv_cache` on the pipeline and a `text_kv_key`, the text K/V are also shared across
+        calls: a hit pre-fills the processors, a miss stores them once the call completes.
+        """
+        unet = getattr(self, self.unet_name) if not hasattr(self, "unet") else self.unet
+        processors = {}
+        if getattr(self, "cache_attention_kv", True):
+            processors = {
+                name: p for name, p in unet.attn_processors.items() if isinstance(p, IPAttnProcessor)
+            }
+        text_kv_cache = getattr(self, "text_kv_cache", None) if text_kv_key is not None else None
+        cached = text_kv_cache.get(text_kv_key) if text_kv_cache is not None and processors else None
+
+        for name, attn_processor in processors.items():
+            attn_processor.kv_cache = dict(cached.get(name, {})) if cached else {}
+        try:
+            yield
+            if text_kv_cache is not None and processors and cached is None:
+                entry = {
+                    name: {k: v for k, v in p.kv_cache.items() if k[0] == "text"}
+                    for name, p in processors.items()
+                }
+                # Only complete calls are shared: every processor must have seen the full batch
+                if all(entry.values()):
+                    text_kv_cache.put(text_kv_key, entry)
+        finally:
+            for attn_processor in processors.values():
+                attn_processor.kv_cache = None
+
+    @contextmanager
+    def _identity_regions_scope(self, regions):
+        """Route each identity's tokens to its own region in every IP processor for one call."""
+        processors = self._ip_attn_processors() if regions is not None else []
+        for attn_processor in processors:
+            attn_processor.identity_regions = regions
+        try:
+            yield
+        finally:
+            for attn_processor in processors:
+                attn_processor.identity_regions = None
+
+    def compiled_state_signature(self):
+        """
+        IP processor state read inside the UNet forward, appended to CompiledPipeline's shape key.
+
+        Dynamo guards on these attributes, so a state not seen during warm-up (identity regions,
+        per-sample or non-default scales) misses and runs eager instead of recompiling.
+        """
+        processors = self._ip_attn_processors()
+        if not processors:
+            return ()
+        processor = processors[0]
+        scale = processor.scale
+        scale_key = ("per_sample", tuple(scale.shape)) if isinstance(scale, torch.Tensor) else float(scale)
+        regions = processor.identity_regions
+        return (
+            ("ip_scale", scale_key),
+            ("identity_regions", None if regions is None else regions.count),
+            ("kv_cache", processor.kv_cache is not None),
+        )
+
+    def set_ip_adapter_scale(self, scale):
+        self._ip_adapter_scale = scale
+        for attn_processor in self._ip_attn_processors():
+            attn_processor.scale = scale
+
+    def _apply_ip_adapter_scale(self, ip_adapter_scale, batch_size, num_images_per_prompt, device, dtype):
+        """Set the IP scale for one call: the pipeline default, one float, or one value per prompt."""
+        processors = self._ip_attn_processors()
+        if not processors:
+            return
+        if getattr(self, "_ip_adapter_scale", None) is None:
+            # Pipelines restored from a snapshot carry their default on the processors
+            self._ip_adapter_scale = float(processors[0].scale)
+
+        scale = _collapse_scale(ip_adapter_scale, batch_size, "ip_adapter_scale")
+        if scale is None:
+            scale = self._ip_adapter_scale
+        elif isinstance(scale, list):
+            # One value per UNet batch row, broadcast over tokens and channels
+            scale = _per_sample_scale(
+                scale, num_images_per_prompt, self.do_classifier_free_guidance, device, dtype
+            ).view(-1, 1, 1)
+        for attn_processor in processors:
+            attn_processor.scale = scale
+
+    def _encode_prompt_image_emb(
+        self, prompt_image_emb, device, dtype, do_classifier_free_guidance, batch_size=1, num_identities=1
+    ):
+        """
+        Project face embeddings to identity tokens.
+
+        A list holds one embedding per prompt; anything else is a single identity shared by all prompts.
+        With `num_identities` > 1 each entry holds that many embeddings; each is projected on its own and
+        their tokens are concatenated in order.
+        """
+        if isinstance(prompt_image_emb, (list, tuple)):
+            if len(prompt_image_emb) != batch_size:
+                raise ValueError(
+                    f"Got {len(prompt_image_emb)} image embeddings for {batch_size} prompts"
+                )
+            prompt_image_emb = torch.stack([torch.as_tensor(emb) for emb in prompt_image_emb])
+            samples = batch_size
+        elif isinstance(prompt_image_emb, torch.Tensor):
             prompt_image_emb = prompt_image_emb.clone().detach()
+            samples = 1
         else:
             prompt_image_emb = torch.tensor(prompt_image_emb)
+            samples = 1
 
         prompt_image_emb = prompt_image_emb.to(device=device, dtype=dtype)
-        prompt_image_emb = prompt_image_emb.reshape([1, -1, self.image_proj_model_in_features])
+        prompt_image_emb = prompt_image_emb.reshape([samples * num_identities, -1, self.image_proj_model_in_features])
+        if samples != batch_size:
+            prompt_image_emb = prompt_image_emb.repeat(batch_size, 1, 1)
 
         if do_classifier_free_guidance:
             prompt_image_emb = torch.cat([torch.zeros_like(prompt_image_emb), prompt_image_emb], dim=0)
@@ -536,8 +877,45 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
             prompt_image_emb = torch.cat([prompt_image_emb], dim=0)
 
         prompt_image_emb = self.image_proj_model(prompt_image_emb)
+        if num_identities > 1:
+            prompt_image_emb = prompt_image_emb.reshape(-1, num_identities * prompt_image_emb.shape[1], prompt_image_emb.shape[2])
         return prompt_image_emb
 
+    def _img2img_timesteps(self, num_inference_steps, strength):
+        """The last `strength` fraction of the scheduler's timesteps (at least one step) and their step count."""
+        init_steps = max(1, min(int(num_inference_steps * strength), num_inference_steps))
+        t_start = num_inference_steps - init_steps
+        timesteps = self.scheduler.timesteps[t_start * self.scheduler.order:]
+        if hasattr(self.scheduler, "set_begin_index"):
+            self.scheduler.set_begin_index(t_start * self.scheduler.order)
+        return timesteps, init_steps
+
+    def prepare_img2img_latents(
+        self, init_image, timestep, batch_size, num_images_per_prompt, height, width, dtype, device, generator
+    ):
+        """VAE-encode the input photo(s) and noise them to `timestep` (one image, or one per prompt)."""
+        init_image = self.image_processor.preprocess(init_image, height=height, width=width)
+
+        # Same float16 overflow guard as the decode at the end of the call
+        needs_upcasting = self.vae.dtype == torch.float16 and self.vae.config.force_upcast
+        if needs_upcasting:
+            self.vae.to(dtype=torch.float32)
+        init_image = init_image.to(device=device, dtype=self.vae.dtype)
+        init_latents = self.vae.encode(init_image).latent_dist.mode()
+        if needs_upcasting:
+            self.vae.to(dtype=torch.float16)
+        init_latents = (init_latents * self.vae.config.scaling_factor).to(dtype)
+
+        if init_latents.shape[0] == 1:
+            init_latents = init_latents.repeat(batch_size, 1, 1, 1)
+        elif init_latents.shape[0] * num_images_per_prompt == batch_size:
+            init_latents = init_latents.repeat_interleave(num_images_per_prompt, dim=0)
+        else:
+            raise ValueError(f"Got {init_latents.shape[0]} init images for {batch_size // num_images_per_prompt} prompts")
+
+        noise = randn_tensor(init_latents.shape, generator=generator, device=device, dtype=dtype)
+        return self.scheduler.add_noise(init_latents, noise, timestep.repeat(batch_size))
+
     def check_inputs(
         self,
         prompt,
@@ -593,7 +971,14 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
         negative_prompt_embeds: Optional[torch.FloatTensor] = None,
         pooled_prompt_embeds: Optional[torch.FloatTensor] = None,
         negative_pooled_prompt_embeds: Optional[torch.FloatTensor] = None,
-        image_embeds: Optional[torch.FloatTensor] = None,
+        image_embeds: Optional[Union[torch.FloatTensor, List[torch.FloatTensor]]] = None,
+        ip_adapter_scale: Optional[Union[float, List[float]]] = None,
+        controlnet_cache_interval: int = 1,
+        guidance_end: float = 1.0,
+        adapter_state: Optional[str] = None,
+        identity_masks: Optional[Union[torch.Tensor, np.ndarray]] = None,
+        init_image: Optional[PipelineImageInput] = None,
+        strength: float = 1.0,
         output_type: Optional[str] = "pil",
         return_dict: bool = True,
         cross_attention_kwargs: Optional[Dict[str, Any]] = None,
@@ -674,8 +1059,12 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
                 Pre-generated negative pooled text embeddings. Can be used to easily tweak text inputs (prompt
                 weighting). If not provided, pooled `negative_prompt_embeds` are generated from `negative_prompt` input
                 argument.
-            image_embeds (`torch.FloatTensor`, *optional*):
-                Pre-generated image embeddings.
+            image_embeds (`torch.FloatTensor` or `List[torch.FloatTensor]`, *optional*):
+                Pre-generated face embeddings. A list holds one embedding per prompt, so one call can render several
+                identities; a single embedding is shared by all prompts.
+            ip_adapter_scale (`float` or `List[float]`, *optional*):
+                Identity (IP-Adapter) strength for this call, or one value per prompt. Defaults to the scale set by
+                `set_ip_adapter_scale`.
             output_type (`str`, *optional*, defaults to `"pil"`):
                 The output format of the generated image. Choose between `PIL.Image` or `np.array`.
             return_dict (`bool`, *optional*, defaults to `True`):
@@ -687,7 +1076,28 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
             controlnet_conditioning_scale (`float` or `List[float]`, *optional*, defaults to 1.0):
                 The outputs of the ControlNet are multiplied by `controlnet_conditioning_scale` before they are added
                 to the residual in the original `unet`. If multiple ControlNets are specified in `init`, you can set
-                the corresponding scale as a list.
+                the corresponding scale as a list. With a single ControlNet, a list with one value per prompt scales
+                each sample's residuals separately.
+            controlnet_cache_interval (`int`, *optional*, defaults to 1):
+                Run the ControlNet every `controlnet_cache_interval` steps and reuse its residuals in between. 1 runs
+                it every step. Steps where its effective scale is zero skip it regardless.
+            guidance_end (`float`, *optional*, defaults to 1.0):
+                Fraction of the denoising steps that use classifier-free guidance. Later steps run only the
+                conditional branch, with prompt, identity and ControlNet inputs sliced to match, at half the cost.
+            adapter_state (`str`, *optional*):
+                Identifies the active LoRA adapters and weights. When given and the pipeline has a `text_kv_cache`,
+                the text cross-attention K/V are looked up by (adapter_state, prompt embeddings) and reused across
+                calls. The caller must clear the cache whenever adapter weights are loaded or deleted.
+            identity_masks (`torch.Tensor` or `np.ndarray`, *optional*):
+                Several identities in one image: one (height, width) mask per face, at any resolution (see
+                `identity_region_masks`). `image_embeds` then holds one embedding per face, in the same order, and
+                each face's identity tokens only act inside its mask. `image` should carry every face's keypoints.
+            init_image (`PIL.Image.Image` or `List[PIL.Image.Image]`, *optional*):
+                Photo (or one per prompt) to restyle instead of generating from pure noise. Used when `strength` < 1.
+            strength (`float`, *optional*, defaults to 1.0):
+                With `init_image`, how much of the photo is re-noised: only the last `strength` fraction of the
+                `num_inference_steps` run, from the VAE-encoded photo noised to that point, still with identity and
+                ControlNet conditioning. 1.0 ignores `init_image` and denoises from pure noise.
             guess_mode (`bool`, *optional*, defaults to `False`):
                 The ControlNet encoder tries to recognize the content of the input image even if you remove all
                 prompts. A `guidance_scale` value between 3.0 and 5.0 is recommended.
@@ -809,11 +1219,20 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
 
         # Convert scalar controlnet_conditioning_scale to list for MultiControlNetModel
         # Use duck typing instead of strict isinstance check to support numpy types (np.float64, np.float32) and int
+        controlnet_sample_scale = None
         if isinstance(controlnet, MultiControlNetModel) and not isinstance(controlnet_conditioning_scale, list):
             controlnet_conditioning_scale = [float(controlnet_conditioning_scale)] * len(controlnet.nets)
         elif not isinstance(controlnet_conditioning_scale, list):
             # Normalize single value to native Python float to avoid numpy type issues
             controlnet_conditioning_scale = float(controlnet_conditioning_scale)
+        elif isinstance(controlnet, ControlNetModel) and batch_size > 1 and len(controlnet_conditioning_scale) == batch_size:
+            # One scale per prompt: run the ControlNet at 1.0 and scale each sample's residuals
+            controlnet_conditioning_scale = _collapse_scale(
+                controlnet_conditioning_scale, batch_size, "controlnet_conditioning_scale"
+            )
+            if isinstance(controlnet_conditioning_scale, list):
+                controlnet_sample_scale = controlnet_conditioning_scale
+                controlnet_conditioning_scale = 1.0
 
         global_pool_conditions = (
             controlnet.config.global_pool_conditions
@@ -848,13 +1267,19 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
         )
 
         # 3.2 Encode image prompt
+        num_identities = len(identity_masks) if identity_masks is not None else 1
         prompt_image_emb = self._encode_prompt_image_emb(
-            image_embeds, device, self.unet.dtype, self.do_classifier_free_guidance
+            image_embeds, device, self.unet.dtype, self.do_classifier_free_guidance, batch_size, num_identities
         )
         bs_embed, seq_len, _ = prompt_image_emb.shape
         prompt_image_emb = prompt_image_emb.repeat(1, num_images_per_prompt, 1)
         prompt_image_emb = prompt_image_emb.view(bs_embed * num_images_per_prompt, seq_len, -1)
 
+        # 3.3 Identity strength (per prompt when given as a list)
+        self._apply_ip_adapter_scale(
+            ip_adapter_scale, batch_size, num_images_per_prompt, device, prompt_embeds.dtype
+        )
+
         # 4. Prepare image
         if isinstance(controlnet, ControlNetModel):
             image = self.prepare_image(
@@ -892,23 +1317,48 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
         else:
             assert False
 
-        # 5. Prepare timesteps
+        # 4.1 Identity regions at latent resolution (multi-face)
+        identity_regions = None
+        if identity_masks is not None:
+            masks = torch.as_tensor(np.asarray(identity_masks, dtype=np.float32), device=device)
+            latent_size = (height // self.vae_scale_factor, width // self.vae_scale_factor)
+            identity_regions = IdentityRegions(F.interpolate(masks[None], size=latent_size, mode="area")[0])
+
+        # 5. Prepare timesteps (img2img: only the last `strength` fraction of them)
+        if not 0.0 < strength <= 1.0:
+            raise ValueError(f"`strength` must be in (0, 1] but is {strength}")
+        img2img = init_image is not None and strength < 1.0 and latents is None
         self.scheduler.set_timesteps(num_inference_steps, device=device)
         timesteps = self.scheduler.timesteps
+        if img2img:
+            timesteps, num_inference_steps = self._img2img_timesteps(num_inference_steps, strength)
         self._num_timesteps = len(timesteps)
 
         # 6. Prepare latent variables
-        num_channels_latents = self.unet.config.in_channels
-        latents = self.prepare_latents(
-            batch_size * num_images_per_prompt,
-            num_channels_latents,
-            height,
-            width,
-            prompt_embeds.dtype,
-            device,
-            generator,
-            latents,
-        )
+        if img2img:
+            latents = self.prepare_img2img_latents(
+                init_image,
+                timesteps[:1],
+                batch_size * num_images_per_prompt,
+                num_images_per_prompt,
+                height,
+                width,
+                prompt_embeds.dtype,
+                device,
+                generator,
+            )
+        else:
+            num_channels_latents = self.unet.config.in_channels
+            latents = self.prepare_latents(
+                batch_size * num_images_per_prompt,
+                num_channels_latents,
+                height,
+                width,
+                prompt_embeds.dtype,
+                device,
+                generator,
+                latents,
+            )
 
         # 6.5 Optionally get Guidance Scale Embedding
         timestep_cond = None
@@ -972,17 +1422,61 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
         add_time_ids = add_time_ids.to(device).repeat(batch_size * num_images_per_prompt, 1)
         encoder_hidden_states = torch.cat([prompt_embeds, prompt_image_emb], dim=1)
 
+        if controlnet_sample_scale is not None:
+            # Rows follow the ControlNet input, which is only the conditional half in guess mode
+            controlnet_sample_scale = _per_sample_scale(
+                controlnet_sample_scale,
+                num_images_per_prompt,
+                self.do_classifier_free_guidance and not guess_mode,
+                device,
+                prompt_embeds.dtype,
+            ).view(-1, 1, 1, 1)
+
         # 8. Denoising loop
         num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
         is_unet_compiled = is_compiled_module(self.unet)
         is_controlnet_compiled = is_compiled_module(self.controlnet)
         is_torch_higher_equal_2_1 = is_torch_version(">=", "2.1")
 
-        with self.progress_bar(total=num_inference_steps) as progress_bar:
+        if not 0.0 < guidance_end <= 1.0:
+            raise ValueError(f"`guidance_end` must be in (0, 1] but is {guidance_end}")
+        guidance_end_step = int(round(len(timesteps) * guidance_end))
+
+        if controlnet_cache_interval < 1:
+            raise ValueError(f"`controlnet_cache_interval` must be >= 1 but is {controlnet_cache_interval}")
+        controlnet_cache = None  # (step, cond_scale, down residuals, mid residual)
+        self._controlnet_calls = 0
+
+        text_kv_key = None
+        if adapter_state is not None and getattr(self, "text_kv_cache", None) is not None:
+            text_kv_key = (adapter_state, _tensor_digest(prompt_embeds))
+
+        with self.progress_bar(total=num_inference_steps) as progress_bar, self._kv_cache_scope(text_kv_key), \
+                self._identity_regions_scope(identity_regions):
             for i, t in enumerate(timesteps):
+                if self.do_classifier_free_guidance and i >= guidance_end_step:
+                    # Truncated CFG: keep only the conditional half ([uncond..., cond...]) of every input
+                    self._guidance_scale = 1.0
+                    prompt_embeds = prompt_embeds.chunk(2)[1]
+                    add_text_embeds = add_text_embeds.chunk(2)[1]
+                    add_time_ids = add_time_ids.chunk(2)[1]
+                    encoder_hidden_states = encoder_hidden_states.chunk(2)[1]
+                    prompt_image_emb = prompt_image_emb.chunk(2)[1]
+                    if not guess_mode:
+                        # In guess mode these already hold the conditional batch only
+                        image = [img.chunk(2)[1] for img in image] if isinstance(image, list) else image.chunk(2)[1]
+                        if controlnet_sample_scale is not None:
+                            controlnet_sample_scale = controlnet_sample_scale.chunk(2)[1]
+                    controlnet_cache = None
+                    self._apply_ip_adapter_scale(
+                        ip_adapter_scale, batch_size, num_images_per_prompt, device, prompt_embeds.dtype
+                    )
+
                 # Relevant thread:
                 # https://dev-discuss.pytorch.org/t/cudagraphs-in-pytorch-2-0/1428
-                if (is_unet_compiled and is_controlnet_compiled) and is_torch_higher_equal_2_1:
+                # CompiledPipeline swaps instance-level forwards, which is_compiled_module does not detect
+                compiled_dispatch = getattr(self, "compiled_dispatch", False)
+                if (compiled_dispatch or (is_unet_compiled and is_controlnet_compiled)) and is_torch_higher_equal_2_1:
                     torch._inductor.cudagraph_mark_step_begin()
                 # expand the latents if we are doing classifier free guidance
                 latent_model_input = torch.cat([latents] * 2) if self.do_classifier_free_guidance else latents
@@ -1013,23 +1507,46 @@ class StableDiffusionXLInstantIDPipeline(StableDiffusionXLControlNetPipeline):
                         controlnet_cond_scale = controlnet_cond_scale[0]
                     cond_scale = controlnet_cond_scale * controlnet_keep[i]
 
-                down_block_res_samples, mid_block_res_sample = self.controlnet(
-                    control_model_input,
-                    t,
-                    encoder_hidden_states=prompt_image_emb,
-                    controlnet_cond=image,
-                    conditioning_scale=cond_scale,
-                    guess_mode=guess_mode,
-                    added_cond_kwargs=controlnet_added_cond_kwargs,
-                    return_dict=False,
-                )
-
-                if guess_mode and self.do_classifier_free_guidance:
-                    # Infered ControlNet only for the conditional batch.
-                    # To apply the output of ControlNet to both the unconditional and conditional batches,
-                    # add 0 to the unconditional batch to keep it unchanged.
-                    down_block_res_samples = [torch.cat([torch.zeros_like(d), d]) for d in down_block_res_samples]
-                    mid_block_res_sample = torch.cat([torch.zeros_like(mid_block_res_sample), mid_block_res_sample])
+                controlnet_off = not any(cond_scale) if isinstance(cond_scale, list) else cond_scale == 0
+                if controlnet_off:
+                    # Residuals would be scaled to zero: skip the ControlNet forward entirely
+                    down_block_res_samples, mid_block_res_sample = None, None
+                elif (
+                    controlnet_cache is not None
+                    and controlnet_cache[1] == cond_scale
+                    and i - controlnet_cache[0] < controlnet_cache_interval
+                ):
+                    # Reuse the residuals of the last ControlNet step (same scales)
+                    down_block_res_samples, mid_block_res_sample = controlnet_cache[2], controlnet_cache[3]
+                else:
+                    down_block_res_samples, mid_block_res_sample = self.controlnet(
+                        control_model_input,
+                        t,
+                        encoder_hidden_states=prompt_image_emb,
+                        controlnet_cond=image,
+                        conditioning_scale=cond_scale,
+                        guess_mode=guess_mode,
+                        added_cond_kwargs=controlnet_added_cond_kwargs,
+                        return_dict=False,
+                    )
+                    self._controlnet_calls += 1
+
+                    if controlnet_sample_scale is not None:
+                        down_block_res_samples = [d * controlnet_sample_scale for d in down_block_res_samples]
+                        mid_block_res_sample = mid_block_res_sample * controlnet_sample_scale
+
+                    if guess_mode and self.do_classifier_free_guidance:
+                        # Infered ControlNet only for the conditional batch.
+                        # To apply the output of ControlNet to both the unconditional and conditional batches,
+                        # add 0 to the unconditional batch to keep it unchanged.
+                        down_block_res_samples = [torch.cat([torch.zeros_like(d), d]) for d in down_block_res_samples]
+                        mid_block_res_sample = torch.cat([torch.zeros_like(mid_block_res_sample), mid_block_res_sample])
+
+                    if controlnet_cache_interval > 1:
+                        # Copies: CUDA graph outputs (compiled ControlNet) are overwritten by the next replay
+                        down_block_res_samples = [d.clone() for d in down_block_res_samples]
+                        mid_block_res_sample = mid_block_res_sample.clone()
+                        controlnet_cache = (i, cond_scale, down_block_res_samples, mid_block_res_sample)
 
                 # predict the noise residual
                 noise_pred = self.unet(
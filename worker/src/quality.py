@@ -0,0 +1,78 @@
+"""
+Quality tiers for Jhakaas Worker.
+
+A tier picks the scheduler, step count, guidance scale and token-merge ratio
+(TOKEN_MERGE_RATIO_BY_TIER, off unless set) for a request:
+- fast: LCM scheduler with the LCM-LoRA step-distillation adapter (4-8 steps)
+- standard: Euler at INFERENCE_STEPS (the previous default)
+- best: DPM-Solver++ with Karras sigmas at more steps
+
+Schedulers are swapped on the live pipeline (`pipe.scheduler = ...`), so
+changing tier never rebuilds or reloads any model component.
+"""
+
+from typing import Dict, Literal
+
+from diffusers import DPMSolverMultistepScheduler, EulerDiscreteScheduler, LCMScheduler
+
+from src.config import settings
+
+QualityTier = Literal["fast", "standard", "best"]
+
+# Adapter name of the step-distillation LoRA, alongside the style LoRA adapters
+DISTILLATION_ADAPTER = "lcm"
+
+
+def tier_config(tier: str) -> Dict:
+    """Scheduler class and sampling parameters for a quality tier."""
+    tiers = {
+        "fast": {
+            "scheduler": LCMScheduler,
+            "scheduler_kwargs": {},
+            "steps": settings.fast_tier_steps,
+            # LCM is distilled for little or no CFG; 1.5 keeps some identity guidance
+            "guidance_scale": 1.5,
+            "distilled": True,
+            "token_merge_ratio": settings.token_merge_ratio_by_tier.get("fast", 0.0),
+        },
+        "standard": {
+            "scheduler": EulerDiscreteScheduler,
+            "scheduler_kwargs": {},
+            "steps": settings.inference_steps,
+            "guidance_scale": settings.guidance_scale,
+            "distilled": False,
+            "token_merge_ratio": settings.token_merge_ratio_by_tier.get("standard", 0.0),
+        },
+        "best": {
+            "scheduler": DPMSolverMultistepScheduler,
+            "scheduler_kwargs": {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True},
+            "steps": settings.best_tier_steps,
+            "guidance_scale": settings.guidance_scale,
+            "distilled": False,
+            "token_merge_ratio": settings.token_merge_ratio_by_tier.get("best", 0.0),
+        },
+    }
+    if tier not in tiers:
+        raise ValueError(f"Unknown quality tier: {tier}")
+    return tiers[tier]
+
+
+class SchedulerSet:
+    """
+    One scheduler instance per tier, built from a pipeline's original scheduler config.
+
+    Schedulers only hold timestep state that set_timesteps() resets at the start
+    of every generation, so the instances are reused across requests.
+    """
+
+    def __init__(self, base_config):
+        self.base_config = base_config
+        self._schedulers = {}
+
+    def get(self, tier: str):
+        if tier not in self._schedulers:
+            config = tier_config(tier)
+            self._schedulers[tier] = config["scheduler"].from_config(
+                self.base_config, **config["scheduler_kwargs"]
+            )
+        return self._schedulers[tier]
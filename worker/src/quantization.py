@@ -0,0 +1,145 @@
+"""
+Weight-only int8 quantization for Jhakaas Worker.
+
+UNet and ControlNet Linear/Conv2d weights are stored as int8 with one fp16
+scale per output channel (symmetric, absmax / 127). Activations stay in
+fp16: each layer dequantizes its weight right before its matmul/conv, so
+only one layer's fp16 weight exists at a time and resident weights take
+half the memory.
+
+Weights are quantized once offline by models/quantize_models.py into a
+`diffusion_pytorch_model.int8.safetensors` variant next to the fp16 file.
+build_model_on_device() recognizes the int8 layout from the file header
+and swaps in the int8 layers before streaming the weights.
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+import torch
+import torch.nn.functional as F
+
+QUANTIZED_VARIANT = "int8"
+SCALE_SUFFIX = ".weight_scale"
+
+# Kept in fp16: conv_in also defines ModelMixin.dtype (its first parameter),
+# conv_out and the ControlNet zero-convs are small and precision-sensitive
+SKIP_PREFIXES = (
+    "conv_in", "conv_out", "time_embedding", "add_embedding",
+    "controlnet_cond_embedding", "controlnet_down_blocks", "controlnet_mid_block",
+)
+
+# Layers below this many weights save too little to be worth the dequantize
+MIN_QUANTIZED_NUMEL = 4096
+
+
+def quantize_weight(weight: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Symmetric per-output-channel int8 quantization. Returns (int8 weight, fp16 scales)."""
+    weight = weight.float()
+    absmax = weight.abs().reshape(weight.shape[0], -1).amax(dim=1)
+    scale = (absmax / 127.0).clamp(min=1e-8)
+    view = (-1,) + (1,) * (weight.dim() - 1)
+    quantized = torch.round(weight / scale.view(view)).clamp(-127, 127).to(torch.int8)
+    return quantized, scale.to(torch.float16)
+
+
+class Int8Linear(torch.nn.Linear):
+    """nn.Linear whose weight is int8 with per-output-channel scales.
+
+    Subclassing nn.Linear keeps PEFT LoRA injection working: the adapter wraps
+    this layer as its base layer and adds its own output on top.
+    """
+
+    def __init__(self, in_features: int, out_features: int, bias: bool = True, device=None):
+        super().__init__(in_features, out_features, bias=bias, device=device)
+        self.weight.requires_grad_(False)
+        self.register_buffer("weight_scale", torch.empty(out_features, device=device, dtype=torch.float16))
+
+    @classmethod
+    def from_linear(cls, linear: torch.nn.Linear, device=None) -> "Int8Linear":
+        return cls(linear.in_features, linear.out_features, bias=linear.bias is not None, device=device)
+
+    def dequantized_weight(self, dtype: torch.dtype) -> torch.Tensor:
+        return self.weight.to(dtype) * self.weight_scale.to(dtype).unsqueeze(1)
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        bias = self.bias.to(input.dtype) if self.bias is not None else None
+        return F.linear(input, self.dequantized_weight(input.dtype), bias)
+
+
+class Int8Conv2d(torch.nn.Conv2d):
+    """nn.Conv2d whose weight is int8 with per-output-channel scales."""
+
+    def __init__(self, conv: torch.nn.Conv2d, device=None):
+        super().__init__(
+            conv.in_channels, conv.out_channels, conv.kernel_size,
+            stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+            groups=conv.groups, bias=conv.bias is not None, padding_mode=conv.padding_mode,
+            device=device,
+        )
+        self.weight.requires_grad_(False)
+        self.register_buffer("weight_scale", torch.empty(conv.out_channels, device=device, dtype=torch.float16))
+
+    def dequantized_weight(self, dtype: torch.dtype) -> torch.Tensor:
+        return self.weight.to(dtype) * self.weight_scale.to(dtype).view(-1, 1, 1, 1)
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        bias = self.bias.to(input.dtype) if self.bias is not None else None
+        return self._conv_forward(input, self.dequantized_weight(input.dtype), bias)
+
+
+def quantizable_layers(model: torch.nn.Module) -> List[str]:
+    """Names of the plain Linear/Conv2d layers that are stored as int8."""
+    names = []
+    for name, module in model.named_modules():
+        # Exact types only: LoRA wrappers and already-quantized layers are left alone
+        if type(module) not in (torch.nn.Linear, torch.nn.Conv2d):
+            continue
+        if name.startswith(SKIP_PREFIXES) or module.weight.numel() < MIN_QUANTIZED_NUMEL:
+            continue
+        names.append(name)
+    return names
+
+
+def _int8_layer(module: torch.nn.Module, device=None) -> torch.nn.Module:
+    if isinstance(module, torch.nn.Conv2d):
+        return Int8Conv2d(module, device=device)
+    return Int8Linear.from_linear(module, device=device)
+
+
+def _replace(model: torch.nn.Module, name: str, layer: torch.nn.Module):
+    parent_path, _, leaf = name.rpartition(".")
+    parent = model.get_submodule(parent_path) if parent_path else model
+    setattr(parent, leaf, layer)
+
+
+def is_quantized_checkpoint(header: Dict) -> bool:
+    """True when a safetensors header holds int8 weights with per-channel scales."""
+    return any(name.endswith(SCALE_SUFFIX) for name in header)
+
+
+def prepare_quantized_layout(model: torch.nn.Module, header: Dict) -> int:
+    """
+    Swap layers listed as int8 in a checkpoint header for empty (meta) int8 layers.
+
+    Must run on a meta-initialised model before its weights are streamed in.
+    Returns the number of layers swapped.
+    """
+    names = [name[:-len(SCALE_SUFFIX)] for name in header if name.endswith(SCALE_SUFFIX)]
+    for name in names:
+        _replace(model, name, _int8_layer(model.get_submodule(name), device="meta"))
+    return len(names)
+
+
+def quantize_model(model: torch.nn.Module, names: Iterable[str] = None) -> int:
+    """Quantize a loaded float model in place (benchmarks/tests; production loads offline artifacts)."""
+    names = list(names) if names is not None else quantizable_layers(model)
+    for name in names:
+        module = model.get_submodule(name)
+        layer = _int8_layer(module, device="meta")  # Every tensor is replaced below
+        quantized, scale = quantize_weight(module.weight.data)
+        layer.weight = torch.nn.Parameter(quantized, requires_grad=False)
+        layer.weight_scale = scale.to(module.weight.device)
+        if module.bias is not None:
+            layer.bias = torch.nn.Parameter(module.bias.data, requires_grad=False)
+        _replace(model, name, layer)
+    return len(names)
@@ -0,0 +1,238 @@
+"""
+Single-file snapshots of the fully assembled InstantID pipeline.
+
+A snapshot directory contains:
+- manifest.json: component classes and configs, scheduler config, IP-Adapter settings
+- weights.safetensors: every tensor of the assembled pipeline in one contiguous file
+  (UNet including its IP attention processors, Resampler, ControlNet, VAE, text encoders)
+- tokenizer/, tokenizer_2/: tokenizer files (a few MB)
+
+Restoring builds every module on the meta device, installs the InstantID attention
+processors, and then fills all weights in one sequential pass over the weights file.
+There is no per-component path resolution and no torch.load of ip-adapter.bin.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+import diffusers
+import torch
+import transformers
+from accelerate import init_empty_weights
+from diffusers import ModelMixin
+from safetensors.torch import save_file
+from transformers import CLIPTokenizer
+
+from src.loading import HostMemoryBudget, assign_tensor, stream_safetensors
+from src.logger import get_logger
+from src.pipelines import (
+    StableDiffusionXLInstantIDPipeline,
+    build_image_proj_model,
+    build_ip_attn_processors,
+)
+from src.pipelines.pipeline_stable_diffusion_xl_instantid import IPAttnProcessor
+
+logger = get_logger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+WEIGHTS_NAME = "weights.safetensors"
+
+# Order matters: tensors are grouped by component in the weights file
+MODEL_COMPONENTS = ("unet", "controlnet", "vae", "text_encoder", "text_encoder_2")
+TOKENIZERS = ("tokenizer", "tokenizer_2")
+
+
+def snapshot_available(snapshot_dir: str) -> bool:
+    """Check whether a snapshot manifest exists in snapshot_dir."""
+    return os.path.exists(os.path.join(snapshot_dir, MANIFEST_NAME))
+
+
+def read_manifest(snapshot_dir: str) -> Dict:
+    """
+    Read and validate a snapshot manifest.
+
+    Raises:
+        ValueError: If the format version is unsupported or the weights file
+            does not match the size recorded at build time
+    """
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported snapshot format {manifest.get('format_version')} "
+            f"(expected {SNAPSHOT_FORMAT_VERSION})"
+        )
+
+    weights_path = os.path.join(snapshot_dir, manifest["weights"])
+    if not os.path.exists(weights_path) or os.path.getsize(weights_path) != manifest["weights_bytes"]:
+        raise ValueError(f"Snapshot weights missing or incomplete: {weights_path}")
+
+    return manifest
+
+
+def _component_entry(module) -> Dict:
+    if isinstance(module, ModelMixin):
+        return {
+            "library": "diffusers",
+            "class_name": type(module).__name__,
+            "config": json.loads(module.to_json_string()),
+        }
+    return {
+        "library": "transformers",
+        "class_name": type(module).__name__,
+        "config": module.config.to_dict(),
+    }
+
+
+def _instantiate(entry: Dict) -> torch.nn.Module:
+    """Build a component from its manifest entry (call under init_empty_weights)."""
+    if entry["library"] == "diffusers":
+        return getattr(diffusers, entry["class_name"]).from_config(entry["config"])
+    model_cls = getattr(transformers, entry["class_name"])
+    return model_cls(model_cls.config_class.from_dict(entry["config"]))
+
+
+def save_snapshot(pipe: StableDiffusionXLInstantIDPipeline, output_dir: str) -> Dict:
+    """
+    Write a snapshot of an assembled InstantID pipeline (IP-Adapter already loaded).
+
+    Args:
+        pipe: Pipeline after load_ip_adapter_instantid(), before any attention
+            processor swaps (slicing/xFormers would drop the IP layers)
+        output_dir: Directory to write manifest, weights and tokenizers into
+
+    Returns:
+        The manifest that was written
+    """
+    ip_processors = [p for p in pipe.unet.attn_processors.values() if isinstance(p, IPAttnProcessor)]
+    if not ip_processors or not hasattr(pipe, "image_proj_model"):
+        raise ValueError("Pipeline has no InstantID IP-Adapter loaded; nothing to snapshot")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    tensors = {}
+    components = {}
+    for name in MODEL_COMPONENTS:
+        module = getattr(pipe, name)
+        components[name] = _component_entry(module)
+        for key, tensor in module.state_dict().items():
+            tensors[f"{name}.{key}"] = tensor.detach().to("cpu").contiguous()
+
+    image_emb_dim = pipe.image_proj_model_in_features
+    components["image_proj_model"] = {
+        "library": "instantid",
+        "class_name": "Resampler",
+        "config": {
+            "cross_attention_dim": pipe.unet.config.cross_attention_dim,
+            "image_emb_dim": image_emb_dim,
+            "num_tokens": ip_processors[0].num_tokens,
+        },
+    }
+    for key, tensor in pipe.image_proj_model.state_dict().items():
+        tensors[f"image_proj_model.{key}"] = tensor.detach().to("cpu").contiguous()
+
+    weights_path = os.path.join(output_dir, WEIGHTS_NAME)
+    save_file(tensors, weights_path, metadata={"format_version": str(SNAPSHOT_FORMAT_VERSION)})
+
+    for name in TOKENIZERS:
+        getattr(pipe, name).save_pretrained(os.path.join(output_dir, name))
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "engine": "instantid",
+        "pipeline_class": type(pipe).__name__,
+        "dtype": str(pipe.unet.dtype).replace("torch.", ""),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "weights": WEIGHTS_NAME,
+        "weights_bytes": os.path.getsize(weights_path),
+        "num_tensors": len(tensors),
+        "components": components,
+        "tokenizers": list(TOKENIZERS),
+        "scheduler": {
+            "class_name": type(pipe.scheduler).__name__,
+            "config": json.loads(pipe.scheduler.to_json_string()),
+        },
+        "ip_adapter": {
+            "num_tokens": ip_processors[0].num_tokens,
+            # The pipeline default; processors may hold the last call's per-sample scales
+            "scale": float(getattr(pipe, "_ip_adapter_scale", None) or ip_processors[0].scale),
+            "image_emb_dim": image_emb_dim,
+        },
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(
+        "snapshot_saved",
+        path=output_dir,
+        num_tensors=len(tensors),
+        size_mb=manifest["weights_bytes"] / 1024 / 1024
+    )
+    return manifest
+
+
+def load_snapshot(
+    snapshot_dir: str,
+    device: str,
+    dtype: torch.dtype = torch.float16,
+    budget: Optional[HostMemoryBudget] = None,
+) -> StableDiffusionXLInstantIDPipeline:
+    """
+    Restore an assembled InstantID pipeline from a snapshot with one sequential read.
+
+    Raises:
+        ValueError: If the manifest is invalid (see read_manifest)
+        RuntimeError: If the weights do not match the manifest's module layout
+    """
+    manifest = read_manifest(snapshot_dir)
+    ip_config = manifest["ip_adapter"]
+    proj_config = manifest["components"]["image_proj_model"]["config"]
+
+    with init_empty_weights():
+        modules = {name: _instantiate(manifest["components"][name]) for name in MODEL_COMPONENTS}
+        unet = modules["unet"]
+        unet.set_attn_processor(build_ip_attn_processors(unet, ip_config["num_tokens"], ip_config["scale"]))
+        modules["image_proj_model"] = build_image_proj_model(
+            proj_config["cross_attention_dim"], proj_config["image_emb_dim"], proj_config["num_tokens"]
+        )
+
+    unexpected = []
+    weights_path = os.path.join(snapshot_dir, manifest["weights"])
+    for key, tensor in stream_safetensors(weights_path, device, dtype, budget):
+        component, _, name = key.partition(".")
+        if component not in modules or not assign_tensor(modules[component], name, tensor):
+            unexpected.append(key)
+
+    missing = [
+        f"{component}.{name}"
+        for component, module in modules.items()
+        for name, param in module.named_parameters()
+        if param.is_meta
+    ]
+    if missing or unexpected:
+        raise RuntimeError(
+            f"Snapshot {weights_path} does not match manifest: "
+            f"{len(missing)} missing, {len(unexpected)} unexpected "
+            f"(e.g. {(missing or unexpected)[:3]})"
+        )
+
+    for module in modules.values():
+        module.to(device)
+        module.eval()
+
+    tokenizers = {
+        name: CLIPTokenizer.from_pretrained(os.path.join(snapshot_dir, name))
+        for name in manifest["tokenizers"]
+    }
+    scheduler_cls = getattr(diffusers, manifest["scheduler"]["class_name"])
+    scheduler = scheduler_cls.from_config(manifest["scheduler"]["config"])
+
+    image_proj_model = modules.pop("image_proj_model")
+    pipe = StableDiffusionXLInstantIDPipeline(scheduler=scheduler, **modules, **tokenizers)
+    pipe.image_proj_model = image_proj_model
+    pipe.image_proj_model_in_features = proj_config["image_emb_dim"]
+    return pipe
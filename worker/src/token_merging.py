@@ -0,0 +1,196 @@
+"""
+Token merging (ToMe) for the UNet self-attention of Jhakaas Worker.
+
+At 1024x1024 the highest-resolution SDXL attention layers attend over 4096
+spatial tokens, and self-attention cost grows with the square of that.
+Neighbouring tokens are often nearly identical (skin, background, sky), so
+before each self-attention the most redundant tokens are merged into a
+similar neighbour (bipartite soft matching: one destination token per 2x2
+window, every other token is a source matched to its most similar
+destination), attention runs over the reduced set, and the output is
+unmerged by copying each merged token's result back to its sources.
+
+The face region from the InsightFace bounding box can be protected: its
+source tokens are never merged, so identity detail keeps full resolution.
+
+Works for both engines without touching their attention processors: the
+UNet's self-attention (`attn1`) forwards are wrapped only inside `active()`.
+Compiled dispatch must be off while merging is active (token counts change).
+"""
+
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from src.config import settings
+
+# Destination tokens: the top-left token of every STRIDE x STRIDE window
+STRIDE = 2
+
+# Protected face box growth on each side, as a fraction of the box size (hair, jaw, ears)
+FACE_MARGIN = 0.25
+
+
+def bipartite_soft_matching(x: torch.Tensor, plan: Dict):
+    """Merge/unmerge functions that remove `plan["r"]` source tokens of x (batch, tokens, channels)."""
+    a_idx, b_idx, r = plan["a_idx"], plan["b_idx"], plan["r"]
+    tokens = x.shape[1]
+
+    metric = x / x.norm(dim=-1, keepdim=True)
+    scores = metric[:, a_idx] @ metric[:, b_idx].transpose(-1, -2)
+    if plan["protect"] is not None:
+        scores = scores.masked_fill(plan["protect"][..., None], -torch.inf)
+
+    # The r sources most similar to some destination are merged into it
+    node_max, node_idx = scores.max(dim=-1)
+    edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+    unm_idx, src_idx = edge_idx[:, r:], edge_idx[:, :r]
+    dst_idx = node_idx[..., None].gather(dim=1, index=src_idx)
+    # Positions of the kept and merged sources in the full token sequence
+    unm_pos, src_pos = a_idx[unm_idx], a_idx[src_idx]
+
+    def merge(x):
+        src, dst = x[:, a_idx], x[:, b_idx]
+        n, t, c = src.shape
+        unm = src.gather(1, unm_idx.expand(n, t - r, c))
+        src = src.gather(1, src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(1, dst_idx.expand(n, r, c), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x):
+        n, _, c = x.shape
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[:, :unm_len], x[:, unm_len:]
+        out = x.new_empty(n, tokens, c)  # Every position is written below
+        out[:, b_idx] = dst
+        out.scatter_(1, unm_pos.expand(n, unm_len, c), unm)
+        out.scatter_(1, src_pos.expand(n, r, c), dst.gather(1, dst_idx.expand(n, r, c)))
+        return out
+
+    return merge, unmerge
+
+
+class TokenMerging:
+    """Merges redundant spatial tokens before the UNet's high-resolution self-attention."""
+
+    def __init__(self, unet: torch.nn.Module, vae_scale_factor: int = 8, max_downsample: Optional[int] = None):
+        self.unet = unet
+        self.vae_scale_factor = vae_scale_factor
+        self.max_downsample = max_downsample or settings.token_merge_max_downsample
+        self.ratio = 0.0  # Fraction of tokens removed per layer; set per request from the quality tier
+        self.stats: Dict[str, int] = {"merged_calls": 0}
+        self.self_attention: List[Tuple[str, torch.nn.Module]] = [
+            (name, module) for name, module in unet.named_modules() if name.endswith(".attn1")
+        ]
+        self._reset()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ratio > 0
+
+    def _reset(self):
+        self.latent_size: Optional[Tuple[int, int]] = None
+        self.face_boxes: Optional[Sequence] = None
+        self.plans: Dict[Tuple[int, int], Optional[Dict]] = {}
+
+    @contextmanager
+    def active(self, face_boxes: Optional[Sequence] = None):
+        """
+        Merge tokens in the UNet calls made inside the block.
+
+        face_boxes: per image, a list of (x1, y1, x2, y2) output-pixel face boxes (or None);
+        their tokens are kept unmerged. Under CFG both branches of an image share its boxes.
+        """
+        if not self.enabled:
+            yield self
+            return
+
+        self._reset()
+        self.face_boxes = face_boxes if settings.token_merge_protect_face else None
+        previous = {}
+        for name, module in self.self_attention:
+            previous[name] = module.__dict__.get("forward")
+            module.forward = self._merged_forward(module.forward)
+        # Token grids per layer follow the latent size of the current call
+        hook = self.unet.register_forward_pre_hook(self._capture_latent_size, with_kwargs=True)
+        try:
+            yield self
+        finally:
+            hook.remove()
+            for name, module in self.self_attention:
+                if previous[name] is None:
+                    module.__dict__.pop("forward", None)
+                else:
+                    module.forward = previous[name]
+            self._reset()
+
+    def _capture_latent_size(self, module, args, kwargs):
+        sample = args[0] if args else kwargs["sample"]
+        latent_size = tuple(sample.shape[-2:])
+        if latent_size != self.latent_size:
+            self.latent_size = latent_size
+            self.plans = {}
+
+    def _merged_forward(self, forward):
+        def merged_forward(hidden_states, encoder_hidden_states=None, attention_mask=None, **kwargs):
+            plan = None
+            if encoder_hidden_states is None and hidden_states.ndim == 3 and self.latent_size is not None:
+                plan = self._plan(hidden_states)
+            if plan is None:
+                return forward(hidden_states, encoder_hidden_states, attention_mask, **kwargs)
+            merge, unmerge = bipartite_soft_matching(hidden_states, plan)
+            self.stats["merged_calls"] += 1
+            return unmerge(forward(merge(hidden_states), None, attention_mask, **kwargs))
+        return merged_forward
+
+    def _plan(self, hidden_states: torch.Tensor) -> Optional[Dict]:
+        batch, tokens, _ = hidden_states.shape
+        if (batch, tokens) not in self.plans:
+            self.plans[(batch, tokens)] = self._build_plan(batch, tokens, hidden_states.device)
+        return self.plans[(batch, tokens)]
+
+    def _build_plan(self, batch: int, tokens: int, device) -> Optional[Dict]:
+        """Source/destination split (and protected sources) for one layer resolution, or None to skip it."""
+        latent_h, latent_w = self.latent_size
+        for downsample in (1, 2, 4, 8):
+            height, width = -(-latent_h // downsample), -(-latent_w // downsample)
+            if height * width == tokens:
+                break
+        else:
+            return None
+        if downsample > self.max_downsample:
+            return None
+
+        dst = torch.zeros(height, width, dtype=torch.bool)
+        dst[::STRIDE, ::STRIDE] = True
+        a_idx = (~dst).flatten().nonzero().squeeze(1)
+        b_idx = dst.flatten().nonzero().squeeze(1)
+        r = min(int(tokens * self.ratio), a_idx.numel())
+
+        protect = None
+        if self.face_boxes:
+            protect = self._face_mask(height, width, batch)[:, a_idx]
+            r = min(r, a_idx.numel() - int(protect.sum(dim=1).max()))
+            protect = protect.to(device)
+        if r <= 0:
+            return None
+        return {"r": r, "a_idx": a_idx.to(device), "b_idx": b_idx.to(device), "protect": protect}
+
+    def _face_mask(self, height: int, width: int, batch: int) -> torch.Tensor:
+        """(batch, height * width) mask of tokens whose centre lies in one of the row's (expanded) face boxes."""
+        latent_h, latent_w = self.latent_size
+        ys = (torch.arange(height) + 0.5) * (latent_h * self.vae_scale_factor / height)
+        xs = (torch.arange(width) + 0.5) * (latent_w * self.vae_scale_factor / width)
+        masks = []
+        for boxes in self.face_boxes:
+            mask = torch.zeros(height, width, dtype=torch.bool)
+            for box in boxes or ():
+                x1, y1, x2, y2 = (float(v) for v in box[:4])
+                margin_x, margin_y = (x2 - x1) * FACE_MARGIN, (y2 - y1) * FACE_MARGIN
+                rows = (ys >= y1 - margin_y) & (ys <= y2 + margin_y)
+                cols = (xs >= x1 - margin_x) & (xs <= x2 + margin_x)
+                mask |= rows[:, None] & cols[None, :]
+            masks.append(mask.flatten())
+        # Rows are [uncond..., cond...] under CFG, each half in image order
+        return torch.stack([masks[row % len(masks)] for row in range(batch)])
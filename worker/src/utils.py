@@ -2,20 +2,20 @@
 Utility functions for image handling.
 
 This module provides functions for:
-- Downloading images from URLs with validation
+- Downloading images from URLs into memory with validation (no temp files)
 - Uploading images to Google Cloud Storage
-- File cleanup and management
+- File size helpers
 """
 
 import os
 import io
 import uuid
-import mimetypes
-from typing import Optional
+from contextlib import closing
+from typing import Iterator
 
+import numpy as np
 import requests
-from PIL import Image
-from google.cloud import storage
+from PIL import Image, ImageOps
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from src.config import settings
@@ -23,8 +23,8 @@ from src.logger import get_logger
 
 logger = get_logger(__name__)
 
-# Initialize GCS Client
-storage_client = storage.Client()
+# GCS client is created on first use so importing this module stays cheap at boot
+_storage_client = None
 
 # Allowed MIME types for images
 ALLOWED_MIME_TYPES = {
@@ -34,6 +34,147 @@ ALLOWED_MIME_TYPES = {
     'image/webp'
 }
 
+# Formats accepted after decoding the header (Pillow format names)
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+# Streaming read size, and GCS ranged-read size (a multiple of 256KB)
+CHUNK_SIZE = 64 * 1024
+GCS_CHUNK_SIZE = 1024 * 1024
+
+# Bytes after which an image header must be parseable (EXIF/ICC blocks can precede JPEG dimensions)
+HEADER_PEEK_BYTES = 256 * 1024
+
+
+def get_storage_client():
+    """Get cached GCS client, importing google-cloud-storage on first use"""
+    global _storage_client
+    if _storage_client is None:
+        from google.cloud import storage
+        _storage_client = storage.Client()
+    return _storage_client
+
+
+def _check_header(image: Image.Image):
+    """Reject unsupported formats and oversized dimensions from a parsed image header."""
+    width, height = image.size
+    if width > settings.max_image_dimension or height > settings.max_image_dimension:
+        raise ValueError(
+            f"Image dimensions too large: {width}x{height} "
+            f"(max: {settings.max_image_dimension}x{settings.max_image_dimension})"
+        )
+    if (image.format or '').upper() not in ALLOWED_FORMATS:
+        raise ValueError(f"Unsupported image format: {image.format}")
+
+
+def _peek_header(buffer: bytearray) -> bool:
+    """Check the header once enough of the image has arrived; False while it is still incomplete."""
+    try:
+        # Image.open only parses the header; pixel data is not decoded here
+        with Image.open(io.BytesIO(buffer)) as image:
+            _check_header(image)
+        return True
+    except (IOError, OSError) as e:
+        if len(buffer) >= HEADER_PEEK_BYTES:
+            raise ValueError(f"Invalid or corrupted image file: {e}")
+        return False
+
+
+def _read_bounded(chunks: Iterator[bytes], max_bytes: int) -> bytes:
+    """Collect streamed chunks in memory, failing as soon as the size limit or the header check fails."""
+    buffer = bytearray()
+    header_checked = False
+    for chunk in chunks:
+        if not chunk:  # filter out keep-alive chunks
+            continue
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise ValueError(f"Image exceeds {settings.max_image_size_mb}MB limit during download")
+        if not header_checked:
+            header_checked = _peek_header(buffer)
+    return bytes(buffer)
+
+
+def _gcs_chunks(url: str, max_bytes: int) -> Iterator[bytes]:
+    """Stream a gs:// or storage.googleapis.com object with the authenticated client."""
+    logger.debug("gcs_download", url=url)
+
+    # Parse bucket and blob from URL
+    if url.startswith('gs://'):
+        # gs://bucket/path/to/file
+        parts = url[5:].split('/', 1)
+    else:
+        # https://storage.googleapis.com/bucket/path/to/file
+        parts = url.split('storage.googleapis.com/', 1)[1].split('/', 1)
+
+    bucket_name = parts[0]
+    blob_name = parts[1] if len(parts) > 1 else ''
+
+    bucket = get_storage_client().bucket(bucket_name)
+    blob = bucket.blob(blob_name)
+
+    # Check blob size
+    blob.reload()  # Get metadata
+    if blob.size > max_bytes:
+        raise ValueError(
+            f"Image too large: {blob.size / 1024 / 1024:.2f}MB "
+            f"(max: {settings.max_image_size_mb}MB)"
+        )
+
+    # Ranged reads: the header is checked after the first GCS_CHUNK_SIZE bytes
+    with blob.open('rb', chunk_size=GCS_CHUNK_SIZE) as reader:
+        yield from iter(lambda: reader.read(CHUNK_SIZE), b'')
+
+
+def _http_chunks(url: str, max_bytes: int) -> Iterator[bytes]:
+    """Stream an external HTTP/HTTPS URL."""
+    with requests.get(
+        url,
+        stream=True,
+        timeout=settings.download_timeout_seconds,
+        headers={'User-Agent': 'Jhakaas-Worker/1.0'}
+    ) as response:
+        response.raise_for_status()
+
+        # Check content length before downloading
+        content_length = response.headers.get('content-length')
+        if content_length:
+            content_length_int = int(content_length)
+            if content_length_int > max_bytes:
+                raise ValueError(
+                    f"Image too large: {content_length_int / 1024 / 1024:.2f}MB "
+                    f"(max: {settings.max_image_size_mb}MB)"
+                )
+            logger.debug("content_length_ok", size_mb=content_length_int / 1024 / 1024)
+
+        # Check content type
+        content_type = response.headers.get('content-type', '').lower()
+        if content_type and not any(mime in content_type for mime in ALLOWED_MIME_TYPES):
+            raise ValueError(f"Invalid content type: {content_type}")
+
+        yield from response.iter_content(chunk_size=CHUNK_SIZE)
+
+
+def _decode_rgb(data: bytes) -> np.ndarray:
+    """Decode image bytes once into an EXIF-upright (height, width, 3) uint8 RGB array."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            _check_header(image)
+            image_format = image.format
+            # Orientation handling matches diffusers' load_image; convert() decodes every pixel,
+            # so truncated or corrupted data fails here
+            rgb = ImageOps.exif_transpose(image).convert('RGB')
+    except (IOError, OSError) as e:
+        raise ValueError(f"Invalid or corrupted image file: {e}")
+
+    logger.info(
+        "image_validated",
+        width=rgb.width,
+        height=rgb.height,
+        format=image_format,
+        size_mb=len(data) / 1024 / 1024
+    )
+    return np.asarray(rgb)
+
 
 @retry(
     stop=stop_after_attempt(3),
@@ -41,167 +182,56 @@ ALLOWED_MIME_TYPES = {
     retry=retry_if_exception_type((requests.RequestException, requests.Timeout)),
     reraise=True
 )
-def download_image(url: str) -> str:
+def download_image(url: str) -> np.ndarray:
     """
-    Downloads image from URL to a temporary file with validation.
+    Downloads an image from URL into memory, validates it and decodes it once.
 
     Supports both GCS URLs (gs:// or https://storage.googleapis.com/) with authentication
-    and external HTTP/HTTPS URLs.
+    and external HTTP/HTTPS URLs. The body is streamed into a buffer bounded by
+    MAX_IMAGE_SIZE_MB, and the header (format, dimensions) is checked as soon as it
+    has arrived, so oversized images are rejected before the rest is downloaded.
+    Nothing is written to disk.
 
     Args:
         url: URL of the image to download
 
     Returns:
-        Path to the downloaded temporary file
+        RGB pixels as a (height, width, 3) uint8 array
 
     Raises:
         ValueError: If image is invalid, too large, or wrong format
         RuntimeError: If download fails after retries
     """
     logger.debug("download_started", url=url)
-    filename = None
+    max_bytes = settings.max_image_size_mb * 1024 * 1024
 
     try:
         # Check if this is a GCS URL
         is_gcs_url = url.startswith('gs://') or 'storage.googleapis.com' in url
+        chunks = _gcs_chunks(url, max_bytes) if is_gcs_url else _http_chunks(url, max_bytes)
 
-        if is_gcs_url:
-            # Download from GCS using authenticated client
-            logger.debug("gcs_download", url=url)
-
-            # Parse bucket and blob from URL
-            if url.startswith('gs://'):
-                # gs://bucket/path/to/file
-                parts = url[5:].split('/', 1)
-            else:
-                # https://storage.googleapis.com/bucket/path/to/file
-                parts = url.split('storage.googleapis.com/', 1)[1].split('/', 1)
-
-            bucket_name = parts[0]
-            blob_name = parts[1] if len(parts) > 1 else ''
+        # closing() ends the stream (and its connection) when a check fails mid-download
+        with closing(chunks):
+            data = _read_bounded(chunks, max_bytes)
+        logger.debug("download_complete", size_bytes=len(data), source="gcs" if is_gcs_url else "http")
 
-            bucket = storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
+        return _decode_rgb(data)
 
-            # Check blob size
-            blob.reload()  # Get metadata
-            max_bytes = settings.max_image_size_mb * 1024 * 1024
-            if blob.size > max_bytes:
-                raise ValueError(
-                    f"Image too large: {blob.size / 1024 / 1024:.2f}MB "
-                    f"(max: {settings.max_image_size_mb}MB)"
-                )
-
-            # Create temp file
-            filename = f"/tmp/{uuid.uuid4()}.jpg"
-
-            # Download from GCS
-            blob.download_to_filename(filename)
-            downloaded = blob.size
-            logger.debug("gcs_download_complete", size_bytes=downloaded, path=filename)
-
-        else:
-            # Download from external URL using HTTP
-            response = requests.get(
-                url,
-                stream=True,
-                timeout=settings.download_timeout_seconds,
-                headers={'User-Agent': 'Jhakaas-Worker/1.0'}
-            )
-            response.raise_for_status()
-
-            # Check content length before downloading
-            content_length = response.headers.get('content-length')
-            max_bytes = settings.max_image_size_mb * 1024 * 1024
-
-            if content_length:
-                content_length_int = int(content_length)
-                if content_length_int > max_bytes:
-                    raise ValueError(
-                        f"Image too large: {content_length_int / 1024 / 1024:.2f}MB "
-                        f"(max: {settings.max_image_size_mb}MB)"
-                    )
-                logger.debug("content_length_ok", size_mb=content_length_int / 1024 / 1024)
-
-            # Check content type
-            content_type = response.headers.get('content-type', '').lower()
-            if content_type and not any(mime in content_type for mime in ALLOWED_MIME_TYPES):
-                raise ValueError(f"Invalid content type: {content_type}")
-
-            # Create temp file
-            filename = f"/tmp/{uuid.uuid4()}.jpg"
-
-            # Download with size limit
-            downloaded = 0
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:  # filter out keep-alive chunks
-                        downloaded += len(chunk)
-                        if downloaded > max_bytes:
-                            raise ValueError(
-                                f"Image exceeds {settings.max_image_size_mb}MB limit during download"
-                            )
-                        f.write(chunk)
-
-            logger.debug("download_complete", size_bytes=downloaded, path=filename)
-        
-        # Validate it's actually a valid image
-        try:
-            with Image.open(filename) as img:
-                # Verify image
-                img.verify()
-                
-                # Re-open to get dimensions (verify() closes the file)
-                with Image.open(filename) as img2:
-                    width, height = img2.size
-                    
-                    # Check dimensions
-                    if width > settings.max_image_dimension or height > settings.max_image_dimension:
-                        raise ValueError(
-                            f"Image dimensions too large: {width}x{height} "
-                            f"(max: {settings.max_image_dimension}x{settings.max_image_dimension})"
-                        )
-                    
-                    # Check format
-                    if img2.format.upper() not in ['JPEG', 'JPG', 'PNG', 'WEBP']:
-                        raise ValueError(f"Unsupported image format: {img2.format}")
-                    
-                    logger.info(
-                        "image_validated",
-                        width=width,
-                        height=height,
-                        format=img2.format,
-                        size_mb=downloaded / 1024 / 1024
-                    )
-                    
-        except (IOError, OSError) as e:
-            raise ValueError(f"Invalid or corrupted image file: {e}")
-        
-        return filename
-        
     except requests.Timeout as e:
         logger.error("download_timeout", url=url, timeout=settings.download_timeout_seconds)
-        if filename and os.path.exists(filename):
-            os.remove(filename)
         raise RuntimeError(f"Download timeout after {settings.download_timeout_seconds}s: {e}")
-        
+
     except requests.RequestException as e:
         logger.error("download_failed", url=url, error=str(e))
-        if filename and os.path.exists(filename):
-            os.remove(filename)
         raise RuntimeError(f"Failed to download image: {e}")
-        
+
     except ValueError as e:
-        # Validation errors - cleanup and re-raise
+        # Validation errors
         logger.warning("image_validation_failed", url=url, error=str(e))
-        if filename and os.path.exists(filename):
-            os.remove(filename)
         raise
-        
+
     except Exception as e:
         logger.exception("unexpected_download_error", url=url, error=str(e))
-        if filename and os.path.exists(filename):
-            os.remove(filename)
         raise RuntimeError(f"Unexpected error downloading image: {e}")
 
 
@@ -246,7 +276,7 @@ def upload_image(image: Image.Image, quality: int = 95) -> str:
         
         # Upload to GCS
         filename = f"generated/{uuid.uuid4()}.jpg"
-        bucket = storage_client.bucket(settings.images_bucket)
+        bucket = get_storage_client().bucket(settings.images_bucket)
         blob = bucket.blob(filename)
         
         # Set metadata
@@ -277,24 +307,6 @@ def upload_image(image: Image.Image, quality: int = 95) -> str:
         raise RuntimeError(f"Failed to upload image: {e}")
 
 
-def cleanup_file(filepath: Optional[str]):
-    """
-    Removes temporary file safely.
-    
-    Args:
-        filepath: Path to file to remove (can be None)
-    """
-    if not filepath:
-        return
-    
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            logger.debug("file_cleaned_up", path=filepath)
-    except Exception as e:
-        logger.warning("cleanup_failed", path=filepath, error=str(e))
-
-
 def get_file_size_mb(filepath: str) -> float:
     """
     Get file size in megabytes.
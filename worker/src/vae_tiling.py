@@ -0,0 +1,84 @@
+"""
+Automatic tiled VAE encode/decode for Jhakaas Worker.
+
+The VAE decode at the end of every generation runs full-resolution
+convolutions (and a mid-block attention over every latent pixel), which
+makes it the largest single activation peak of a request. Tiled mode
+decodes overlapping latent tiles and linearly blends the overlap so no
+seams are visible (diffusers' AutoencoderKL tiled_decode/tiled_encode),
+bounding the peak by the tile size instead of the output size.
+
+Tiling is chosen per call:
+- above VAE_TILING_MIN_PIXELS (larger outputs than the SDXL buckets), or
+- under memory pressure, when GPU headroom is below the estimated
+  untiled decode peak
+Otherwise the VAE runs untiled, exactly as before.
+"""
+
+from typing import Dict
+
+from src.config import settings
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+MB = 1024 * 1024
+
+# Fraction of each tile that overlaps its neighbour and is blended
+TILE_OVERLAP = 0.25
+
+
+class AutoTiledVae:
+    """Installs per-call tiling decisions on a pipeline's VAE encode/decode."""
+
+    def __init__(self, vae, vram=None):
+        self.vae = vae
+        self.vram = vram
+        self.scale_factor = 2 ** (len(vae.config.block_out_channels) - 1)
+        self.stats: Dict[str, int] = {"tiled": 0, "untiled": 0}
+
+        # Tile geometry read by AutoencoderKL.tiled_decode/tiled_encode
+        vae.tile_sample_min_size = settings.vae_tile_size
+        vae.tile_latent_min_size = settings.vae_tile_size // self.scale_factor
+        vae.tile_overlap_factor = TILE_OVERLAP
+
+        self._decode = vae.decode
+        self._encode = vae.encode
+        vae.decode = self.decode
+        vae.encode = self.encode
+
+    def should_tile(self, width: int, height: int) -> bool:
+        """Tile when the output is above the pixel threshold or the GPU lacks headroom for it."""
+        if settings.vae_tiling == "never":
+            return False
+        if settings.vae_tiling == "always":
+            return True
+        if width * height > settings.vae_tiling_min_pixels:
+            return True
+        if self.vram is not None and self.vram.enabled:
+            peak = width * height / 1e6 * settings.vae_decode_mb_per_megapixel * MB
+            if self.vram.headroom_bytes() < peak:
+                logger.info("vae_tiling_memory_pressure", bucket=f"{width}x{height}",
+                            headroom_mb=round(self.vram.headroom_bytes() / MB), estimate_mb=round(peak / MB))
+                return True
+        return False
+
+    def _run(self, fn, width: int, height: int, *args, **kwargs):
+        tiled = self.should_tile(width, height)
+        self.vae.use_tiling = tiled
+        self.stats["tiled" if tiled else "untiled"] += 1
+        return fn(*args, **kwargs)
+
+    def decode(self, z, *args, **kwargs):
+        height, width = z.shape[-2] * self.scale_factor, z.shape[-1] * self.scale_factor
+        return self._run(self._decode, width, height, z, *args, **kwargs)
+
+    def encode(self, x, *args, **kwargs):
+        return self._run(self._encode, x.shape[-1], x.shape[-2], x, *args, **kwargs)
+
+    def remove(self):
+        """Restore the VAE's own encode/decode (untiled) and drop the references to it."""
+        for name in ("decode", "encode"):
+            self.vae.__dict__.pop(name, None)
+        self.vae.use_tiling = False
+        self.vae = self._decode = self._encode = None
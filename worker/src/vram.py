@@ -0,0 +1,286 @@
+"""
+VRAM budget manager for Jhakaas Worker.
+
+Keeps a ledger of what occupies GPU memory and decides, per request, whether
+the request fits:
+- Component footprints are measured from the live modules (UNet, VAE, text
+  encoders, ControlNet, each LoRA adapter, IP-Adapter layers), not declared
+- Request footprints (activation peak per engine x resolution x batch) are
+  measured during warm-up and scaled by pixel count for unwarmed shapes
+- Free memory comes from cudaMemGetInfo plus the caching allocator's idle
+  blocks, so memory torch has cached but not used is not counted as lost
+
+When a request does not fit, the manager first returns cached blocks to the
+driver, then drops the cross-request text K/V cache, then offloads the text
+encoders to the CPU (they only run once per request, before denoising), and
+only then rejects the request.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import torch
+
+from src.config import settings
+from src.logger import get_logger
+
+logger = get_logger(__name__)
+
+MB = 1024 * 1024
+
+# Pipeline attributes that hold GPU modules, in ledger order
+PIPELINE_MODULES = ("unet", "controlnet", "vae", "text_encoder", "text_encoder_2", "image_encoder", "image_proj_model")
+
+# Offloaded first under memory pressure: used once per request, cheap to page in
+OFFLOADABLE_MODULES = ("text_encoder_2", "text_encoder")
+
+
+class VramAdmissionError(RuntimeError):
+    """Raised when a request cannot fit in GPU memory even after offloading."""
+
+
+def _tensor_bytes(tensor: torch.Tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+def _ledger_key(module_name: str, param_name: str) -> str:
+    """Attribute a parameter to its ledger entry: a LoRA adapter, the IP-Adapter, or the module."""
+    parts = param_name.split(".")
+    for marker in ("lora_A", "lora_B", "lora_embedding_A", "lora_embedding_B"):
+        if marker in parts:
+            index = parts.index(marker)
+            if index + 1 < len(parts):
+                return f"lora:{parts[index + 1]}"
+    # IP-Adapter attention processors (to_k_ip/to_v_ip) and the image projection
+    if ".processor." in param_name or param_name.startswith("encoder_hid_proj"):
+        return "ip_adapter"
+    return module_name
+
+
+class VramManager:
+    """Ledger of GPU memory use and per-request admission control."""
+
+    def __init__(self, device: str):
+        self.device = device
+        self.enabled = device == "cuda"
+        self.components: Dict[str, int] = {}
+        self.activations: Dict[Tuple[str, int, int, int], int] = {}
+        self.offloaded: Dict[str, torch.nn.Module] = {}
+        self.engine: Optional[str] = None
+        self.rejections = 0
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Ledger
+    # ------------------------------------------------------------------
+
+    def register_pipeline(self, engine: str, pipe):
+        """(Re)measure every GPU-resident component of the active pipeline."""
+        components: Dict[str, int] = {}
+        for module_name in PIPELINE_MODULES:
+            module = getattr(pipe, module_name, None)
+            if not isinstance(module, torch.nn.Module):
+                continue
+            for name, tensor in list(module.named_parameters()) + list(module.named_buffers()):
+                key = "ip_adapter" if module_name in ("image_encoder", "image_proj_model") else _ledger_key(module_name, name)
+                if tensor.device.type == "cuda" or module_name in self.offloaded:
+                    components[key] = components.get(key, 0) + _tensor_bytes(tensor)
+
+        with self._lock:
+            self.engine = engine
+            self.components = components
+        logger.info(
+            "vram_components_registered",
+            engine=engine,
+            resident_mb=round(self.resident_bytes() / MB),
+            components={key: round(size / MB) for key, size in components.items()}
+        )
+
+    def release_engine(self):
+        """Forget the ledger of an engine that is being unloaded and return its memory."""
+        with self._lock:
+            self.components = {}
+            self.offloaded = {}
+            self.engine = None
+        if self.enabled:
+            torch.cuda.empty_cache()
+
+    def record_activation(self, engine: str, width: int, height: int, batch_size: int, peak_bytes: int):
+        """Store the measured activation peak of a request shape (from warm-up)."""
+        self.activations[(engine, width, height, batch_size)] = peak_bytes
+
+    def resident_bytes(self) -> int:
+        return sum(
+            size for key, size in self.components.items()
+            if key not in self.offloaded
+        )
+
+    def estimate_activation(self, engine: str, width: int, height: int, batch_size: int) -> Optional[int]:
+        """Measured activation peak for a shape, or the nearest measured shape scaled by pixels x batch."""
+        exact = self.activations.get((engine, width, height, batch_size))
+        if exact is not None:
+            return exact
+
+        measured = [(key, peak) for key, peak in self.activations.items() if key[0] == engine]
+        if not measured:
+            return None
+        target = width * height * batch_size
+        (_, w, h, b), peak = min(measured, key=lambda item: abs(item[0][1] * item[0][2] * item[0][3] - target))
+        # Unmeasured shape: scale linearly and keep a safety margin
+        return int(peak * target / (w * h * b) * settings.vram_activation_safety)
+
+    # ------------------------------------------------------------------
+    # Memory state
+    # ------------------------------------------------------------------
+
+    def available_bytes(self) -> int:
+        """Memory a new allocation can use: driver-free plus the allocator's idle cached blocks."""
+        if not self.enabled:
+            return 0
+        free, _ = torch.cuda.mem_get_info()
+        idle_cached = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+        return free + idle_cached
+
+    def headroom_bytes(self) -> int:
+        return self.available_bytes() - settings.vram_reserve_mb * MB
+
+    # ------------------------------------------------------------------
+    # Admission
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def measure(self, engine: str, width: int, height: int, batch_size: int = 1):
+        """Record the activation peak (above resident weights) of the generation run inside the block."""
+        if not self.enabled:
+            yield
+            return
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+        yield
+        torch.cuda.synchronize()
+        self.record_activation(engine, width, height, batch_size, torch.cuda.max_memory_allocated() - baseline)
+
+    @contextmanager
+    def admit(self, engine: str, width: int, height: int, batch_size: int = 1, pipe=None):
+        """
+        Admit a request shape, offloading text encoders if needed.
+
+        Raises:
+            VramAdmissionError: If the request cannot fit even after offloading
+        """
+        if not self.enabled:
+            yield
+            return
+
+        need = self.estimate_activation(engine, width, height, batch_size)
+        if need is None:
+            # Nothing measured for this engine yet (warm-up disabled): admit and learn
+            with self.measure(engine, width, height, batch_size):
+                yield
+            return
+
+        if self.headroom_bytes() < need:
+            torch.cuda.empty_cache()
+        text_kv_cache = getattr(pipe, "text_kv_cache", None)
+        if self.headroom_bytes() < need and text_kv_cache is not None and text_kv_cache.entries:
+            # Cross-request attention caches are the cheapest thing to rebuild
+            text_kv_cache.clear("memory_pressure")
+            torch.cuda.empty_cache()
+        if self.headroom_bytes() < need and pipe is not None and settings.vram_offload_text_encoders:
+            self._offload_text_encoders(pipe)
+        if self.headroom_bytes() < need:
+            self.rejections += 1
+            logger.warning(
+                "vram_admission_rejected",
+                engine=engine,
+                bucket=f"{width}x{height}",
+                batch_size=batch_size,
+                need_mb=round(need / MB),
+                headroom_mb=round(self.headroom_bytes() / MB)
+            )
+            raise VramAdmissionError(
+                f"Insufficient GPU memory for {width}x{height} x{batch_size} "
+                f"(need {need / MB:.0f}MB, headroom {self.headroom_bytes() / MB:.0f}MB)"
+            )
+
+        if (engine, width, height, batch_size) in self.activations:
+            yield
+        else:
+            # Replace the scaled estimate with a measurement
+            with self.measure(engine, width, height, batch_size):
+                yield
+
+        # Bring offloaded encoders back once there is room for them and the next request
+        if self.offloaded and pipe is not None:
+            offloaded_bytes = sum(self.components.get(name, 0) for name in self.offloaded)
+            if self.headroom_bytes() - offloaded_bytes >= need:
+                self._restore_text_encoders(pipe)
+
+    def _offload_text_encoders(self, pipe):
+        """Keep text encoders on the CPU, paging each onto the GPU only for its forward pass."""
+        for name in OFFLOADABLE_MODULES:
+            module = getattr(pipe, name, None)
+            if module is None or name in self.offloaded:
+                continue
+            module.to("cpu")
+            module._vram_hooks = (
+                module.register_forward_pre_hook(self._page_in),
+                module.register_forward_hook(self._page_out),
+            )
+            self.offloaded[name] = module
+            logger.info("vram_offloaded", module=name, size_mb=round(self.components.get(name, 0) / MB))
+        torch.cuda.empty_cache()
+
+    # Forward hooks must return None, otherwise torch replaces the inputs/outputs
+    def _page_in(self, module, args):
+        module.to(self.device)
+
+    def _page_out(self, module, args, output):
+        module.to("cpu")
+
+    def _restore_text_encoders(self, pipe):
+        for name, module in list(self.offloaded.items()):
+            for hook in getattr(module, "_vram_hooks", ()):
+                hook.remove()
+            module._vram_hooks = ()
+            module.to(self.device)
+            del self.offloaded[name]
+            logger.info("vram_restored", module=name)
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def ledger(self) -> Dict:
+        """Snapshot for the debug endpoint."""
+        report = {
+            "engine": self.engine,
+            "components_mb": {
+                key: {"size": round(size / MB), "resident": key not in self.offloaded}
+                for key, size in sorted(self.components.items(), key=lambda item: -item[1])
+            },
+            "resident_mb": round(self.resident_bytes() / MB),
+            "activations_mb": {
+                f"{engine}:{w}x{h}x{b}": round(peak / MB)
+                for (engine, w, h, b), peak in sorted(self.activations.items())
+            },
+            "offloaded": list(self.offloaded),
+            "rejections": self.rejections,
+            "reserve_mb": settings.vram_reserve_mb,
+        }
+        if self.enabled:
+            free, total = torch.cuda.mem_get_info()
+            reserved = torch.cuda.memory_reserved()
+            allocated = torch.cuda.memory_allocated()
+            report.update({
+                "total_mb": round(total / MB),
+                "driver_free_mb": round(free / MB),
+                "torch_allocated_mb": round(allocated / MB),
+                "torch_reserved_mb": round(reserved / MB),
+                # CUDA context, cuDNN workspaces, onnxruntime (InsightFace), ...
+                "non_torch_mb": round((total - free - reserved) / MB),
+                "available_mb": round(self.available_bytes() / MB),
+            })
+        return report
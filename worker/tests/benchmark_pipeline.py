@@ -0,0 +1,1105 @@
+#!/usr/bin/env python3
+"""
+Local latency benchmarks for the generation pipeline.
+
+Unlike the other scripts in this directory, this runs inside the worker
+image (not against the deployed service) and imports `src` directly.
+
+    # Eager vs compiled per-step latency on a small SDXL-shaped UNet (CPU OK)
+    python tests/benchmark_pipeline.py compile --tiny --device cpu
+
+    # Same comparison with the real engine (GPU + models mount)
+    python tests/benchmark_pipeline.py compile --engine instantid
+
+    # Latency and identity similarity per quality tier
+    python tests/benchmark_pipeline.py tiers --image face.jpg --style anime
+
+    # Per-step and end-to-end latency per resolution bucket
+    python tests/benchmark_pipeline.py buckets --engine instantid
+
+    # Weight-only int8 vs fp16: size, latency, output error (toy UNet, CPU OK)
+    python tests/benchmark_pipeline.py quant --tiny --device cpu
+
+    # Same with the real engine: VRAM, load time, latency, identity similarity
+    python tests/benchmark_pipeline.py quant --image face.jpg --engine instantid
+
+    # Tiled vs untiled VAE decode/encode: peak memory, latency, output difference
+    python tests/benchmark_pipeline.py vae --resolutions 1024x1024 1536x1536 2048x2048
+    python tests/benchmark_pipeline.py vae --tiny --device cpu
+
+    # InstantID attention backends: per-step latency and peak memory at 1024x1024
+    python tests/benchmark_pipeline.py attention --resolution 1024x1024
+    python tests/benchmark_pipeline.py attention --tiny --device cpu
+
+    # Text/identity K/V every step vs once per request vs shared across requests: latency
+    python tests/benchmark_pipeline.py attention-kv --resolution 1024x1024
+    python tests/benchmark_pipeline.py attention-kv --tiny --device cpu
+
+    # ControlNet residual reuse every N steps: latency and identity similarity
+    python tests/benchmark_pipeline.py controlnet --image face.jpg --intervals 1 2 3
+
+    # Deep UNet feature caching vs full UNet per style: speed-up, PSNR, identity
+    python tests/benchmark_pipeline.py unet-cache --image face.jpg --interval 3
+
+    # Truncated CFG (guidance off after 70% of steps) vs full CFG per style: latency cut, PSNR, identity
+    python tests/benchmark_pipeline.py cfg --image face.jpg --cutoff 0.7
+
+    # img2img at strength 0.4 vs a full denoise from noise for photo-preserving styles
+    python tests/benchmark_pipeline.py img2img --image face.jpg --strength 0.4
+
+    # Self-attention token merging (30% of tokens, face box protected) vs full attention per style
+    python tests/benchmark_pipeline.py tome --image face.jpg --ratio 0.3
+
+    # End-to-end throughput through process_image (GPU, or CPU mode without one)
+    python tests/benchmark_pipeline.py throughput --image face.jpg
+
+    # Group photo: latency and per-face identity for 1..4 faces in one denoising pass
+    python tests/benchmark_pipeline.py faces --image group.jpg --faces 1 2 3 4
+
+    # Large photo: whole photo at its bucket vs face-region crop with paste-back (latency, identity, face size)
+    python tests/benchmark_pipeline.py crop --image wide_shot.jpg --style natural
+
+    # Several faces in one denoising loop vs one process_image call each
+    python tests/benchmark_pipeline.py batch --images a.jpg b.jpg c.jpg d.jpg
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Make `src` importable when run as a script from worker/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def summarize(name, timings_ms):
+    """Print and return mean/p50/p95 of per-step timings."""
+    timings_ms = sorted(timings_ms)
+    result = {
+        "mean_ms": statistics.mean(timings_ms),
+        "p50_ms": timings_ms[len(timings_ms) // 2],
+        "p95_ms": timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.95))],
+    }
+    print(f"  {name:<28} mean {result['mean_ms']:8.2f}ms  p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms")
+    return result
+
+
+def synchronize(device):
+    import torch
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+# ----------------------------------------------------------------------
+# Tiny SDXL-shaped UNet (runs anywhere)
+# ----------------------------------------------------------------------
+
+def tiny_unet(device, dtype):
+    """UNet with the SDXL conditioning interface (text_time embeddings) at toy size."""
+    from diffusers import UNet2DConditionModel
+
+    unet = UNet2DConditionModel(
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=64,
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        projection_class_embeddings_input_dim=80,
+    )
+    return unet.to(device=device, dtype=dtype).eval()
+
+
+def tiny_unet_inputs(device, dtype, width, height, batch_size):
+    import torch
+
+    # Classifier-free guidance doubles the UNet batch
+    unet_batch = 2 * batch_size
+    return {
+        "sample": torch.randn(unet_batch, 4, height // 8, width // 8, device=device, dtype=dtype),
+        "timestep": torch.tensor(500, device=device),
+        "encoder_hidden_states": torch.randn(unet_batch, 77, 64, device=device, dtype=dtype),
+        "added_cond_kwargs": {
+            "text_embeds": torch.randn(unet_batch, 32, device=device, dtype=dtype),
+            "time_ids": torch.randn(unet_batch, 6, device=device, dtype=dtype),
+        },
+        "return_dict": False,
+    }
+
+
+def time_unet_steps(unet, inputs, steps, device):
+    import torch
+
+    timings = []
+    with torch.inference_mode():
+        for _ in range(steps):
+            synchronize(device)
+            start = time.perf_counter()
+            unet(**inputs)
+            synchronize(device)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def benchmark_compile_tiny(args):
+    import torch
+    from src.compiled import BucketedCompiledForward, compile_buckets
+
+    dtype = torch.float16 if args.device == "cuda" else torch.float32
+    mode = "reduce-overhead" if args.device == "cuda" else "default"
+    unet = tiny_unet(args.device, dtype)
+    buckets = compile_buckets()
+
+    print(f"\n⏱️  Tiny UNet, device={args.device}, mode={mode}, steps={args.steps}")
+    eager = {}
+    for width, height, batch_size in buckets:
+        inputs = tiny_unet_inputs(args.device, dtype, width, height, batch_size)
+        time_unet_steps(unet, inputs, 2, args.device)
+        eager[(width, height, batch_size)] = summarize(
+            f"eager {width}x{height} x{batch_size}", time_unet_steps(unet, inputs, args.steps, args.device)
+        )
+
+    compiled = BucketedCompiledForward(unet, "unet", mode)
+    for width, height, batch_size in buckets:
+        inputs = tiny_unet_inputs(args.device, dtype, width, height, batch_size)
+        start = time.perf_counter()
+        time_unet_steps(unet, inputs, 3, args.device)
+        print(f"  compile+warm-up {width}x{height} x{batch_size}: {time.perf_counter() - start:.1f}s")
+    compiled.seal()
+
+    for width, height, batch_size in buckets:
+        inputs = tiny_unet_inputs(args.device, dtype, width, height, batch_size)
+        result = summarize(
+            f"compiled {width}x{height} x{batch_size}", time_unet_steps(unet, inputs, args.steps, args.device)
+        )
+        speedup = eager[(width, height, batch_size)]["mean_ms"] / result["mean_ms"]
+        print(f"  → speedup {speedup:.2f}x")
+
+    if compiled.misses:
+        print(f"⚠️  {compiled.misses} calls fell back to eager after sealing")
+
+
+# ----------------------------------------------------------------------
+# Real engine
+# ----------------------------------------------------------------------
+
+def time_pipeline_steps(manager, engine, width, height, batch_size, steps):
+    """Per-step latency of a synthetic generation, measured between step-end callbacks.
+
+    The first step is excluded since its interval would include prompt encoding.
+    """
+    import torch
+
+    kwargs = manager._synthetic_generation_kwargs(engine, width, height, batch_size)
+    kwargs["num_inference_steps"] = steps
+    marks = []
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        synchronize(manager.device)
+        marks.append(time.perf_counter())
+        return callback_kwargs
+
+    with torch.inference_mode():
+        manager.pipe(**kwargs, callback_on_step_end=on_step_end)
+    return [(b - a) * 1000 for a, b in zip(marks, marks[1:])]
+
+
+def benchmark_compile_engine(args):
+    # Load eager; compilation is applied below so both runs share one pipeline
+    os.environ["ENABLE_COMPILE"] = "false"
+    os.environ["ENABLE_WARMUP"] = "false"
+    from src.compiled import compile_buckets
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    if args.engine == "ip_adapter":
+        manager.load_ip_adapter_engine()
+    else:
+        manager.load_models()
+
+    buckets = compile_buckets()
+    print(f"\n⏱️  {args.engine} engine, device={manager.device}, steps={args.steps}")
+    eager = {}
+    for width, height, batch_size in buckets:
+        time_pipeline_steps(manager, args.engine, width, height, batch_size, 2)
+        eager[(width, height, batch_size)] = summarize(
+            f"eager {width}x{height} x{batch_size}",
+            time_pipeline_steps(manager, args.engine, width, height, batch_size, args.steps)
+        )
+
+    start = time.perf_counter()
+    settings.enable_compile = True
+    manager.warm_up(args.engine)
+    print(f"  compile+warm-up total: {time.perf_counter() - start:.1f}s")
+
+    for width, height, batch_size in buckets:
+        result = summarize(
+            f"compiled {width}x{height} x{batch_size}",
+            time_pipeline_steps(manager, args.engine, width, height, batch_size, args.steps)
+        )
+        speedup = eager[(width, height, batch_size)]["mean_ms"] / result["mean_ms"]
+        print(f"  → speedup {speedup:.2f}x")
+    print(f"  compiled stats: {manager.compiled.stats()}")
+
+
+def face_embedding(app, image):
+    """Normalized InsightFace embedding of the largest face in a PIL image, or None."""
+    import cv2
+    import numpy as np
+
+    faces = app.get(cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2BGR))
+    if not faces:
+        return None
+    face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+    return face.embedding / np.linalg.norm(face.embedding)
+
+
+def benchmark_tiers(args):
+    """End-to-end latency and input/output identity cosine similarity per quality tier."""
+    import numpy as np
+    from PIL import Image
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    if args.engine == "ip_adapter":
+        manager.load_ip_adapter_engine()
+        manager.app = manager._load_face_analysis()
+    else:
+        manager.load_models()
+
+    reference = face_embedding(manager.app, Image.open(args.image))
+    if reference is None:
+        raise SystemExit(f"No face detected in {args.image}")
+
+    print(f"\n⏱️  {args.engine} engine, style={args.style}, runs={args.runs}")
+    for tier in ("fast", "standard", "best"):
+        # First run warms the tier (scheduler swap, adapter activation)
+        manager.process_image(args.image, args.prompt, args.style, args.engine, tier)
+
+        timings, similarities = [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = manager.process_image(args.image, args.prompt, args.style, args.engine, tier)
+            timings.append((time.perf_counter() - start) * 1000)
+            embedding = face_embedding(manager.app, output)
+            similarities.append(float(np.dot(reference, embedding)) if embedding is not None else 0.0)
+
+        summarize(f"{tier} latency", timings)
+        print(f"  {tier + ' identity':<28} mean cosine {statistics.mean(similarities):.3f}  "
+              f"min {min(similarities):.3f}")
+
+
+def benchmark_buckets(args):
+    """Per-step and end-to-end latency of a synthetic generation at every resolution bucket."""
+    import torch
+    from src.buckets import RESOLUTION_BUCKETS
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    if args.engine == "ip_adapter":
+        manager.load_ip_adapter_engine()
+    else:
+        manager.load_models()
+
+    print(f"\n⏱️  {args.engine} engine, steps={args.steps}")
+    for output_size, buckets in RESOLUTION_BUCKETS.items():
+        for width, height in buckets:
+            # Warm the shape once so allocator/cudnn setup is not timed
+            time_pipeline_steps(manager, args.engine, width, height, 1, 2)
+
+            kwargs = manager._synthetic_generation_kwargs(args.engine, width, height, 1)
+            kwargs["num_inference_steps"] = args.steps
+            synchronize(manager.device)
+            start = time.perf_counter()
+            with torch.inference_mode():
+                manager.pipe(**kwargs)
+            synchronize(manager.device)
+            total_ms = (time.perf_counter() - start) * 1000
+
+            summarize(
+                f"{output_size} {width}x{height} step",
+                time_pipeline_steps(manager, args.engine, width, height, 1, args.steps)
+            )
+            print(f"  {output_size + ' ' + str(width) + 'x' + str(height) + ' total':<28} {total_ms:8.0f}ms")
+
+
+def module_bytes(module):
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def benchmark_quant_tiny(args):
+    """fp vs int8 toy UNet: weight bytes, per-step latency and output error."""
+    import torch
+    import torch.nn.functional as F
+    from src.quantization import quantize_model
+
+    dtype = torch.float16 if args.device == "cuda" else torch.float32
+    torch.manual_seed(0)
+    unet = tiny_unet(args.device, dtype)
+    inputs = tiny_unet_inputs(args.device, dtype, 512, 512, 1)
+
+    with torch.inference_mode():
+        reference = unet(**inputs)[0].float()
+    size_fp = module_bytes(unet)
+    print(f"\n⏱️  tiny UNet, device={args.device}, dtype={dtype}")
+    fp_result = summarize("fp weights", time_unet_steps(unet, inputs, args.steps, args.device))
+
+    layers = quantize_model(unet)
+    with torch.inference_mode():
+        output = unet(**inputs)[0].float()
+    int8_result = summarize("int8 weights", time_unet_steps(unet, inputs, args.steps, args.device))
+
+    cosine = F.cosine_similarity(reference.flatten(), output.flatten(), dim=0).item()
+    relative_error = ((output - reference).norm() / reference.norm()).item()
+    print(f"  {layers} layers quantized, weights {size_fp / 1024**2:.1f}MB → {module_bytes(unet) / 1024**2:.1f}MB")
+    print(f"  output cosine {cosine:.5f}, relative L2 error {relative_error:.4f}, "
+          f"latency ratio {int8_result['mean_ms'] / fp_result['mean_ms']:.2f}x")
+
+
+def benchmark_quant_engine(args):
+    """fp16 vs int8 engine: load time, resident VRAM, latency and identity similarity."""
+    import gc
+    import numpy as np
+    import torch
+    from PIL import Image
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    settings.enable_compile = False
+    for int8 in (False, True):
+        settings.enable_int8_weights = int8
+        label = "int8" if int8 else "fp16"
+        manager = ModelManager(settings.model_bucket)
+
+        torch.cuda.reset_peak_memory_stats()
+        start = time.perf_counter()
+        if args.engine == "ip_adapter":
+            manager.load_ip_adapter_engine()
+            manager.app = manager._load_face_analysis()
+        else:
+            manager.load_models()
+        load_s = time.perf_counter() - start
+        ledger = manager.vram.ledger()
+        print(f"\n⏱️  {args.engine} {label}: load {load_s:.1f}s (incl. warm-up), "
+              f"resident {ledger['resident_mb']}MB (unet {ledger['components_mb'].get('unet', {}).get('size')}MB, "
+              f"controlnet {ledger['components_mb'].get('controlnet', {}).get('size')}MB), "
+              f"peak allocated {torch.cuda.max_memory_allocated() / 1024**2:.0f}MB")
+
+        reference = face_embedding(manager.app, Image.open(args.image))
+        if reference is None:
+            raise SystemExit(f"No face detected in {args.image}")
+        manager.process_image(args.image, args.prompt, args.style, args.engine)
+
+        timings, similarities = [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = manager.process_image(args.image, args.prompt, args.style, args.engine)
+            timings.append((time.perf_counter() - start) * 1000)
+            embedding = face_embedding(manager.app, output)
+            similarities.append(float(np.dot(reference, embedding)) if embedding is not None else 0.0)
+        summarize(f"{label} latency", timings)
+        print(f"  {label + ' identity':<28} mean cosine {statistics.mean(similarities):.3f}  "
+              f"min {min(similarities):.3f}")
+
+        # Free the engine before loading the other precision
+        del manager
+        gc.collect()
+        torch.cuda.empty_cache()
+
+
+def benchmark_throughput(args):
+    """Seconds per image and images/hour through process_image per quality tier and output size."""
+    import torch
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    start = time.perf_counter()
+    if args.engine == "ip_adapter":
+        manager.load_ip_adapter_engine()
+    else:
+        manager.load_models()
+    print(f"\n⏱️  {args.engine} engine on {manager.device} ({manager.dtype}, {torch.get_num_threads()} threads), "
+          f"loaded in {time.perf_counter() - start:.1f}s")
+
+    for quality in args.quality:
+        for output_size in args.output_size:
+            # First run absorbs the scheduler swap and any allocator/oneDNN setup
+            manager.process_image(args.image, args.prompt, args.style, args.engine, quality, output_size)
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                manager.process_image(args.image, args.prompt, args.style, args.engine, quality, output_size)
+                timings.append((time.perf_counter() - start) * 1000)
+            result = summarize(f"{quality} {output_size}", timings)
+            print(f"  {'':<28} {result['mean_ms'] / 1000:.1f}s/image, {3600_000 / result['mean_ms']:.0f} images/hour")
+
+
+def benchmark_attention(args):
+    """Per-step latency, peak memory and output drift of each InstantID attention backend."""
+    import torch
+    from src.compiled import parse_resolution
+    from src.pipelines import build_ip_attn_processors
+    from src.pipelines.pipeline_stable_diffusion_xl_instantid import resolve_attention_backend
+
+    width, height = parse_resolution(args.resolution)
+    if args.tiny:
+        device = args.device
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        torch.manual_seed(0)
+        unet = tiny_unet(device, dtype)
+        unet.set_attn_processor(build_ip_attn_processors(unet, num_tokens=4, scale=0.8))
+        inputs = tiny_unet_inputs(device, dtype, width, height, 1)
+        # 77 text tokens + 4 identity tokens
+        inputs["encoder_hidden_states"] = torch.randn(2, 81, 64, device=device, dtype=dtype)
+
+        def set_backend(backend):
+            for processor in unet.attn_processors.values():
+                processor.backend = backend
+
+        def run_steps():
+            time_unet_steps(unet, inputs, 2, device)
+            timings = time_unet_steps(unet, inputs, args.steps, device)
+            with torch.inference_mode():
+                return timings, unet(**inputs)[0].float()
+    else:
+        from src.config import settings
+        from src.model_manager import ModelManager
+        settings.enable_compile = False
+        manager = ModelManager(settings.model_bucket)
+        manager.load_models()
+        device = manager.device
+        set_backend = manager.pipe.set_attention_backend
+
+        def run_steps():
+            time_pipeline_steps(manager, "instantid", width, height, 1, 2)
+            timings = time_pipeline_steps(manager, "instantid", width, height, 1, args.steps)
+            kwargs = manager._synthetic_generation_kwargs("instantid", width, height, 1)
+            kwargs.update(num_inference_steps=args.steps, output_type="latent",
+                          generator=torch.Generator(device).manual_seed(0))
+            with torch.inference_mode():
+                return timings, manager.pipe(**kwargs).images.float()
+
+    print(f"\n⏱️  InstantID attention on {device}, {width}x{height}, steps={args.steps}")
+    reference = None
+    for backend in args.backends:
+        try:
+            resolve_attention_backend(backend)
+        except ValueError as e:
+            print(f"  {backend:<28} skipped: {e}")
+            continue
+        set_backend(backend)
+        if device == "cuda":
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
+        try:
+            timings, output = run_steps()
+        except torch.cuda.OutOfMemoryError:
+            print(f"  {backend:<28} out of memory")
+            continue
+        summarize(f"{backend} step", timings)
+        if device == "cuda":
+            print(f"  {'':<28} peak {torch.cuda.max_memory_allocated() / 1024**2:.0f}MB")
+        if reference is None:
+            reference = output
+        else:
+            print(f"  {'':<28} max |Δ| vs {args.backends[0]}: {(output - reference).abs().max().item():.4f}")
+
+
+def benchmark_attention_kv(args):
+    """Latency with text/identity K/V recomputed every step, cached per request, and shared across requests."""
+    import torch
+    from src.compiled import parse_resolution
+    from src.kv_cache import TextKVCache
+    from src.pipelines import build_ip_attn_processors
+    from src.pipelines.pipeline_stable_diffusion_xl_instantid import IPAttnProcessor
+
+    modes = ("recomputed every step", "cached per request", "shared across requests")
+    width, height = parse_resolution(args.resolution)
+    if args.tiny:
+        device = args.device
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        torch.manual_seed(0)
+        unet = tiny_unet(device, dtype)
+        unet.set_attn_processor(build_ip_attn_processors(unet, num_tokens=16, scale=0.8))
+        inputs = tiny_unet_inputs(device, dtype, width, height, 1)
+        # 77 text tokens + 16 identity tokens
+        inputs["encoder_hidden_states"] = torch.randn(2, 93, 64, device=device, dtype=dtype)
+        processors = {name: p for name, p in unet.attn_processors.items() if isinstance(p, IPAttnProcessor)}
+        shared = {}
+        time_unet_steps(unet, inputs, 2, device)
+
+        def run(mode):
+            # One "request" of args.steps UNet calls; a shared hit starts with the text K/V filled in
+            for name, processor in processors.items():
+                processor.kv_cache = None if mode == modes[0] else dict(shared.get(name, {}))
+            timings = time_unet_steps(unet, inputs, args.steps, device)
+            if mode == modes[1]:
+                shared.update({
+                    name: {k: v for k, v in p.kv_cache.items() if k[0] == "text"}
+                    for name, p in processors.items()
+                })
+            for processor in processors.values():
+                processor.kv_cache = None
+            return timings
+    else:
+        from src.config import settings
+        from src.model_manager import ModelManager
+        settings.enable_compile = False
+        manager = ModelManager(settings.model_bucket)
+        manager.load_models()
+        device = manager.device
+        manager.pipe.text_kv_cache = TextKVCache(1024)
+        kwargs = manager._synthetic_generation_kwargs("instantid", width, height, 1)
+        kwargs["num_inference_steps"] = args.steps
+
+        def call(**extra):
+            synchronize(device)
+            start = time.perf_counter()
+            with torch.inference_mode():
+                manager.pipe(**kwargs, **extra)
+            synchronize(device)
+            return (time.perf_counter() - start) * 1000
+
+        def run(mode):
+            # Whole calls: the cross-request saving lands before the first step
+            manager.pipe.cache_attention_kv = mode != modes[0]
+            extra = {"adapter_state": "none"} if mode == modes[2] else {}
+            manager.pipe.text_kv_cache.clear("benchmark")
+            call(**extra)  # Warm-up; fills the shared cache
+            return [call(**extra) for _ in range(args.repeats)]
+
+    unit = "UNet call" if args.tiny else "request"
+    print(f"\n⏱️  Attention K/V on {device}, {width}x{height}, steps={args.steps} (ms per {unit})")
+    results = {mode: summarize(mode, run(mode)) for mode in modes}
+    baseline = results[modes[0]]["mean_ms"]
+    for mode in modes[1:]:
+        saved = baseline - results[mode]["mean_ms"]
+        print(f"  → {mode}: {saved:.2f}ms saved ({100 * saved / baseline:.1f}%)")
+
+
+def benchmark_controlnet(args):
+    """Latency and identity similarity per ControlNet cache interval (1 = run every step)."""
+    import numpy as np
+    from PIL import Image
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    manager.load_models()
+    reference = face_embedding(manager.app, Image.open(args.image))
+    if reference is None:
+        raise SystemExit(f"No face detected in {args.image}")
+
+    print(f"\n⏱️  InstantID, {args.quality} tier, runs={args.runs}")
+    baseline_ms = None
+    for interval in args.intervals:
+        settings.controlnet_cache_interval = interval
+        manager.process_image(args.image, args.prompt, args.style, "instantid", args.quality)
+
+        timings, similarities = [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = manager.process_image(args.image, args.prompt, args.style, "instantid", args.quality)
+            timings.append((time.perf_counter() - start) * 1000)
+            embedding = face_embedding(manager.app, output)
+            similarities.append(float(np.dot(reference, embedding)) if embedding is not None else 0.0)
+
+        result = summarize(f"interval {interval}", timings)
+        baseline_ms = baseline_ms or result["mean_ms"]
+        print(f"  {'':<28} {manager.pipe._controlnet_calls} ControlNet calls, "
+              f"speedup {baseline_ms / result['mean_ms']:.2f}x, "
+              f"identity cosine {statistics.mean(similarities):.3f} (min {min(similarities):.3f})")
+
+
+def compare_styles(args, label, set_mode):
+    """
+    Per style, generate from the same seed with set_mode(False) (baseline) and set_mode(True):
+    latency, PSNR of the variant vs the baseline, and identity cosine of both.
+    """
+    import numpy as np
+    import torch
+    from PIL import Image
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    if args.engine == "ip_adapter":
+        manager.load_ip_adapter_engine()
+        manager.app = manager._load_face_analysis()
+    else:
+        manager.load_models()
+    reference = face_embedding(manager.app, Image.open(args.image))
+    if reference is None:
+        raise SystemExit(f"No face detected in {args.image}")
+
+    def generate(style, variant):
+        set_mode(variant)
+        torch.manual_seed(args.seed)  # Same initial latents for both modes
+        start = time.perf_counter()
+        output = manager.process_image(args.image, args.prompt, style, args.engine, args.quality)
+        return output, (time.perf_counter() - start) * 1000
+
+    styles = args.styles or settings.allowed_styles
+    print(f"\n⏱️  {args.engine}, {args.quality} tier, {label}")
+    speedups, psnrs = [], []
+    for style in styles:
+        generate(style, False)  # Absorb the LoRA load for this style
+        baseline, baseline_ms = generate(style, False)
+        variant, variant_ms = generate(style, True)
+
+        mse = np.mean((np.asarray(baseline, dtype=np.float32) - np.asarray(variant, dtype=np.float32)) ** 2)
+        psnr = 10 * np.log10(255.0 ** 2 / mse) if mse > 0 else float("inf")
+        similarity = {}
+        for name, output in (("baseline", baseline), ("variant", variant)):
+            embedding = face_embedding(manager.app, output)
+            similarity[name] = float(np.dot(reference, embedding)) if embedding is not None else 0.0
+
+        speedups.append(baseline_ms / variant_ms)
+        psnrs.append(psnr)
+        print(f"  {style:<20} {baseline_ms:7.0f}ms → {variant_ms:7.0f}ms "
+              f"(-{100 * (1 - variant_ms / baseline_ms):.0f}%, {baseline_ms / variant_ms:.2f}x)  "
+              f"PSNR {psnr:5.1f}dB  identity {similarity['baseline']:.3f} → {similarity['variant']:.3f}")
+
+    print(f"  {'mean':<20} speedup {statistics.mean(speedups):.2f}x, PSNR {statistics.mean(psnrs):.1f}dB")
+    return manager
+
+
+def benchmark_unet_cache(args):
+    """Full UNet vs cached deep features per style."""
+    from src.config import settings
+
+    def set_mode(cached):
+        settings.unet_cache_interval = args.interval if cached else 1
+
+    manager = compare_styles(args, f"UNet cache interval {args.interval}, depth {settings.unet_cache_depth}", set_mode)
+    print(f"  cache steps: {manager.unet_cache.stats}")
+
+
+def benchmark_cfg(args):
+    """Full classifier-free guidance vs guidance truncated after a fraction of the steps, per style."""
+    from src.config import settings
+
+    def set_mode(truncated):
+        settings.cfg_cutoff = args.cutoff if truncated else 1.0
+        settings.cfg_cutoff_by_style = {}
+
+    compare_styles(args, f"CFG cutoff {args.cutoff}", set_mode)
+
+
+def benchmark_img2img(args):
+    """Full denoise from noise vs img2img from the input photo at a strength, per style."""
+    from src.config import settings
+
+    def set_mode(img2img):
+        settings.img2img_strength_by_style = {style: args.strength for style in args.styles} if img2img else {}
+
+    compare_styles(args, f"img2img strength {args.strength}", set_mode)
+
+
+def benchmark_tome(args):
+    """Full self-attention vs token merging at a ratio, per style."""
+    from src.config import settings
+
+    settings.token_merge_protect_face = not args.no_protect_face
+
+    def set_mode(merged):
+        settings.token_merge_ratio_by_tier = {args.quality: args.ratio} if merged else {}
+
+    label = f"token merge ratio {args.ratio}, face {'unprotected' if args.no_protect_face else 'protected'}"
+    manager = compare_styles(args, label, set_mode)
+    print(f"  merged self-attention calls: {manager.token_merging.stats['merged_calls']}")
+
+
+def benchmark_batch(args):
+    """Sequential process_image calls vs one process_batch call over the same faces."""
+    import numpy as np
+    from PIL import Image
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    manager.load_models()
+    settings.max_batch_size = max(settings.max_batch_size, len(args.images))
+    jobs = [
+        # Vary the identity strength per job to exercise per-sample scales
+        {"face_image_path": path, "prompt": args.prompt, "ip_adapter_scale": 0.8 - 0.05 * (i % 3)}
+        for i, path in enumerate(args.images)
+    ]
+
+    # Warm both paths (scheduler swap, batch-shaped kernels)
+    manager.process_image(args.images[0], args.prompt, args.style, "instantid", args.quality)
+    manager.process_batch(jobs, args.style, "instantid", args.quality)
+
+    print(f"\n⏱️  {len(jobs)} faces, {args.quality} tier, runs={args.runs}")
+    sequential, batched = [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        for path in args.images:
+            manager.process_image(path, args.prompt, args.style, "instantid", args.quality)
+        sequential.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        outputs = manager.process_batch(jobs, args.style, "instantid", args.quality)
+        batched.append((time.perf_counter() - start) * 1000)
+
+    for label, timings in (("sequential", sequential), ("batched", batched)):
+        result = summarize(label, timings)
+        print(f"  {'':<28} {3600_000 * len(jobs) / result['mean_ms']:.0f} images/hour")
+
+    # Each output must keep its own identity, not a blend of the batch
+    for path, output in zip(args.images, outputs):
+        if isinstance(output, Exception):
+            print(f"  {os.path.basename(path):<28} failed: {output}")
+            continue
+        reference = face_embedding(manager.app, Image.open(path))
+        embedding = face_embedding(manager.app, output)
+        similarity = float(np.dot(reference, embedding)) if reference is not None and embedding is not None else 0.0
+        print(f"  {os.path.basename(path):<28} identity cosine {similarity:.3f}")
+
+
+def benchmark_faces(args):
+    """Latency and per-face identity of multi-face generation against the number of faces kept."""
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from src.buckets import fit_to_bucket
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    manager.load_models()
+
+    def embeddings(image):
+        faces = manager.app.get(cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2BGR))
+        faces = sorted(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]), reverse=True)
+        return [f.embedding / np.linalg.norm(f.embedding) for f in faces]
+
+    # References from the same bucketed crop the manager conditions on
+    references = embeddings(fit_to_bucket(Image.open(args.image), "full"))
+    if not references:
+        raise SystemExit(f"No face detected in {args.image}")
+    counts = [n for n in args.faces if n <= len(references)]
+
+    manager.process_image(args.image, args.prompt, args.style, "instantid", args.quality)  # Warm-up
+    print(f"\n⏱️  {len(references)} faces in image, {args.quality} tier, runs={args.runs}")
+    baseline = None
+    for count in counts:
+        settings.max_faces = count
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = manager.process_image(args.image, args.prompt, args.style, "instantid", args.quality,
+                                           all_faces=True)
+            timings.append((time.perf_counter() - start) * 1000)
+        result = summarize(f"{count} face(s)", timings)
+        baseline = baseline or result["mean_ms"]
+        generated = embeddings(output)
+        # Each kept identity: best match among the generated faces
+        similarity = [max((float(np.dot(ref, gen)) for gen in generated), default=0.0) for ref in references[:count]]
+        print(f"  {'':<28} {result['mean_ms'] / baseline:.2f}x one face, "
+              f"identity {' '.join(f'{s:.3f}' for s in similarity)}")
+
+
+def benchmark_crop(args):
+    """Whole-photo generation vs face-region crop with paste-back on the same (large) photo."""
+    import numpy as np
+    from PIL import Image
+    from src.config import settings
+    from src.model_manager import ModelManager
+
+    manager = ModelManager(settings.model_bucket)
+    manager.load_models()
+    original = Image.open(args.image)
+    reference = face_embedding(manager.app, original)
+    if reference is None:
+        raise SystemExit(f"No face detected in {args.image}")
+
+    print(f"\n⏱️  {original.width}x{original.height}, {args.style}, {args.quality} tier, runs={args.runs}")
+    for label, face_crop in (("whole photo", False), ("face crop", True)):
+        manager.process_image(args.image, args.prompt, args.style, "instantid", args.quality,
+                              face_crop=face_crop)  # Warm-up
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = manager.process_image(args.image, args.prompt, args.style, "instantid", args.quality,
+                                           face_crop=face_crop)
+            timings.append((time.perf_counter() - start) * 1000)
+        summarize(label, timings)
+        embedding = face_embedding(manager.app, output)
+        similarity = float(np.dot(reference, embedding)) if embedding is not None else 0.0
+        print(f"  {'':<28} output {output.width}x{output.height}, identity {similarity:.3f}")
+
+
+def benchmark_vae(args):
+    """Untiled vs tiled VAE decode and encode: peak memory, latency and output difference."""
+    import math
+    import numpy as np
+    import torch
+    from diffusers import AutoencoderKL
+    from PIL import Image
+    from src.compiled import parse_resolution
+    from src.config import settings
+    from src.vae_tiling import TILE_OVERLAP, AutoTiledVae
+
+    if args.tiny:
+        device = args.device
+        dtype = torch.float16 if device == "cuda" else torch.float32
+        torch.manual_seed(0)
+        vae = AutoencoderKL(
+            block_out_channels=(32, 32, 64, 64),
+            down_block_types=("DownEncoderBlock2D",) * 4,
+            up_block_types=("UpDecoderBlock2D",) * 4,
+            latent_channels=4,
+            norm_num_groups=16,
+        ).to(device=device, dtype=dtype).eval()
+    else:
+        from src.model_manager import VAE_FP16_REPO, ModelManager
+        manager = ModelManager(settings.model_bucket)
+        device, dtype = manager.device, manager.dtype
+        vae = manager._load_component(AutoencoderKL, "vae-fp16", "", VAE_FP16_REPO)
+
+    settings.vae_tiling = "never"
+    tiling = AutoTiledVae(vae)
+    print(f"\n⏱️  VAE on {device} ({dtype}), tile {settings.vae_tile_size}px, overlap {TILE_OVERLAP:.0%}")
+
+    def run(fn):
+        if device == "cuda":
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
+        synchronize(device)
+        start = time.perf_counter()
+        try:
+            with torch.inference_mode():
+                output = fn()
+        except torch.cuda.OutOfMemoryError:
+            return None, None, None
+        synchronize(device)
+        peak_mb = torch.cuda.max_memory_allocated() / 1024**2 if device == "cuda" else None
+        return output, (time.perf_counter() - start) * 1000, peak_mb
+
+    def describe(label, elapsed_ms, peak_mb):
+        if elapsed_ms is None:
+            return f"  {label:<28} out of memory"
+        peak = f", peak {peak_mb:.0f}MB" if peak_mb is not None else ""
+        return f"  {label:<28} {elapsed_ms:8.0f}ms{peak}"
+
+    for resolution in args.resolutions:
+        width, height = parse_resolution(resolution)
+        if args.image:
+            image = Image.open(args.image).convert("RGB").resize((width, height), Image.LANCZOS)
+            pixels = torch.from_numpy(np.array(image)).permute(2, 0, 1)[None].float() / 127.5 - 1
+        else:
+            # Smooth synthetic image: seams show up clearly against gradients
+            y, x = torch.meshgrid(torch.linspace(-1, 1, height), torch.linspace(-1, 1, width), indexing="ij")
+            pixels = torch.stack([x, y, torch.sin(3 * x) * torch.cos(3 * y)])[None]
+        pixels = pixels.to(device=device, dtype=dtype)
+
+        print(f"\n  {width}x{height}")
+        results = {}
+        for mode in ("never", "always"):
+            settings.vae_tiling = mode
+            label = "untiled" if mode == "never" else "tiled"
+            latents, encode_ms, encode_peak = run(lambda: vae.encode(pixels).latent_dist.mode())
+            print(describe(f"{label} encode", encode_ms, encode_peak))
+            if latents is None:
+                continue
+            decoded, decode_ms, decode_peak = run(lambda: vae.decode(latents, return_dict=False)[0])
+            print(describe(f"{label} decode", decode_ms, decode_peak))
+            results[label] = (latents, decoded)
+
+        if "untiled" in results and "tiled" in results and results["untiled"][1] is not None:
+            reference, tiled = results["untiled"][1].float(), results["tiled"][1].float()
+            mse = torch.mean(((reference - tiled) / 2) ** 2).item()
+            psnr = 10 * math.log10(1 / mse) if mse > 0 else float("inf")
+            latent_error = ((results["tiled"][0] - results["untiled"][0]).float().norm()
+                            / results["untiled"][0].float().norm()).item()
+            print(f"  {'tiled vs untiled':<28} decode PSNR {psnr:.1f}dB, max abs {(reference - tiled).abs().max().item():.3f}, "
+                  f"encode relative error {latent_error:.4f}")
+
+    tiling.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jhakaas worker pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="Eager vs compiled per-step latency")
+    compile_parser.add_argument("--tiny", action="store_true", help="Use a toy SDXL-shaped UNet instead of the real engine")
+    compile_parser.add_argument("--device", default="cuda", choices=["cuda", "cpu"], help="Device for --tiny")
+    compile_parser.add_argument("--engine", default="instantid", choices=["instantid", "ip_adapter"])
+    compile_parser.add_argument("--steps", type=int, default=20, help="Timed steps per bucket")
+
+    tiers_parser = subparsers.add_parser("tiers", help="Latency and identity similarity per quality tier")
+    tiers_parser.add_argument("--image", required=True, help="Local face image")
+    tiers_parser.add_argument("--engine", default="instantid", choices=["instantid", "ip_adapter"])
+    tiers_parser.add_argument("--style", default="natural")
+    tiers_parser.add_argument("--prompt", default="high quality portrait")
+    tiers_parser.add_argument("--runs", type=int, default=3, help="Timed runs per tier")
+
+    buckets_parser = subparsers.add_parser("buckets", help="Latency per resolution bucket")
+    buckets_parser.add_argument("--engine", default="instantid", choices=["instantid", "ip_adapter"])
+    buckets_parser.add_argument("--steps", type=int, default=15, help="Inference steps per generation")
+
+    quant_parser = subparsers.add_parser("quant", help="fp16 vs weight-only int8 UNet/ControlNet")
+    quant_parser.add_argument("--tiny", action="store_true", help="Use a toy SDXL-shaped UNet (quantized in memory)")
+    quant_parser.add_argument("--device", default="cuda", choices=["cuda", "cpu"], help="Device for --tiny")
+    quant_parser.add_argument("--steps", type=int, default=20, help="Timed steps for --tiny")
+    quant_parser.add_argument("--image", help="Local face image (real engine)")
+    quant_parser.add_argument("--engine", default="instantid", choices=["instantid", "ip_adapter"])
+    quant_parser.add_argument("--style", default="natural")
+    quant_parser.add_argument("--prompt", default="high quality portrait")
+    quant_parser.add_argument("--runs", type=int, default=3, help="Timed runs per precision")
+
+    throughput_parser = subparsers.add_parser("throughput", help="End-to-end images/hour per tier and size")
+    throughput_parser.add_argument("--image", required=True, help="Local face image")
+    throughput_parser.add_argument("--engine", default="instantid", choices=["instantid", "ip_adapter"])
+    throughput_parser.add_argument("--style", default="natural")
+    throughput_parser.add_argument("--prompt", default="high quality portrait")
+    throughput_parser.add_argument("--quality", nargs="+", default=["fast", "standard"], choices=["fast", "standard", "best"])
+    throughput_parser.add_argument("--output-size", nargs="+", default=["preview", "full"], choices=["preview", "full"])
+    throughput_parser.add_argument("--runs", type=int, default=3, help="Timed runs per combination")
+
+    attention_parser = subparsers.add_parser("attention", help="InstantID attention backends: step latency, peak memory")
+    attention_parser.add_argument("--tiny", action="store_true", help="Use a toy SDXL-shaped UNet with InstantID processors")
+    attention_parser.add_argument("--device", default="cuda", choices=["cuda", "cpu"], help="Device for --tiny")
+    attention_parser.add_argument("--resolution", default="1024x1024")
+    attention_parser.add_argument("--steps", type=int, default=10, help="Timed steps per backend")
+    attention_parser.add_argument("--backends", nargs="+", default=["math", "xformers", "sdpa"],
+                                  choices=["math", "xformers", "sdpa"], help="First is the drift reference")
+
+    kv_parser = subparsers.add_parser("attention-kv", help="Text/identity K/V per step vs per request vs across requests")
+    kv_parser.add_argument("--tiny", action="store_true", help="Use a toy SDXL-shaped UNet with InstantID processors")
+    kv_parser.add_argument("--device", default="cuda", choices=["cuda", "cpu"], help="Device for --tiny")
+    kv_parser.add_argument("--resolution", default="1024x1024")
+    kv_parser.add_argument("--steps", type=int, default=10, help="UNet calls (--tiny) or denoising steps per request")
+    kv_parser.add_argument("--repeats", type=int, default=3, help="Timed requests per mode (engine)")
+
+    controlnet_parser = subparsers.add_parser("controlnet", help="ControlNet residual reuse: latency vs identity")
+    controlnet_parser.add_argument("--image", required=True, help="Local face image")
+    controlnet_parser.add_argument("--style", default="natural")
+    controlnet_parser.add_argument("--prompt", default="high quality portrait")
+    controlnet_parser.add_argument("--quality", default="standard", choices=["fast", "standard", "best"])
+    controlnet_parser.add_argument("--intervals", nargs="+", type=int, default=[1, 2, 3], help="First is the baseline")
+    controlnet_parser.add_argument("--runs", type=int, default=3, help="Timed runs per interval")
+
+    unet_cache_parser = subparsers.add_parser("unet-cache", help="Deep UNet feature caching per style")
+    unet_cache_parser.add_argument("--image", required=True, help="Local face image")
+    unet_cache_parser.add_argument("--engine", default="instantid", choices=["instantid", "ip_adapter"])
+    unet_cache_parser.add_argument("--prompt", default="high quality portrait")
+    unet_cache_parser.add_argument("--quality", default="standard", choices=["standard", "best"])
+    unet_cache_parser.add_argument("--interval", type=int, default=3, help="Full UNet every N steps")
+    unet_cache_parser.add_argument("--styles", nargs="+", help="Default: every allowed style")
+    unet_cache_parser.add_argument("--seed", type=int, default=0)
+
+    cfg_parser = subparsers.add_parser("cfg", help="Truncated classifier-free guidance per style")
+    cfg_parser.add_argument("--image", required=True, help="Local face image")
+    cfg_parser.add_argument("--prompt", default="high quality portrait")
+    cfg_parser.add_argument("--quality", default="standard", choices=["standard", "best"])
+    cfg_parser.add_argument("--cutoff", type=float, default=0.7, help="Fraction of steps with guidance")
+    cfg_parser.add_argument("--styles", nargs="+", help="Default: every allowed style")
+    cfg_parser.add_argument("--seed", type=int, default=0)
+    cfg_parser.set_defaults(engine="instantid")
+
+    img2img_parser = subparsers.add_parser("img2img", help="img2img from the input photo vs full denoise per style")
+    img2img_parser.add_argument("--image", required=True, help="Local face image")
+    img2img_parser.add_argument("--prompt", default="high quality portrait")
+    img2img_parser.add_argument("--quality", default="standard", choices=["fast", "standard", "best"])
+    img2img_parser.add_argument("--strength", type=float, default=0.4, help="Fraction of steps run from the photo")
+    img2img_parser.add_argument("--styles", nargs="+", default=["natural", "corporate", "vintage"])
+    img2img_parser.add_argument("--seed", type=int, default=0)
+    img2img_parser.set_defaults(engine="instantid")
+
+    tome_parser = subparsers.add_parser("tome", help="Self-attention token merging per style")
+    tome_parser.add_argument("--image", required=True, help="Local face image")
+    tome_parser.add_argument("--engine", default="instantid", choices=["instantid", "ip_adapter"])
+    tome_parser.add_argument("--prompt", default="high quality portrait")
+    tome_parser.add_argument("--quality", default="standard", choices=["fast", "standard", "best"])
+    tome_parser.add_argument("--ratio", type=float, default=0.3, help="Fraction of tokens merged")
+    tome_parser.add_argument("--no-protect-face", action="store_true", help="Allow merging inside the face box")
+    tome_parser.add_argument("--styles", nargs="+", help="Default: every allowed style")
+    tome_parser.add_argument("--seed", type=int, default=0)
+
+    faces_parser = subparsers.add_parser("faces", help="Multi-face generation cost and identity per face count")
+    faces_parser.add_argument("--image", required=True, help="Local group photo")
+    faces_parser.add_argument("--style", default="couple_aesthetic")
+    faces_parser.add_argument("--prompt", default="group portrait")
+    faces_parser.add_argument("--quality", default="standard", choices=["fast", "standard", "best"])
+    faces_parser.add_argument("--faces", type=int, nargs="+", default=[1, 2, 3, 4], help="Face counts to keep")
+    faces_parser.add_argument("--runs", type=int, default=2, help="Timed runs per face count")
+
+    crop_parser = subparsers.add_parser("crop", help="Whole photo vs face-region crop with paste-back")
+    crop_parser.add_argument("--image", required=True, help="Local large or wide photo with a face")
+    crop_parser.add_argument("--style", default="natural")
+    crop_parser.add_argument("--prompt", default="high quality portrait")
+    crop_parser.add_argument("--quality", default="standard", choices=["fast", "standard", "best"])
+    crop_parser.add_argument("--runs", type=int, default=3, help="Timed runs per mode")
+
+    batch_parser = subparsers.add_parser("batch", help="Batched vs sequential multi-face throughput")
+    batch_parser.add_argument("--images", nargs="+", required=True, help="Local face images, one job each")
+    batch_parser.add_argument("--style", default="natural")
+    batch_parser.add_argument("--prompt", default="high quality portrait")
+    batch_parser.add_argument("--quality", default="standard", choices=["fast", "standard", "best"])
+    batch_parser.add_argument("--runs", type=int, default=3, help="Timed runs per mode")
+
+    vae_parser = subparsers.add_parser("vae", help="Tiled vs untiled VAE memory, latency and fidelity")
+    vae_parser.add_argument("--tiny", action="store_true", help="Use a small randomly initialised VAE")
+    vae_parser.add_argument("--device", default="cuda", choices=["cuda", "cpu"], help="Device for --tiny")
+    vae_parser.add_argument("--image", help="Local image to encode/decode (default: synthetic gradients)")
+    vae_parser.add_argument("--resolutions", nargs="+", default=["1024x1024", "1536x1536", "2048x2048"])
+
+    args = parser.parse_args()
+    if args.benchmark == "compile":
+        if args.tiny:
+            benchmark_compile_tiny(args)
+        else:
+            benchmark_compile_engine(args)
+    elif args.benchmark == "tiers":
+        benchmark_tiers(args)
+    elif args.benchmark == "buckets":
+        benchmark_buckets(args)
+    elif args.benchmark == "crop":
+        benchmark_crop(args)
+    elif args.benchmark == "vae":
+        benchmark_vae(args)
+    elif args.benchmark == "throughput":
+        benchmark_throughput(args)
+    elif args.benchmark == "attention":
+        benchmark_attention(args)
+    elif args.benchmark == "attention-kv":
+        benchmark_attention_kv(args)
+    elif args.benchmark == "controlnet":
+        benchmark_controlnet(args)
+    elif args.benchmark == "img2img":
+        benchmark_img2img(args)
+    elif args.benchmark == "unet-cache":
+        benchmark_unet_cache(args)
+    elif args.benchmark == "cfg":
+        benchmark_cfg(args)
+    elif args.benchmark == "tome":
+        benchmark_tome(args)
+    elif args.benchmark == "faces":
+        benchmark_faces(args)
+    elif args.benchmark == "batch":
+        benchmark_batch(args)
+    elif args.benchmark == "quant":
+        if args.tiny:
+            benchmark_quant_tiny(args)
+        elif not args.image:
+            parser.error("quant needs --image unless --tiny is given")
+        else:
+            benchmark_quant_engine(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Resolution bucket selection (src/buckets.py)"""
+import pytest
+from PIL import Image
+
+from src.buckets import fit_to_bucket, select_bucket
+
+
+def test_exact_aspect_selects_its_bucket():
+    assert select_bucket(832, 1216) == (832, 1216)
+    assert select_bucket(2048, 2048, "preview") == (768, 768)
+
+
+def test_aspect_boundary_between_square_and_portrait():
+    # 1024x1024 and 896x1152 are equally far from an aspect of ~0.8819 in log space
+    assert select_bucket(882, 1000) == (1024, 1024)
+    assert select_bucket(881, 1000) == (896, 1152)
+    assert select_bucket(1000, 881) == (1152, 896)
+
+
+def test_extreme_aspect_uses_widest_bucket():
+    assert select_bucket(4000, 1000) == (1344, 768)
+    assert select_bucket(1000, 4000, "preview") == (576, 1024)
+
+
+def test_unknown_output_size():
+    with pytest.raises(ValueError):
+        select_bucket(1024, 1024, "poster")
+
+
+def test_fit_to_bucket_crops_to_bucket_size():
+    assert fit_to_bucket(Image.new("RGB", (1200, 800))).size == (1216, 832)
+
+
+def test_fit_to_bucket_keeps_image_already_at_bucket():
+    image = Image.new("RGB", (1024, 1024))
+    assert fit_to_bucket(image) is image
@@ -0,0 +1,60 @@
+"""Face-region crop geometry and paste-back (src/face_crop.py)"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.face_crop import face_crop_region, faces_in_crop, paste_back
+
+
+def test_region_centred_on_face():
+    region, bucket = face_crop_region([[1900, 1400, 2100, 1600]], 4000, 3000, "full", 2.5)
+    assert region == (1750, 1250, 2250, 1750)
+    assert bucket == (1024, 1024)
+
+
+def test_region_takes_bucket_aspect():
+    region, bucket = face_crop_region([[1000, 1000, 1100, 1300]], 4000, 3000, "full", 2.5)
+    assert bucket == (768, 1344)
+    assert region == (836, 775, 1264, 1525)
+    width, height = region[2] - region[0], region[3] - region[1]
+    assert width / height == pytest.approx(bucket[0] / bucket[1], abs=0.01)
+
+
+def test_region_clamped_at_photo_border():
+    region, _ = face_crop_region([[0, 0, 200, 200]], 4000, 3000, "full", 2.5)
+    assert region == (0, 0, 500, 500)
+    region, _ = face_crop_region([[3800, 2800, 4000, 3000]], 4000, 3000, "full", 2.5)
+    assert region == (3500, 2500, 4000, 3000)
+
+
+def test_region_covers_every_face():
+    region, _ = face_crop_region([[1000, 1000, 1200, 1200], [1600, 1100, 1800, 1300]], 4000, 3000, "full", 1.5)
+    assert region[0] <= 1000 and region[1] <= 1000 and region[2] >= 1800 and region[3] >= 1300
+
+
+def test_large_face_falls_back_to_whole_image():
+    # The expanded region is shrunk to the whole photo, which is over MAX_REGION_FRACTION
+    assert face_crop_region([[100, 100, 900, 900]], 1000, 1000, "full", 2.5) is None
+
+
+def test_faces_mapped_into_crop():
+    face = SimpleNamespace(bbox=np.array([1900, 1400, 2100, 1600, 0.9]), kps=np.array([[2000.0, 1500.0]]))
+    mapped, = faces_in_crop([face], (1750, 1250, 2250, 1750), (1024, 1024))
+    np.testing.assert_allclose(mapped.bbox, [307.2, 307.2, 716.8, 716.8])
+    np.testing.assert_allclose(mapped.kps, [[512.0, 512.0]])
+    assert face.kps[0, 0] == 2000.0
+
+
+def test_paste_back_feathers_only_interior_edges():
+    original = Image.new("RGB", (400, 300))
+    generated = Image.new("RGB", (50, 50), (255, 255, 255))
+    output = paste_back(original, generated, (0, 0, 100, 100), 0.1)
+
+    assert output.size == original.size
+    assert output.getpixel((0, 0)) == (255, 255, 255)  # Photo border: no blending
+    assert output.getpixel((50, 50)) == (255, 255, 255)
+    assert output.getpixel((99, 99))[0] < 30  # Interior edge ramps towards the original
+    assert output.getpixel((200, 200)) == (0, 0, 0)
+    assert original.getpixel((0, 0)) == (0, 0, 0)
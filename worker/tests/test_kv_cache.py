@@ -0,0 +1,74 @@
+"""Cross-request text K/V cache LRU and byte budget (src/kv_cache.py)"""
+from src.kv_cache import MB, TextKVCache
+
+
+class FakeTensor:
+    """Only what the cache reads from a tensor: its size in bytes."""
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def numel(self):
+        return self.nbytes
+
+    def element_size(self):
+        return 1
+
+
+def entry(nbytes):
+    """One processor with a single (key, value) pair holding nbytes in total."""
+    return {"down.0.attn2": {("text", 2): (FakeTensor(nbytes // 2), FakeTensor(nbytes // 2))}}
+
+
+def test_fills_to_the_byte_cap_without_evicting():
+    cache = TextKVCache(max_mb=1)
+    cache.put("a", entry(MB // 2))
+    cache.put("b", entry(MB // 2))
+    assert list(cache.entries) == ["a", "b"]
+    assert cache.bytes == MB
+    assert cache.stats["evictions"] == 0
+
+
+def test_evicts_least_recently_used_at_the_cap():
+    cache = TextKVCache(max_mb=1)
+    cache.put("a", entry(MB // 2))
+    cache.put("b", entry(MB // 2))
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    cache.put("c", entry(MB // 2))
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.bytes == MB
+    assert cache.stats["evictions"] == 1
+
+
+def test_evicts_as_many_entries_as_needed():
+    cache = TextKVCache(max_mb=1)
+    for key in "abcd":
+        cache.put(key, entry(MB // 4))
+    cache.put("e", entry(MB * 3 // 4))
+    assert list(cache.entries) == ["d", "e"]
+    assert cache.stats["evictions"] == 3
+
+
+def test_entry_larger_than_budget_is_not_cached():
+    cache = TextKVCache(max_mb=1)
+    cache.put("a", entry(MB // 2))
+    cache.put("big", entry(2 * MB))
+    assert list(cache.entries) == ["a"]
+    assert cache.stats["evictions"] == 0
+
+
+def test_replacing_a_key_does_not_double_count():
+    cache = TextKVCache(max_mb=1)
+    cache.put("a", entry(MB // 2))
+    cache.put("a", entry(MB // 4))
+    assert cache.bytes == MB // 4
+    assert len(cache.entries) == 1
+
+
+def test_hits_misses_and_clear():
+    cache = TextKVCache(max_mb=1)
+    assert cache.get("a") is None
+    cache.put("a", entry(MB // 2))
+    assert cache.get("a") is not None
+    cache.clear("lora_changed")
+    assert cache.summary() == {"entries": 0, "size_mb": 0, "budget_mb": 1, "hits": 1, "misses": 1, "evictions": 0}
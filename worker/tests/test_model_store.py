@@ -0,0 +1,89 @@
+"""Manifest resolution and weight selection (src/model_store.py)"""
+import json
+import os
+
+import pytest
+
+from src.model_store import MANIFEST_VERSION, ModelStore, ModelStoreError
+
+UNET_FILES = {
+    "unet/config.json": b"{}",
+    "unet/diffusion_pytorch_model.safetensors": b"fp32 weights",
+    "unet/diffusion_pytorch_model.bin": b"pickled weights",
+}
+
+
+def make_store(tmp_path, files, **kwargs):
+    """A mount with files written under component "sdxl-base" and listed in its manifest."""
+    mount = tmp_path / "mount"
+    for relpath, data in files.items():
+        path = mount / "sdxl-base" / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "components": {
+            "sdxl-base": {"files": {relpath: {"size": len(data), "md5": None} for relpath, data in files.items()}},
+        },
+    }
+    (mount / "manifest.json").write_text(json.dumps(manifest))
+    kwargs.setdefault("stage", False)
+    return ModelStore(str(mount), str(tmp_path / "local"), **kwargs)
+
+
+def test_missing_variant_falls_back_to_default_weights():
+    files = ModelStore._select_weights(sorted(UNET_FILES), "unet", "diffusion_pytorch_model", "fp16")
+    assert files == ["unet/config.json", "unet/diffusion_pytorch_model.safetensors"]
+
+
+def test_variant_preferred_when_listed():
+    listed = sorted([*UNET_FILES, "unet/diffusion_pytorch_model.fp16.safetensors"])
+    files = ModelStore._select_weights(listed, "unet", "diffusion_pytorch_model", "fp16")
+    assert files == ["unet/config.json", "unet/diffusion_pytorch_model.fp16.safetensors"]
+
+
+def test_no_safetensors_weights():
+    with pytest.raises(ModelStoreError):
+        ModelStore._select_weights(["unet/config.json", "unet/diffusion_pytorch_model.bin"],
+                                   "unet", "diffusion_pytorch_model", None)
+
+
+def test_direct_mode_resolves_on_the_mount(tmp_path):
+    store = make_store(tmp_path, UNET_FILES)
+    path = store.path("sdxl-base", "unet", weight_name="diffusion_pytorch_model", variant="fp16")
+    assert path == os.path.join(tmp_path, "mount", "sdxl-base", "unet")
+    assert not (tmp_path / "local").exists()
+
+
+def test_files_are_resolved_by_manifest_key(tmp_path):
+    store = make_store(tmp_path, UNET_FILES)
+    assert store.files("sdxl-base", "unet/") == sorted(UNET_FILES)
+    assert store.files("sdxl-base", "vae") == []
+    assert not store.has("instantid")
+    with pytest.raises(ModelStoreError, match="not listed in manifest"):
+        store.path("instantid")
+    with pytest.raises(ModelStoreError):
+        store.file("sdxl-base", "unet/missing.json")
+
+
+def test_missing_manifest(tmp_path):
+    store = ModelStore(str(tmp_path), str(tmp_path / "local"), stage=False)
+    assert not store.available
+    with pytest.raises(ModelStoreError, match="manifest not found"):
+        store.path("sdxl-base")
+
+
+def test_size_mismatch_is_rejected(tmp_path):
+    store = make_store(tmp_path, UNET_FILES)
+    (tmp_path / "mount" / "sdxl-base" / "unet" / "config.json").write_bytes(b"{ }")
+    with pytest.raises(ModelStoreError, match="Size mismatch"):
+        store.file("sdxl-base", "unet/config.json")
+
+
+def test_staged_files_are_deleted_on_release(tmp_path):
+    store = make_store(tmp_path, UNET_FILES, stage=True, allow_tmpfs=True)
+    path = store.file("sdxl-base", "unet/config.json")
+    assert path == os.path.join(tmp_path, "local", "sdxl-base", "unet", "config.json")
+    assert open(path, "rb").read() == b"{}"
+    store.release()
+    assert not os.path.exists(path)